@@ -0,0 +1,5 @@
+# EMAV - Benchmark suite
+# Generates synthetic Testlab-style files and times the real EMAV stages on
+# them without a display. Run from the EMAV folder with:
+#
+#   python -m benchmarks --records 2000 --points 4096
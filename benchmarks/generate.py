@@ -0,0 +1,142 @@
+# EMAV - Synthetic Testlab-style files for benchmarks
+# Files are reproducible for a given seed so that timings from different
+# EMAV versions are comparable.
+import numpy as np
+import scipy.io as sio
+import emav_unv
+
+FORMATS = ('unv-ascii', 'unv-binary', 'unv-ascii-151', 'unv-binary-151', 'mat-v5', 'mat-v73')
+
+F_MAX = 4000.0
+# Response nodes per reference in the generated node layout
+NODES_PER_REFERENCE = 200
+
+
+def frequency_axis(n_points):
+    return np.linspace(0.0, F_MAX, n_points)
+
+
+def synthetic_frf(x, rng, n_modes=8):
+    """A receptance-like FRF made of n_modes lightly damped modes at random frequencies."""
+    s = 2j * np.pi * x
+    frf = np.zeros(len(x), dtype=complex)
+    for f_n in np.sort(rng.uniform(0.02, 0.95, n_modes)) * F_MAX:
+        w_n = 2 * np.pi * f_n
+        zeta = rng.uniform(0.005, 0.03)
+        frf += rng.uniform(0.5, 2.0) * 1e4 / (s ** 2 + 2 * zeta * w_n * s + w_n ** 2)
+    return frf
+
+
+def record_points(i):
+    """(rsp_node, rsp_dir, ref_node, ref_dir) of the i-th generated record."""
+    return (i % NODES_PER_REFERENCE + 1, i % 3 + 1, i // NODES_PER_REFERENCE + 1, 3)
+
+
+# --- UNV ---
+
+def _header_151():
+    lines = ['    -1', '   151', 'EMAV benchmark model', 'Synthetic Testlab export',
+             'EMAV benchmarks', '01-Jan-24 00:00:00', '01-Jan-24 00:00:00',
+             'EMAV benchmarks', '01-Jan-24 00:00:00', '    -1']
+    return ''.join(f'{line:<80}'.rstrip() + '\n' for line in lines)
+
+
+def _record_58(name, points, x, data, ordinate_label='NONE'):
+    """A dataset 58 record dict for emav_unv.dump_unv58()."""
+    rsp_node, rsp_dir, ref_node, ref_dir = points
+    return {
+        'id1': name, 'id3': '01-Jan-24 00:00:00', 'func_type': 4,
+        'rsp_node': rsp_node, 'rsp_dir': rsp_dir, 'ref_node': ref_node, 'ref_dir': ref_dir,
+        'abscissa_spacing': 1, 'abscissa_spec_data_type': 18, 'abscissa_axis_lab': 'Frequency', 'abscissa_axis_units_lab': 'Hz',
+        'ordinate_spec_data_type': 12, 'ordinate_axis_lab': ordinate_label, 'orddenom_spec_data_type': 13,
+        'x': x, 'data': data,
+    }
+
+
+def write_unv(path, n_records, n_points, binary=False, header_151=False, seed=0):
+    """Writes n_records complex FRFs of n_points each as dataset 58 (ASCII) or 58b (binary)."""
+    rng = np.random.default_rng(seed)
+    x = frequency_axis(n_points)
+    records = (_record_58(f'Synthetic FRF {i + 1}', record_points(i), x, synthetic_frf(x, rng)) for i in range(n_records))
+    with open(path, 'wb', buffering=emav_unv.WRITE_BUFFER_SIZE) as f:
+        if header_151:
+            f.write(_header_151().encode('ascii'))
+        emav_unv.dump_unv58(f, records, binary=binary)
+
+
+def write_reconstructed(path, n_points, seed=0):
+    """Writes a reconstructed-style file: dataset 151 followed by one linear-amplitude dataset 58."""
+    x = frequency_axis(n_points)
+    amplitude = np.abs(synthetic_frf(x, np.random.default_rng(seed)))
+    with open(path, 'wb') as f:
+        f.write(_header_151().encode('ascii'))
+        emav_unv.dump_unv58(f, [_record_58('Reconstructed FRF', (1, 3, 1, 3), x, amplitude, ordinate_label='AMPLITUDE')])
+
+
+# --- MAT ---
+
+def write_mat_v5(path, n_records, n_points, seed=0):
+    """Writes a compressed v5/v7 .mat file with an FRFs struct array (Name, X_Data, Y_Data, X_Label, X_Units)."""
+    rng = np.random.default_rng(seed)
+    x = frequency_axis(n_points)
+    frfs = np.zeros((n_records,), dtype=[(name, object) for name in ('Name', 'X_Data', 'Y_Data', 'X_Label', 'X_Units')])
+    for i in range(n_records):
+        rsp_node, rsp_dir, ref_node, ref_dir = record_points(i)
+        frfs[i] = (f'FRF {rsp_node}:+{"XYZ"[rsp_dir - 1]}/{ref_node}:+Z', x, synthetic_frf(x, rng), 'Freq', 'Hz')
+    sio.savemat(path, {'FRFs': frfs}, do_compression=True)
+
+
+def _matlab_char(group, name, text):
+    dataset = group.create_dataset(name, data=np.array([ord(c) for c in text], dtype='<u2').reshape(-1, 1))
+    dataset.attrs['MATLAB_class'] = np.bytes_('char')
+    return dataset
+
+
+def _matlab_row(group, name, values):
+    """Stores a MATLAB 1xN double row vector (HDF5 shape N x 1), complex as a real/imag compound."""
+    values = np.asarray(values).reshape(-1, 1)
+    if np.iscomplexobj(values):
+        compound = np.empty(values.shape, dtype=[('real', '<f8'), ('imag', '<f8')])
+        compound['real'] = values.real
+        compound['imag'] = values.imag
+        values = compound
+    dataset = group.create_dataset(name, data=values, chunks=True)
+    dataset.attrs['MATLAB_class'] = np.bytes_('double')
+    return dataset
+
+
+def write_mat_v73(path, n_records, n_points, seed=0):
+    """Writes a MATLAB v7.3 (HDF5) file laid out like MATLAB's, with an FRFs struct array."""
+    import h5py
+    rng = np.random.default_rng(seed)
+    x = frequency_axis(n_points)
+    with h5py.File(path, 'w', userblock_size=512) as f:
+        refs = f.create_group('#refs#')
+        fields = {name: [] for name in ('Name', 'X_Data', 'Y_Data', 'X_Label', 'X_Units')}
+        for i in range(n_records):
+            rsp_node, rsp_dir, ref_node, ref_dir = record_points(i)
+            prefix = f'r{i}_'
+            fields['Name'].append(_matlab_char(refs, prefix + 'name', f'FRF {rsp_node}:+{"XYZ"[rsp_dir - 1]}/{ref_node}:+Z').ref)
+            fields['X_Data'].append(_matlab_row(refs, prefix + 'x', x).ref)
+            fields['Y_Data'].append(_matlab_row(refs, prefix + 'y', synthetic_frf(x, rng)).ref)
+            fields['X_Label'].append(_matlab_char(refs, prefix + 'xl', 'Freq').ref)
+            fields['X_Units'].append(_matlab_char(refs, prefix + 'xu', 'Hz').ref)
+        group = f.create_group('FRFs')
+        group.attrs['MATLAB_class'] = np.bytes_('struct')
+        for name, values in fields.items():
+            group.create_dataset(name, data=np.array(values, dtype=h5py.ref_dtype).reshape(-1, 1))
+    with open(path, 'r+b') as f:
+        header = b'MATLAB 7.3 MAT-file, Platform: EMAV benchmarks, HDF5 schema 1.00 .'
+        f.write(header.ljust(116) + b'\x00' * 8 + b'\x00\x02IM')
+
+
+def generate(fmt, path, n_records, n_points, seed=0):
+    """Writes a synthetic Testlab file of the given FORMATS entry."""
+    if fmt.startswith('unv-'):
+        write_unv(path, n_records, n_points, binary='binary' in fmt, header_151=fmt.endswith('-151'), seed=seed)
+    elif fmt == 'mat-v5':
+        write_mat_v5(path, n_records, n_points, seed=seed)
+    elif fmt == 'mat-v73':
+        write_mat_v73(path, n_records, n_points, seed=seed)
+    else:
+        raise ValueError(f"Unknown benchmark format: {fmt}")
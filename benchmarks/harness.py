@@ -0,0 +1,215 @@
+# EMAV - Headless application for benchmarks
+# Runs the real EMAVApp methods with stub widgets and an Agg canvas, so the
+# stages can be timed without a display.
+import os
+import threading
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import emav_app
+import emav_library
+import emav_watch
+
+
+class BenchmarkError(RuntimeError):
+    pass
+
+
+class StubWidget:
+    """Accepts and ignores any widget call (config, pack, ...)."""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class StubVar:
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class StubTree:
+    """The parts of ttk.Treeview used by EMAV, kept in plain dicts."""
+    def __init__(self):
+        self.items = {'': {'text': '', 'children': []}}
+        self.counter = 0
+        self.focused = ''
+        self.selected = ()
+
+    def insert(self, parent, index, iid=None, text='', **options):
+        if iid is None:
+            self.counter += 1
+            iid = f'I{self.counter:06X}'
+        if iid in self.items:
+            raise BenchmarkError(f"Item {iid} already exists")
+        self.items[iid] = dict(options, text=text, parent=parent, children=[])
+        if index == 'end':
+            self.items[parent]['children'].append(iid)
+        else:
+            self.items[parent]['children'].insert(int(index), iid)
+        return iid
+
+    def item(self, iid, option=None, **options):
+        if options:
+            self.items[iid].update(options)
+            return None
+        return dict(self.items[iid]) if option is None else self.items[iid].get(option)
+
+    def get_children(self, iid=''):
+        return tuple(self.items[iid]['children'])
+
+    def delete(self, *iids):
+        for iid in iids:
+            for child in list(self.items[iid]['children']):
+                self.delete(child)
+            self.items[self.items[iid]['parent']]['children'].remove(iid)
+            del self.items[iid]
+
+    def destroy(self):
+        pass
+
+    def exists(self, iid):
+        return iid in self.items
+
+    def parent(self, iid):
+        return self.items[iid]['parent']
+
+    def focus(self, iid=None):
+        if iid is None:
+            return self.focused
+        self.focused = iid
+
+    def selection_set(self, *iids):
+        self.selected = tuple(iids)
+
+    def selection(self):
+        return self.selected
+
+    def see(self, iid):
+        pass
+
+
+class StubDialogs:
+    """Replaces tkinter's messagebox and filedialog: warnings fail the benchmark, saves go to save_path."""
+    def __init__(self):
+        self.save_path = None
+
+    def showinfo(self, title, message, **options):
+        pass
+
+    def showwarning(self, title, message, **options):
+        raise BenchmarkError(f"{title}: {message}")
+
+    showerror = showwarning
+
+    def asksaveasfilename(self, **options):
+        return self.save_path
+
+    def askopenfilename(self, **options):
+        return self.save_path
+
+    def askdirectory(self, **options):
+        return self.save_path
+
+
+def make_app():
+    """Returns (app, dialogs): an EMAVApp without Tk, and the dialog stub it reports to."""
+    dialogs = StubDialogs()
+    emav_app.messagebox = dialogs
+    emav_app.filedialog = dialogs
+
+    app = emav_app.EMAVApp.__new__(emav_app.EMAVApp)
+    app.root = StubWidget()
+    app.init_state()
+    for name in ('file_label', 'load_progress', 'cancel_load_button', 'save_button', 'match_button',
+                 'open_testlab_button', 'open_folder_button', 'open_recon_button', 'filter_status'):
+        setattr(app, name, StubWidget())
+    app.log_scale_var = StubVar(True)
+    app.overlay_var = StubVar(False)
+    app.overlay_envelope_var = StubVar(True)
+    app.overlay_recon_var = StubVar(True)
+    app.filter_var = StubVar('')
+    app.watch_var = StubVar(False)
+    app.tree = StubTree()
+    app.create_tree = lambda: setattr(app, 'tree', StubTree())
+    app.create_testlab_figure()
+    app.canvas_testlab = FigureCanvasAgg(app.fig_testlab)
+    app.connect_testlab_canvas()
+    app.canvas_testlab.draw()
+    return app, dialogs
+
+
+def reset_testlab(app, filepaths):
+    """
+    Clears the tree and records as load_testlab_file or load_testlab_folder
+    do before parsing filepaths (a file, or a list of files), bypassing the cache.
+    """
+    app.tree = StubTree()
+    app.clear_tree_model()
+    app.selected_record_iid = None
+    app.match_index = None
+    app.prefetcher.clear()
+    app.library.close()
+    app.library = emav_library.Library()
+    app.library_failures = []
+    if isinstance(filepaths, str):
+        app.current_testlab_filepath = filepaths
+        app.library.add(filepaths, emav_library.file_type(filepaths))
+        return
+    app.current_testlab_filepath = os.path.dirname(filepaths[0])
+    for filepath in filepaths:
+        app.library.add(filepath, emav_library.file_type(filepath))
+    for testlab_file in app.library.files:
+        app.get_tree_file_node(testlab_file)
+
+
+def drain(app):
+    """Returns the (kind, payload) messages queued by a worker, in order."""
+    messages = []
+    while not app.ui_queue.empty():
+        _, _, kind, payload = app.ui_queue.get_nowait()
+        messages.append((kind, payload))
+    return messages
+
+
+def parse_testlab(app, filepath):
+    """Runs the load_testlab_file worker synchronously, bypassing the cache; returns its messages."""
+    app.load_id += 1
+    app.testlab_load_worker(app.load_id, filepath, app.library.files[0].type, None, threading.Event())
+    messages = drain(app)
+    for kind, payload in messages:
+        if kind == 'error':
+            raise BenchmarkError(f"Parsing {filepath} failed: {payload[0]}")
+    return messages
+
+
+def append_testlab(app):
+    """
+    Runs one poll of watch mode synchronously: the datasets appended to the
+    watched file are indexed and added to the tree. Returns the messages.
+    """
+    watcher = app.file_watcher
+    if watcher.check() != emav_watch.GROWN:
+        raise BenchmarkError(f"{watcher.path} has not grown")
+    testlab_file = app.library.files[0]
+    app.load_id += 1
+    app.testlab_append_worker(app.load_id, testlab_file.path, watcher.offset, len(testlab_file.data), threading.Event())
+    messages = drain(app)
+    for kind, payload in messages:
+        if kind == 'append_error':
+            raise BenchmarkError(f"Scanning {testlab_file.path} failed: {payload[0]}")
+        app.handle_testlab_message(kind, payload)
+    return messages
+
+
+def parse_library(app):
+    """Runs the load_testlab_folder worker synchronously on the files of the library, bypassing the cache; returns its messages."""
+    app.load_id += 1
+    app.library_load_worker(app.load_id, list(app.library.files), None, threading.Event())
+    messages = drain(app)
+    for kind, payload in messages:
+        if kind in ('error', 'file_error'):
+            raise BenchmarkError(f"Parsing the library failed: {payload[-2]}")
+    return messages
@@ -0,0 +1,349 @@
+# EMAV - Benchmark runner
+# Times the EMAV stages on generated files and writes the results as JSON.
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import matplotlib
+import emav_perf
+from benchmarks import generate, harness
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Start-up stages: (imported untimed first, timed import, top-level packages it must not load). The
+# data core is used by scripts without the GUI, and the application imports the plotting
+# modules only once its window is shown.
+STARTUP_STAGES = {
+    'core': ('', 'import emav_core', ('tkinter', 'matplotlib', 'scipy', 'h5py')),
+    'app': ('', 'import emav_app', ('matplotlib', 'scipy', 'h5py')),
+    'plots': ('import emav_app', 'from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg; '
+                                 'from matplotlib.figure import Figure', ()),
+}
+
+
+def measure(fn, repeat, memory=True, setup=None):
+    """
+    Calls fn() repeat times and returns (times, peak_memory_mb, last_result).
+
+    setup() runs before each call and is not timed. Peak memory comes from one
+    extra call under tracemalloc so that tracing does not slow down the timed runs.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return times, peak_mb, result
+
+
+def result_entry(fmt, stage, times, peak_mb, items):
+    return {
+        'format': fmt,
+        'stage': stage,
+        'items': items,
+        'repeat': len(times),
+        'times_s': [round(t, 6) for t in times],
+        'min_s': round(min(times), 6),
+        'median_s': round(statistics.median(times), 6),
+        'per_item_ms': round(1000 * min(times) / items, 4) if items else None,
+        'peak_memory_mb': None if peak_mb is None else round(peak_mb, 3),
+    }
+
+
+def sample_iids(app, count):
+    """Up to count record iids spread evenly over the file."""
+    iids = list(app.record_map)
+    if len(iids) <= count:
+        return iids
+    return [iids[i] for i in np.linspace(0, len(iids) - 1, count).astype(int)]
+
+
+def timed_import(setup, statement):
+    """Runs statement after setup in a fresh interpreter; returns (seconds for statement, top-level packages loaded)."""
+    code = (f"import sys, time\n{setup}\nstart = time.perf_counter()\n{statement}\n"
+            f"print(time.perf_counter() - start)\nprint(' '.join(sorted({{name.split('.')[0] for name in sys.modules}})))")
+    lines = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=REPO_DIR).stdout.splitlines()
+    return float(lines[-2]), set(lines[-1].split())
+
+
+def bench_startup(args):
+    """startup: importing the data core, the application, and the plotting modules the application defers."""
+    results = []
+    for stage, (setup, statement, unwanted) in STARTUP_STAGES.items():
+        times = []
+        for _ in range(args.repeat):
+            seconds, loaded = timed_import(setup, statement)
+            times.append(seconds)
+        loaded = sorted(loaded.intersection(unwanted))
+        if loaded:
+            raise harness.BenchmarkError(f"'{statement}' imports {', '.join(loaded)}")
+        results.append(result_entry('startup', stage, times, None, 1))
+    return results
+
+
+def bench_testlab(app, dialogs, fmt, filepath, args, workdir):
+    results = []
+    harness.reset_testlab(app, filepath)
+
+    # parse: the load_testlab_file worker, from the file to the queued record batches
+    times, peak, messages = measure(lambda: harness.parse_testlab(app, filepath), args.repeat, not args.no_memory,
+                                    setup=lambda: harness.reset_testlab(app, filepath))
+    n_records = max((payload[3] for kind, payload in messages if kind == 'records'), default=0)
+    results.append(result_entry(fmt, 'parse', times, peak, n_records))
+    app.library.files[0].data = next(payload[0] for kind, payload in messages if kind in ('done', 'cancelled'))
+
+    # tree: the UI side of the load, applying every queued batch to the tree and
+    # inserting the items that are visible without expanding anything
+    def clear_tree():
+        app.tree = harness.StubTree()
+        app.clear_tree_model()
+    times, peak, _ = measure(lambda: populate(app, messages), args.repeat, not args.no_memory, setup=clear_tree)
+    results.append(result_entry(fmt, 'tree', times, peak, len(app.record_map)))
+
+    # select: selecting a record until the Testlab plot is drawn
+    iids = sample_iids(app, args.select)
+    if iids:
+        times, peak, _ = measure(lambda: select_all(app, iids), args.repeat, not args.no_memory, setup=app.prefetcher.clear)
+        results.append(result_entry(fmt, 'select', times, peak, len(iids)))
+
+    # overlay: the selection drawn at once in overlay mode
+    overlay_iids = sample_iids(app, args.overlay)
+    if len(overlay_iids) > 1:
+        times, peak, _ = measure(lambda: overlay(app, overlay_iids), args.repeat, not args.no_memory)
+        results.append(result_entry(fmt, 'overlay', times, peak, len(overlay_iids)))
+
+        # overlay export: the overlaid records saved together into one file
+        def export_overlay():
+            dialogs.save_path = os.path.join(workdir, f'overlay-{fmt}.unv')
+            app.overlay_var.set(True)
+            app.overlay_iids = overlay_iids
+            try:
+                app.save_selected_record()
+            finally:
+                app.overlay_var.set(False)
+        times, peak, _ = measure(export_overlay, args.repeat, not args.no_memory)
+        results.append(result_entry(fmt, 'overlay-export', times, peak, len(overlay_iids)))
+
+    # export: Save Selected Testlab Record, with the save dialog answered
+    export_dir = os.path.join(workdir, f'export-{fmt}')
+    os.makedirs(export_dir, exist_ok=True)
+    export_iids = iids[:args.export]
+
+    def export_all():
+        for n, iid in enumerate(export_iids):
+            dialogs.save_path = os.path.join(export_dir, f'record{n}.unv')
+            app.selected_record_iid = iid
+            app.save_selected_record()
+    if export_iids:
+        times, peak, _ = measure(export_all, args.repeat, not args.no_memory)
+        results.append(result_entry(fmt, 'export', times, peak, len(export_iids)))
+
+    app.library.close()
+    return results
+
+
+def bench_watch(app, fmt, filepath, args, workdir):
+    """
+    watch: a copy of the Testlab file is loaded in watch mode, then a tenth of
+    its records is appended to it before each run. A run indexes only the
+    appended datasets and adds them to the tree, keeping the selected record.
+    """
+    watch_path = os.path.join(workdir, f'watch-{fmt}.unv')
+    shutil.copyfile(filepath, watch_path)
+    harness.reset_testlab(app, watch_path)
+    messages = harness.parse_testlab(app, watch_path)
+    populate(app, messages)
+    data = app.library.files[0].data = next(payload[0] for kind, payload in messages if kind == 'done')
+    app.watch_var.set(True)
+    app.start_watching()
+
+    datasets = [dataset for dataset in data if dataset['type'] == 58]
+    n_append = max(len(datasets) // 10, 1)
+    with open(watch_path, 'rb') as f:
+        f.seek(datasets[-n_append]['offset'])
+        chunk = f.read(datasets[-1]['end_offset'] - datasets[-n_append]['offset'])
+    selected = app.selected_record_iid = sample_iids(app, 1)[0]
+    appends = []
+
+    def append():
+        with open(watch_path, 'ab') as f:
+            f.write(chunk)
+        appends.append(len(chunk))
+    try:
+        times, peak, _ = measure(lambda: harness.append_testlab(app), args.repeat, not args.no_memory, setup=append)
+        expected = len(datasets) + n_append * len(appends)
+        if len(app.record_map) != expected or app.selected_record_iid != selected:
+            raise harness.BenchmarkError(f"Watching {watch_path} gave {len(app.record_map)} records, expected {expected}")
+    finally:
+        app.watch_var.set(False)
+        app.stop_watching()
+        app.library.close()
+    return [result_entry(fmt, 'watch', times, peak, n_append)]
+
+
+def populate(app, messages):
+    """Applies the queued record batches to the tree and inserts the items visible without expanding anything."""
+    for kind, payload in messages:
+        if kind == 'records':
+            app.handle_testlab_message(kind, payload)
+    while app.tree_insert_scheduled:
+        app.insert_tree_items()
+
+
+def select_all(app, iids):
+    for iid in iids:
+        app.selected_record_iid = iid
+        app.update_testlab_plots()
+
+
+def overlay(app, iids):
+    app.overlay_var.set(True)
+    app.tree.selection_set(*iids)
+    app.tree.focus(iids[0])
+    try:
+        app.on_tree_select()
+        app.show_selection()
+    finally:
+        app.overlay_var.set(False)
+
+
+def bench_library(app, filepaths, args):
+    """
+    library: the generated Testlab files loaded together as a folder, scanned
+    in parallel by the process pool, then records selected across the files.
+    """
+    results = []
+    times, peak, messages = measure(lambda: harness.parse_library(app), args.repeat, not args.no_memory,
+                                    setup=lambda: harness.reset_testlab(app, filepaths))
+    n_records = max((payload[3] for kind, payload in messages if kind == 'records'), default=0)
+    results.append(result_entry('library', 'parse', times, peak, n_records))
+
+    for kind, payload in messages:
+        if kind == 'file_done':
+            app.handle_testlab_message(kind, payload)
+    populate(app, messages)
+    iids = sample_iids(app, args.select)
+    if iids:
+        times, peak, _ = measure(lambda: select_all(app, iids), args.repeat, not args.no_memory, setup=app.prefetcher.clear)
+        results.append(result_entry('library', 'select', times, peak, len(iids)))
+    app.library.close()
+    return results
+
+
+def bench_reconstructed(app, filepath, args):
+    """reconstructed: the load_reconstructed_file worker, reading past the dataset 151 header."""
+    def load():
+        app.recon_load_id += 1
+        app.reconstructed_load_worker(app.recon_load_id, filepath)
+        kind, payload = harness.drain(app)[-1]
+        if kind != 'done' or not payload[1]:
+            raise harness.BenchmarkError(f"Reading {filepath} failed: {payload}")
+    times, peak, _ = measure(load, args.repeat, not args.no_memory)
+    return [result_entry('reconstructed', 'reconstructed', times, peak, 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=REPO_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description="Times EMAV's start-up imports, and its parse, tree, select, overlay, export, library and "
+                                                 "reconstructed-file stages on synthetic files.")
+    parser.add_argument('--records', type=int, default=1000, help="Records per generated Testlab file.")
+    parser.add_argument('--points', type=int, default=4096, help="Frequency lines per record.")
+    parser.add_argument('--formats', nargs='+', default=list(generate.FORMATS), choices=generate.FORMATS)
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage.")
+    parser.add_argument('--select', type=int, default=20, help="Records selected in the select stage.")
+    parser.add_argument('--overlay', type=int, default=200, help="Records drawn together in the overlay stage.")
+    parser.add_argument('--export', type=int, default=5, help="Records saved in the export stage.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-startup', action='store_true', help="Skip the start-up import stages.")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc run that measures peak memory.")
+    parser.add_argument('--workdir', help="Folder for the generated files (default: a temporary folder).")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated files.")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="JSON results file.")
+    parser.add_argument('--trace', help="Also record the EMAV timing spans and save them as a Chrome trace to this file.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='emav-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    app, dialogs = harness.make_app()
+    emav_perf.recorder.enabled = bool(args.trace)
+    results = [] if args.no_startup else bench_startup(args)
+    testlab_paths = []
+    try:
+        for fmt in args.formats:
+            filepath = os.path.join(workdir, f'testlab-{fmt}-{args.records}x{args.points}' + ('.mat' if fmt.startswith('mat') else '.unv'))
+            if not os.path.exists(filepath):
+                start = time.perf_counter()
+                generate.generate(fmt, filepath, args.records, args.points, seed=args.seed)
+                print(f"Generated {os.path.basename(filepath)} ({os.path.getsize(filepath) / 1e6:.1f} MB) "
+                      f"in {time.perf_counter() - start:.1f} s")
+            results.extend(bench_testlab(app, dialogs, fmt, filepath, args, workdir))
+            if filepath.endswith('.unv'):
+                results.extend(bench_watch(app, fmt, filepath, args, workdir))
+            testlab_paths.append(filepath)
+        if len(testlab_paths) > 1:
+            results.extend(bench_library(app, testlab_paths, args))
+
+        recon_path = os.path.join(workdir, f'reconstructed-{args.points}.unv')
+        if not os.path.exists(recon_path):
+            generate.write_reconstructed(recon_path, args.points, seed=args.seed)
+        results.extend(bench_reconstructed(app, recon_path, args))
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'matplotlib': matplotlib.__version__,
+        'config': {'records': args.records, 'points': args.points, 'formats': args.formats,
+                   'repeat': args.repeat, 'select': args.select, 'overlay': args.overlay, 'export': args.export, 'seed': args.seed},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'format':<16}{'stage':<15}{'items':>7}{'min s':>10}{'median s':>10}{'ms/item':>10}{'peak MB':>10}")
+    for r in results:
+        per_item = '' if r['per_item_ms'] is None else f"{r['per_item_ms']:.2f}"
+        peak = '' if r['peak_memory_mb'] is None else f"{r['peak_memory_mb']:.1f}"
+        print(f"{r['format']:<16}{r['stage']:<15}{r['items']:>7}{r['min_s']:>10.3f}{r['median_s']:>10.3f}{per_item:>10}{peak:>10}")
+    print(f"Results written to {args.output}")
+    if args.trace:
+        emav_perf.recorder.export_chrome_trace(args.trace)
+        print(f"Trace written to {args.trace}")
+    return 0
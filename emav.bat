@@ -0,0 +1,12 @@
+@echo off
+:: ============================================================================
+::  EMAV command-line tools, e.g.
+::      emav export data\*.unv -o exported --type FRF
+::  Uses the 'emavenv' virtual environment created by RUN_EMAV.bat if present.
+:: ============================================================================
+IF EXIST "%~dp0emavenv\Scripts\python.exe" (
+    "%~dp0emavenv\Scripts\python.exe" "%~dp0emav_cli.py" %*
+) ELSE (
+    python "%~dp0emav_cli.py" %*
+)
+exit /b %errorlevel%
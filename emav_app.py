@@ -2,15 +2,111 @@
 # Version: 0.2.1 (with UNV temp file fix)
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import scipy.io as sio
 import numpy as np
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import pyuff
+# matplotlib is imported once the window is shown (see create_plots), and
+# scipy.io and h5py by emav_core when a file needs them
+import emav_core
+import emav_unv
+import emav_match
+import emav_cache
+import emav_mat
+import emav_lod
+import emav_export
+import emav_perf
+import emav_index
+import emav_library
+import emav_overlay
+import emav_prefetch
+import emav_watch
 import traceback # Import for detailed error logging
 import io
-import tempfile
+import itertools
 import os
+import queue
+import threading
+import time
+
+# Number of ranked records listed by "Find Best Matches"
+MATCH_TOP_N = 25
+
+# Background loading: records are handed to the tree in batches of this size
+# (or after LOAD_POST_INTERVAL seconds), and the UI polls the worker queue
+# every UI_POLL_MS, spending at most UI_POLL_BUDGET seconds per poll.
+LOAD_BATCH_SIZE = 500
+LOAD_POST_INTERVAL = 0.1
+UI_POLL_MS = 50
+UI_POLL_BUDGET = 0.03
+
+# The tree model is shown lazily: children of a group are inserted into the
+# Treeview only once it is expanded, TREE_INSERT_BATCH items every TREE_INSERT_MS.
+TREE_INSERT_BATCH = 500
+TREE_INSERT_MS = 1
+# Tree nodes of the files are TREE_FILE_NODE followed by the file number
+TREE_FILE_NODE = "#file"
+TREE_PENDING_SUFFIX = "#pending"
+# The tree filter is applied this long after the last keystroke in the filter box
+FILTER_DELAY_MS = 150
+
+# Fixed amplitude limits of the Testlab plot in log scale
+LOG_SCALE_YLIM = (1e-3, 1e2)
+# Overlay mode draws at most this many of the selected records
+OVERLAY_MAX_RECORDS = 500
+# A tree selection is plotted once it has not changed for this long, so that
+# records passed over with the arrow keys are not drawn. The records this many
+# places before and after the one shown are then prepared in the background.
+SELECT_DELAY_MS = 80
+PREFETCH_NEIGHBOURS = 8
+
+# Watch mode: the size and modification time of the loaded .unv file are checked this often
+WATCH_POLL_MS = 1000
+
+# Performance panel: number of most recent operations listed, and its refresh interval
+PERF_PANEL_ROWS = 200
+PERF_PANEL_REFRESH_MS = 500
+
+def nice_limit(value):
+    """Rounds a positive value up to 1, 2 or 5 times a power of ten."""
+    if not np.isfinite(value) or value <= 0:
+        return 1.0
+    exponent = np.floor(np.log10(value))
+    for step in (1.0, 2.0, 5.0, 10.0):
+        if value <= step * 10 ** exponent:
+            return float(step * 10 ** exponent)
+    return float(10 ** (exponent + 1))
+
+
+def nice_ylim(y):
+    """
+    Linear-scale limits rounded to 1-2-5 steps, so records of similar level
+    share the same axis limits and can be switched without a full redraw.
+    """
+    y = np.asarray(y)
+    if y.size == 0:
+        return (0.0, 1.0)
+    y_min = float(np.nanmin(y))
+    y_max = float(np.nanmax(y))
+    upper = nice_limit(y_max * 1.05) if y_max > 0 else 0.0
+    lower = -nice_limit(-y_min * 1.05) if y_min < 0 else 0.0
+    if upper == lower:
+        upper = lower + 1.0
+    return (lower, upper)
+
+
+def nice_xlim(x):
+    x = np.asarray(x)
+    if x.size == 0:
+        return (0.0, 1.0)
+    x_min = float(np.nanmin(x))
+    x_max = float(np.nanmax(x))
+    if x_max <= x_min:
+        x_max = x_min + 1.0
+    return (x_min, x_max)
+
+
+def axes_width_pixels(ax):
+    """Width of a matplotlib Axes on screen, in pixels."""
+    return max(int(ax.bbox.width), 1)
+
 
 class EMAVApp:
     """
@@ -25,16 +121,29 @@ class EMAVApp:
         self.root.title("EMAV - v0.2.1")
         self.root.geometry("1200x800")
 
-        # --- Member variables ---
-        self.testlab_data = None
-        self.reconstructed_data = None
-        self.record_map = {}
-        self.selected_record_iid = None
-        self.current_testlab_filepath = ""
-        self.file_type = None
-        
-        self.recon_x_data = None
-        self.recon_y_data = None
+        self.init_state()
+
+        # --- Menu bar ---
+        menubar = tk.Menu(self.root)
+        cache_menu = tk.Menu(menubar, tearoff=0)
+        cache_menu.add_command(label="Clear Testlab File Cache", command=self.clear_cache)
+        menubar.add_cascade(label="Cache", menu=cache_menu)
+
+        # Timings are recorded by default so that a slow load can be exported after the fact
+        emav_perf.recorder.enabled = True
+        self.perf_enabled_var = tk.BooleanVar(value=True)
+        self.perf_memory_var = tk.BooleanVar(value=False)
+        self.perf_profile_var = tk.BooleanVar(value=False)
+        perf_menu = tk.Menu(menubar, tearoff=0)
+        perf_menu.add_checkbutton(label="Record Timings", variable=self.perf_enabled_var, command=self.toggle_perf_recording)
+        perf_menu.add_checkbutton(label="Capture Memory (tracemalloc)", variable=self.perf_memory_var, command=self.toggle_perf_capture)
+        perf_menu.add_checkbutton(label="Capture Profile (cProfile)", variable=self.perf_profile_var, command=self.toggle_perf_capture)
+        perf_menu.add_separator()
+        perf_menu.add_command(label="Show Performance Panel", command=self.show_perf_panel)
+        perf_menu.add_command(label="Export Chrome Trace...", command=self.export_perf_trace)
+        perf_menu.add_command(label="Clear Timings", command=self.clear_perf)
+        menubar.add_cascade(label="Performance", menu=perf_menu)
+        self.root.config(menu=menubar)
 
         # --- Main layout ---
         main_frame = ttk.Frame(self.root, padding="10")
@@ -47,15 +156,32 @@ class EMAVApp:
         self.open_testlab_button = ttk.Button(top_frame, text="Load Testlab File (.unv, .mat)", command=self.load_testlab_file)
         self.open_testlab_button.pack(side=tk.LEFT, padx=(0,10))
 
+        self.open_folder_button = ttk.Button(top_frame, text="Load Testlab Folder...", command=self.load_testlab_folder)
+        self.open_folder_button.pack(side=tk.LEFT, padx=(0,10))
+
         self.open_recon_button = ttk.Button(top_frame, text="Load Reconstructed FRF (.unv)", command=self.load_reconstructed_file)
         self.open_recon_button.pack(side=tk.LEFT)
 
+        self.match_button = ttk.Button(top_frame, text="Find Best Matches", command=self.find_best_matches)
+        self.match_button.pack(side=tk.LEFT, padx=(10,0))
+
         self.file_label = ttk.Label(top_frame, text="No file loaded.")
         self.file_label.pack(side=tk.LEFT, padx=10)
 
         self.version_label = ttk.Label(top_frame, text="v0.2.1")
         self.version_label.pack(side=tk.RIGHT)
 
+        self.cancel_load_button = ttk.Button(top_frame, text="Cancel", command=self.cancel_load, state=tk.DISABLED)
+        self.cancel_load_button.pack(side=tk.RIGHT, padx=(5,10))
+
+        # Watch mode: datasets appended to the loaded .unv file are added to the tree as they arrive
+        self.watch_var = tk.BooleanVar(value=False)
+        self.watch_check = ttk.Checkbutton(top_frame, text="Watch File", variable=self.watch_var, command=self.on_watch_toggled)
+        self.watch_check.pack(side=tk.RIGHT, padx=(5,0))
+
+        self.load_progress = ttk.Progressbar(top_frame, orient=tk.HORIZONTAL, length=150, mode='determinate', maximum=1.0)
+        self.load_progress.pack(side=tk.RIGHT)
+
         # Paned window for resizable left/right panes
         paned_window = ttk.PanedWindow(main_frame, orient=tk.HORIZONTAL)
         paned_window.pack(expand=True, fill=tk.BOTH)
@@ -64,20 +190,23 @@ class EMAVApp:
         left_pane = ttk.Frame(paned_window, padding="5")
         paned_window.add(left_pane, weight=2) 
 
-        tree_frame = ttk.Frame(left_pane)
-        tree_frame.pack(expand=True, fill=tk.BOTH)
+        filter_frame = ttk.Frame(left_pane)
+        filter_frame.pack(fill=tk.X)
+        ttk.Label(filter_frame, text="Filter:").pack(side=tk.LEFT, padx=(0,2))
+        self.filter_var = tk.StringVar()
+        self.filter_entry = ttk.Entry(filter_frame, textvariable=self.filter_var)
+        self.filter_entry.pack(side=tk.LEFT, expand=True, fill=tk.X)
+        self.filter_var.trace_add('write', self.on_filter_changed)
+        # Shows the match count, or why the query is invalid
+        self.filter_status = ttk.Label(left_pane, text="e.g. ref=1 dir=+Z type=FRF f>2000")
+        self.filter_status.pack(fill=tk.X, pady=(2, 5))
 
-        self.tree = ttk.Treeview(tree_frame, columns=("info",), show="tree headings")
-        self.tree.heading("#0", text="File / Record")
-        self.tree.column("#0", width=200)
-        self.tree.heading("info", text="Information")
-        self.tree.pack(side=tk.LEFT, expand=True, fill=tk.BOTH)
+        self.tree_frame = ttk.Frame(left_pane)
+        self.tree_frame.pack(expand=True, fill=tk.BOTH)
 
-        tree_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=tree_scrollbar.set)
-        tree_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-
-        self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        self.tree_scrollbar = ttk.Scrollbar(self.tree_frame, orient="vertical")
+        self.tree_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.create_tree()
 
         # --- Right Pane: Plots and controls ---
         right_pane = ttk.Frame(paned_window, padding="5")
@@ -88,14 +217,6 @@ class EMAVApp:
         right_pane.grid_rowconfigure(3, weight=0) # Testlab controls
         right_pane.grid_columnconfigure(0, weight=1)
 
-        # Reconstructed FRF Plot
-        self.fig_recon = Figure(figsize=(7, 3), dpi=100)
-        self.ax_recon = self.fig_recon.add_subplot(111)
-        self.ax_recon.set_title("Reconstructed FRF (Linear Scale)")
-        self.canvas_recon = FigureCanvasTkAgg(self.fig_recon, master=right_pane)
-        self.canvas_recon_widget = self.canvas_recon.get_tk_widget()
-        self.canvas_recon_widget.grid(row=0, column=0, sticky="nsew", pady=(0, 5))
-        
         # --- Reconstructed Plot Controls ---
         recon_controls_frame = ttk.Frame(right_pane)
         recon_controls_frame.grid(row=1, column=0, sticky="ew", pady=5)
@@ -124,38 +245,208 @@ class EMAVApp:
         self.reset_scale_button = ttk.Button(recon_controls_frame, text="Reset Scale", command=self.reset_recon_scale, state=tk.DISABLED)
         self.reset_scale_button.pack(side=tk.LEFT)
 
-
-        # Testlab FRF Plot
-        self.fig_testlab = Figure(figsize=(7, 4), dpi=100)
-        self.axes_testlab = self.fig_testlab.subplots(2, 1, sharex=True)
-        self.fig_testlab.tight_layout(pad=3.0)
-        self.canvas_testlab = FigureCanvasTkAgg(self.fig_testlab, master=right_pane)
-        self.canvas_testlab_widget = self.canvas_testlab.get_tk_widget()
-        self.canvas_testlab_widget.grid(row=2, column=0, sticky="nsew", pady=(10, 5))
-        
         # Controls for Testlab plot
         controls_frame_testlab = ttk.Frame(right_pane)
         controls_frame_testlab.grid(row=3, column=0, sticky="ew", pady=(5,0))
         
         self.log_scale_var = tk.BooleanVar(value=True)
-        self.log_scale_check = ttk.Checkbutton(controls_frame_testlab, text="Log Scale", variable=self.log_scale_var, command=self.update_testlab_plots)
+        self.log_scale_check = ttk.Checkbutton(controls_frame_testlab, text="Log Scale", variable=self.log_scale_var, command=self.refresh_testlab_plot)
         self.log_scale_check.pack(side=tk.LEFT)
 
+        # Overlay mode: every record selected in the tree (or under a selected group) is drawn
+        self.overlay_var = tk.BooleanVar(value=False)
+        self.overlay_check = ttk.Checkbutton(controls_frame_testlab, text="Overlay Selection", variable=self.overlay_var, command=self.on_tree_select)
+        self.overlay_check.pack(side=tk.LEFT, padx=(10,0))
+        self.overlay_envelope_var = tk.BooleanVar(value=True)
+        self.overlay_envelope_check = ttk.Checkbutton(controls_frame_testlab, text="Envelope", variable=self.overlay_envelope_var, command=self.update_testlab_plots)
+        self.overlay_envelope_check.pack(side=tk.LEFT, padx=(5,0))
+        self.overlay_recon_var = tk.BooleanVar(value=True)
+        self.overlay_recon_check = ttk.Checkbutton(controls_frame_testlab, text="Reconstructed", variable=self.overlay_recon_var, command=self.update_testlab_plots)
+        self.overlay_recon_check.pack(side=tk.LEFT, padx=(5,0))
+
         self.save_button = ttk.Button(controls_frame_testlab, text="Save Selected Testlab Record (as Linear UNV)", command=self.save_selected_record, state=tk.DISABLED)
         self.save_button.pack(side=tk.RIGHT)
 
+        # Importing matplotlib takes most of the start-up time, so the window is shown first
+        self.root.update()
+        self.create_plots(right_pane)
+        self.root.after(UI_POLL_MS, self.poll_ui_queue)
+
+    def create_plots(self, parent):
+        """Creates the reconstructed and Testlab plots in rows 0 and 2 of parent."""
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+        with emav_perf.span('ui.plots'):
+            # Reconstructed FRF Plot
+            self.fig_recon = Figure(figsize=(7, 3), dpi=100)
+            self.ax_recon = self.fig_recon.add_subplot(111)
+            self.ax_recon.set_title("Reconstructed FRF (Linear Scale)")
+            self.canvas_recon = FigureCanvasTkAgg(self.fig_recon, master=parent)
+            self.canvas_recon_widget = self.canvas_recon.get_tk_widget()
+            self.canvas_recon_widget.grid(row=0, column=0, sticky="nsew", pady=(0, 5))
+            self.canvas_recon.mpl_connect('resize_event', self.on_recon_resize)
+
+            # Testlab FRF Plot
+            self.create_testlab_figure()
+            self.canvas_testlab = FigureCanvasTkAgg(self.fig_testlab, master=parent)
+            self.canvas_testlab_widget = self.canvas_testlab.get_tk_widget()
+            self.canvas_testlab_widget.grid(row=2, column=0, sticky="nsew", pady=(10, 5))
+            self.connect_testlab_canvas()
+
+    def init_state(self):
+        """Sets the member variables that do not belong to a widget."""
+        self.reconstructed_data = None
+        self.selected_record_iid = None
+        self.overlay_iids = []
+        self.current_testlab_filepath = ""
+        
+        self.recon_x_data = None
+        self.recon_y_data = None
+        self.recon_lod = None
+        self.recon_line = None
+        self.match_index = None
+        self.match_window = None
+        self.perf_window = None
+        self.perf_tree = None
+        self.perf_version = None
+        self.cache = emav_cache.TestlabCache()
+        # The loaded Testlab files: one, or the files of a folder
+        self.library = emav_library.Library(self.cache)
+        self.library_failures = []
+
+        # Background loading state; messages from workers arrive on ui_queue
+        self.ui_queue = queue.Queue()
+        self.load_id = 0
+        self.recon_load_id = 0
+        self.load_cancel_event = None
+        self.loading = False
+        self.file_watcher = None
+        self.watch_after_id = None
+        self.tree_query = None
+        self.filter_after_id = None
+        self.select_after_id = None
+        # Records prepared for plotting (see prepare_record), by tree iid
+        self.prefetcher = emav_prefetch.RecordPrefetcher(self.prepare_record, cost=lambda prepared: len(prepared['x']))
+        self.clear_tree_model()
+
+        # Timing spans that end in a later callback than the one that starts them
+        self.load_span = emav_perf.NULL_SPAN
+        self.recon_load_span = emav_perf.NULL_SPAN
+        self.testlab_draw_span = emav_perf.NULL_SPAN
+
+    def create_testlab_figure(self):
+        """Creates the Testlab figure with its persistent artists; the canvas is attached separately."""
+        from matplotlib.collections import LineCollection, PolyCollection
+        from matplotlib.figure import Figure
+        self.fig_testlab = Figure(figsize=(7, 4), dpi=100)
+        self.axes_testlab = self.fig_testlab.subplots(2, 1, sharex=True)
+        self.fig_testlab.tight_layout(pad=3.0)
+
+        # Persistent artists: records are shown by swapping the line data. The lines
+        # and the title are animated, i.e. left out of full redraws and blitted on
+        # top of the saved background instead (see refresh_testlab_plot).
+        self.mag_line, = self.axes_testlab[0].plot([], [])
+        self.phase_line, = self.axes_testlab[1].plot([], [])
+        # Overlay mode: all records in one LineCollection per axes, so that drawing
+        # hundreds of them stays one artist each, plus the envelope band and mean of
+        # the magnitudes and the reconstructed FRF
+        self.overlay_band = PolyCollection([], facecolors='0.5', edgecolors='none', alpha=0.25)
+        self.axes_testlab[0].add_collection(self.overlay_band, autolim=False)
+        self.overlay_mag = LineCollection([], linewidths=0.8)
+        self.axes_testlab[0].add_collection(self.overlay_mag, autolim=False)
+        self.overlay_phase = LineCollection([], linewidths=0.8)
+        self.axes_testlab[1].add_collection(self.overlay_phase, autolim=False)
+        self.overlay_mean_line, = self.axes_testlab[0].plot([], [], color='k', linewidth=1.5)
+        self.overlay_recon_line, = self.axes_testlab[0].plot([], [], color='r', linewidth=1.5, linestyle='--')
+        self.testlab_animated = [self.overlay_band, self.overlay_mag, self.overlay_phase, self.mag_line, self.phase_line,
+                                 self.overlay_mean_line, self.overlay_recon_line, self.axes_testlab[0].title]
+        for artist in self.testlab_animated:
+            artist.set_animated(True)
+        self.axes_testlab[1].set_ylabel("Phase (deg)")
+        self.axes_testlab[1].set_ylim(-200, 200)
+        self.axes_testlab[1].set_yticks([-180, -90, 0, 90, 180])
+        for ax in self.axes_testlab:
+            ax.grid(True, which='both', linestyle='--')
+        self.testlab_background = None
+        self.testlab_view_state = None
+        self.testlab_plot_mode = None
+        self.testlab_plot = {}
+        # Min/max pyramids of the curves on the persistent lines, see set_line_detail;
+        # the OverlayCurves of the overlay collections and the overlay Envelope
+        self.testlab_lods = {}
+        self.overlay_lods = {}
+        self.overlay_envelope = None
+
+    def create_tree(self):
+        """Creates the record Treeview; clearing the tree replaces it with a new one."""
+        self.tree = ttk.Treeview(self.tree_frame, columns=("info",), show="tree headings")
+        self.tree.heading("#0", text="File / Record")
+        self.tree.column("#0", width=200)
+        self.tree.heading("info", text="Information")
+        self.tree.pack(side=tk.LEFT, expand=True, fill=tk.BOTH)
+        self.tree.configure(yscrollcommand=self.tree_scrollbar.set)
+        self.tree_scrollbar.config(command=self.tree.yview)
+
+        self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        self.tree.bind("<<TreeviewOpen>>", self.on_tree_open)
+        self.tree.bind("<<TreeviewClose>>", self.on_tree_close)
+
+    def clear_tree_model(self):
+        """
+        Empties the tree model: the file, group and record items of the Testlab files.
+
+        record_map holds the record of each record item and record_files its
+        emav_library.TestlabFile. tree_children lists the children of every
+        group in order (those of the root group '' are the file nodes), and
+        tree_shown holds, for each expanded group, how many of them are in the
+        Treeview so far. Collapsed groups only have a placeholder child there.
+        While a filter is active, the Treeview shows tree_visible (the
+        children of each group that match or hold a match) instead of
+        tree_children. The filter itself stays active for the next file.
+        """
+        self.record_map = {}
+        self.record_files = {}
+        self.tree_text = {}
+        self.tree_parent = {}
+        self.tree_children = {'': []}
+        self.tree_shown = {'': 0}
+        self.tree_expanded = set()
+        self.tree_insert_scheduled = False
+        self.metadata_index = emav_index.MetadataIndex()
+        self.tree_match_count = 0
+        if self.tree_query is None:
+            self.tree_visible = None
+            self.tree_visible_items = None
+        else:
+            self.tree_visible = {}
+            self.tree_visible_items = {''}
+
+    def connect_testlab_canvas(self):
+        self.canvas_testlab.mpl_connect('draw_event', self.on_testlab_draw)
+        self.canvas_testlab.mpl_connect('resize_event', self.on_testlab_resize)
+
     def reset_ui_testlab(self):
         """Clears the tree, testlab plot, and resets state variables."""
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        self.record_map.clear()
-        for ax in self.axes_testlab:
-            ax.clear()
-        self.axes_testlab[0].set_title("Select a Testlab record to display")
-        self.canvas_testlab.draw()
+        self.stop_loading()
+        self.stop_watching()
+        # Replacing the Treeview is much faster than deleting its items one by one
+        self.tree.destroy()
+        self.create_tree()
+        self.clear_tree_model()
+        self.update_filter_status()
+        self.library.close()
+        self.library = emav_library.Library(self.cache)
+        self.library_failures = []
+        self.clear_testlab_plot("Select a Testlab record to display")
         self.save_button.config(state=tk.DISABLED)
         self.selected_record_iid = None
-        self.file_type = None
+        self.overlay_iids = []
+        if self.select_after_id is not None:
+            self.root.after_cancel(self.select_after_id)
+            self.select_after_id = None
+        self.prefetcher.clear()
+        self.match_index = None
+        self.load_progress.config(value=0)
 
     def load_testlab_file(self):
         """Opens a file dialog to select a .mat or .unv file and loads its contents into the tree."""
@@ -164,45 +455,399 @@ class EMAVApp:
             filetypes=(("Supported Files", "*.mat *.unv"), ("All files", "*.*"))
         )
         if not filepath: return
+        self.open_testlab_file(filepath)
 
+    def open_testlab_file(self, filepath):
+        """Replaces the tree with the records of filepath, loaded in the background."""
         self.reset_ui_testlab()
         self.current_testlab_filepath = filepath
         filename = filepath.split('/')[-1]
         self.file_label.config(text=f"Loading: {filename}...")
-        self.root.update_idletasks() 
+
+        file_type = emav_library.file_type(filepath)
+        if file_type is None:
+            self.on_testlab_load_error(ValueError("Unsupported file type."), "")
+            return
+        self.load_span = emav_perf.span('testlab.load', file=filepath, type=file_type)
+        testlab_file = self.library.add(filepath, file_type)
+        testlab_file.cache_entry = self.load_cache_entry(filepath)
+
+        # Parsing runs in a worker thread; records stream back through ui_queue
+        self.start_loading(self.testlab_load_worker, filepath, file_type, testlab_file.cache_entry)
+
+    def load_testlab_folder(self):
+        """Opens a folder and loads all its .unv/.mat files, sub-folders included, into one tree; files are parsed in parallel."""
+        folder = filedialog.askdirectory(title="Select a folder of Testlab files")
+        if not folder: return
+        files = emav_library.library_files(folder)
+        if not files:
+            messagebox.showwarning("Load Folder", f"No .unv or .mat files found in:\n{folder}")
+            return
+
+        self.reset_ui_testlab()
+        self.current_testlab_filepath = folder
+        self.file_label.config(text=f"Loading: {len(files)} files in {os.path.basename(folder)}...")
+        self.load_span = emav_perf.span('testlab.load', folder=folder, files=len(files))
+        for path in files:
+            self.library.add(path, emav_library.file_type(path), label=os.path.relpath(path, folder))
+        # File nodes are listed in path order, whichever file finishes first
+        for testlab_file in self.library.files:
+            self.get_tree_file_node(testlab_file)
+        self.start_loading(self.library_load_worker, list(self.library.files), self.cache)
+
+    def start_loading(self, worker, *args):
+        """Runs worker(load_id, *args, cancel_event) in a thread; the records it finds stream back through ui_queue."""
+        self.load_id += 1
+        self.load_cancel_event = threading.Event()
+        self.loading = True
+        self.cancel_load_button.config(state=tk.NORMAL)
+        thread = threading.Thread(target=worker, args=(self.load_id, *args, self.load_cancel_event), daemon=True)
+        thread.start()
+
+    def testlab_load_worker(self, load_id, filepath, file_type, cache_entry, cancel_event):
+        """
+        Background worker for load_testlab_file. Must not touch any Tk widget.
+
+        Posts ('records', 0, batch, progress, count) messages as records are
+        found (the file is file 0 of the library), then ('done', data,
+        from_cache, signature), 'cancelled' or 'error'; signature is the file
+        signature taken before the scan, None for a cached file. Names and
+        index metadata are read here rather than on the UI thread, as lazy
+        v7.3 records read them from the file.
+        """
+        def post(kind, *payload):
+            self.ui_queue.put(('testlab', load_id, kind, payload))
 
         try:
-            print(f"--- Loading Testlab File: {filepath} ---")
-            if filepath.lower().endswith('.mat'):
-                self.file_type = 'mat'
-                print("File type detected: .mat")
-                self.testlab_data = sio.loadmat(filepath, struct_as_record=False, squeeze_me=True)
-                print("Raw .mat data loaded.")
-                self.populate_tree_mat()
-            elif filepath.lower().endswith('.unv'):
-                self.file_type = 'unv'
-                print("File type detected: .unv")
-                uff_file = pyuff.UFF(filepath)
-                self.testlab_data = uff_file.read_sets()
-                print(f"pyuff read_sets result type: {type(self.testlab_data)}")
-                self.populate_tree_unv()
-            else:
-                raise ValueError("Unsupported file type.")
-            
-            self.file_label.config(text=f"Loaded: {filename}")
-            print("--- File loading successful ---")
+            from_cache = cache_entry is not None and cache_entry.kind == file_type
+            # Taken before the scan, so that a file that changes during it is not cached as up to date
+            signature = None if from_cache else emav_cache.file_signature(filepath)
+            data, items = emav_library.scan_file(filepath, file_type, cache_entry if from_cache else None)
+
+            batch = []
+            count = 0
+            progress = 0.0
+            last_post = time.perf_counter()
+            with emav_perf.span('testlab.scan', file=filepath, cached=from_cache) as span:
+                for item, progress in items:
+                    if cancel_event.is_set():
+                        span.set(records=count, cancelled=True)
+                        post('records', 0, batch, progress, count)
+                        post('cancelled', data, count)
+                        return
+                    batch.append(item)
+                    count += 1
+                    now = time.perf_counter()
+                    if len(batch) >= LOAD_BATCH_SIZE or now - last_post >= LOAD_POST_INTERVAL:
+                        post('records', 0, batch, progress, count)
+                        batch = []
+                        last_post = now
+                span.set(records=count)
+            post('records', 0, batch, 1.0, count)
+            post('done', data, from_cache, signature)
+        except Exception as e:
+            post('error', e, traceback.format_exc())
+
+    def testlab_append_worker(self, load_id, filepath, offset, first_position, cancel_event):
+        """
+        Background worker of watch mode. Must not touch any Tk widget.
+
+        Indexes the datasets appended to filepath after offset, numbering them
+        on from first_position, and posts them in 'records' messages like
+        testlab_load_worker, then ('appended', datasets, signature, cancelled),
+        or 'append_error' if it fails. signature is the file signature taken
+        before the scan, under which the whole file can be cached.
+        """
+        def post(kind, *payload):
+            self.ui_queue.put(('testlab', load_id, kind, payload))
 
+        try:
+            signature = emav_cache.file_signature(filepath)
+            total_bytes = max(signature['size'] - offset, 1)
+            datasets = []
+            batch = []
+            progress = 0.0
+            last_post = time.perf_counter()
+            with emav_perf.span('testlab.scan', file=filepath, offset=offset) as span:
+                for i, dataset in enumerate(emav_unv.iter_unv_index(filepath, offset), first_position):
+                    if cancel_event.is_set():
+                        break
+                    datasets.append(dataset)
+                    batch.append((i, dataset))
+                    progress = min((dataset['end_offset'] - offset) / total_bytes, 1.0)
+                    now = time.perf_counter()
+                    if len(batch) >= LOAD_BATCH_SIZE or now - last_post >= LOAD_POST_INTERVAL:
+                        post('records', 0, batch, progress, first_position + len(datasets))
+                        batch = []
+                        last_post = now
+                span.set(records=len(datasets), cancelled=cancel_event.is_set())
+            post('records', 0, batch, progress, first_position + len(datasets))
+            post('appended', datasets, signature, cancel_event.is_set())
         except Exception as e:
-            print("--- ERROR DETAILS (Testlab File) ---")
-            print(f"Error Type: {type(e).__name__}")
+            post('append_error', e, traceback.format_exc())
+
+    def library_load_worker(self, load_id, files, cache, cancel_event):
+        """
+        Background thread for load_testlab_folder. Must not touch any Tk widget.
+
+        Runs emav_library.scan_library, which posts the 'records', 'file_done',
+        'file_error' and 'library_done' messages; posts 'error' if it fails.
+        cache is None to neither read nor write cache entries.
+        """
+        def post(kind, *payload):
+            self.ui_queue.put(('testlab', load_id, kind, payload))
+
+        try:
+            with emav_perf.span('library.scan', files=len(files)):
+                emav_library.scan_library(files, post, cancel_event, cache)
+        except Exception as e:
+            post('error', e, traceback.format_exc())
+
+    def poll_ui_queue(self):
+        """Applies messages posted by background workers, then reschedules itself."""
+        deadline = time.perf_counter() + UI_POLL_BUDGET
+        try:
+            while time.perf_counter() < deadline:
+                source, load_id, kind, payload = self.ui_queue.get_nowait()
+                if source == 'testlab' and load_id == self.load_id:
+                    self.handle_testlab_message(kind, payload)
+                elif source == 'recon' and load_id == self.recon_load_id:
+                    self.handle_reconstructed_message(kind, payload)
+        except queue.Empty:
+            pass
+        self.root.after(UI_POLL_MS, self.poll_ui_queue)
+
+    def handle_testlab_message(self, kind, payload):
+        filename = self.current_testlab_filepath.split('/')[-1]
+        if kind == 'records':
+            file_no, batch, progress, count = payload
+            testlab_file = self.library.files[file_no]
+            if testlab_file.type == 'mat':
+                self.populate_tree_mat(testlab_file, batch)
+            else:
+                self.populate_tree_unv(testlab_file, batch)
+            self.load_progress.config(value=progress)
+            self.update_filter_status()
+            self.file_label.config(text=f"Loading: {filename}... {count} records")
+        elif kind == 'done':
+            data, from_cache, signature = payload
+            self.library.files[0].data = data
+            self.library.files[0].signature = signature
+            self.finish_loading(records=len(self.record_map), cached=from_cache)
+            self.load_progress.config(value=1.0)
+            self.file_label.config(text=f"Loaded: {filename}")
+            self.start_watching()
+            # A watched file is still being written to; it is cached once watching stops
+            if not from_cache and self.file_watcher is None:
+                self.start_cache_write(self.library.files[0])
+        elif kind == 'appended':
+            datasets, signature, cancelled = payload
+            testlab_file = self.library.files[0]
+            testlab_file.data.extend(datasets)
+            # After a cancelled scan the records no longer cover the file as it was signed
+            testlab_file.signature = None if cancelled else signature
+            if datasets:
+                if self.file_watcher is not None:
+                    self.file_watcher.advance(datasets[-1]['end_offset'])
+                self.match_index = None
+            self.finish_loading(records=len(datasets), cancelled=cancelled)
+            self.load_progress.config(value=1.0)
+            if cancelled:
+                self.watch_var.set(False)
+                self.stop_watching()
+            elif self.file_watcher is None:
+                # Watching was turned off during the scan
+                self.start_cache_write(testlab_file)
+            self.file_label.config(text=f"Loaded: {filename} ({len(self.record_map)} records"
+                                        f"{', watching' if self.file_watcher is not None else ''})")
+        elif kind == 'cancelled':
+            data, count = payload
+            self.library.files[0].data = data
+            self.finish_loading(records=count, cancelled=True)
+            self.file_label.config(text=f"Loading cancelled: {filename} ({count} records)")
+        elif kind == 'append_error':
+            e, details = payload
+            print("--- ERROR DETAILS (Watched Testlab File) ---")
             print(f"Error Message: {e}")
-            traceback.print_exc()
+            print(details, end="")
             print("---------------------------------")
-            messagebox.showerror("Error", f"Failed to load Testlab file. See console for details.\n{e}")
-            self.reset_ui_testlab()
-            self.file_label.config(text="File loading failed.")
-        
-        self.canvas_testlab.draw()
+            self.load_span.set(error=f"{type(e).__name__}: {e}")
+            self.finish_loading()
+            # The records indexed so far stay loaded, but are not cached
+            self.library.files[0].signature = None
+            self.watch_var.set(False)
+            self.stop_watching()
+            self.file_label.config(text=f"Stopped watching {filename}: {e}")
+        elif kind == 'file_done':
+            file_no, data, cache_entry, count = payload
+            testlab_file = self.library.files[file_no]
+            testlab_file.data = data
+            testlab_file.cache_entry = cache_entry
+        elif kind == 'file_error':
+            self.on_library_file_error(*payload)
+        elif kind == 'library_done':
+            cancelled, = payload
+            self.finish_loading(records=len(self.record_map), files=len(self.library),
+                                failed=len(self.library_failures), cancelled=cancelled)
+            summary = f"{filename} ({len(self.library)} files, {len(self.record_map)} records"
+            if self.library_failures:
+                summary += f", {len(self.library_failures)} failed"
+            if cancelled:
+                self.file_label.config(text=f"Loading cancelled: {summary})")
+                return
+            self.load_progress.config(value=1.0)
+            self.file_label.config(text=f"Loaded: {summary})")
+            if self.library_failures:
+                messagebox.showwarning("Load Folder", f"{len(self.library_failures)} of {len(self.library)} files could not be loaded. "
+                                       f"See console for details.\n" + "\n".join(self.library_failures[:10]))
+        elif kind == 'error':
+            self.on_testlab_load_error(*payload)
+
+    def on_testlab_load_error(self, e, details):
+        print("--- ERROR DETAILS (Testlab File) ---")
+        print(f"Error Type: {type(e).__name__}")
+        print(f"Error Message: {e}")
+        print(details, end="")
+        print("---------------------------------")
+        self.load_span.set(error=f"{type(e).__name__}: {e}")
+        messagebox.showerror("Error", f"Failed to load Testlab file. See console for details.\n{e}")
+        self.reset_ui_testlab()
+        self.file_label.config(text="File loading failed.")
+
+    def on_library_file_error(self, file_no, error, details):
+        """A file of a folder could not be loaded: reports it and marks its tree node; the other files load on."""
+        testlab_file = self.library.files[file_no]
+        print(f"--- ERROR DETAILS (Testlab File {testlab_file.path}) ---")
+        print(f"Error Message: {error}")
+        print(details, end="")
+        print("---------------------------------")
+        self.library_failures.append(f"{testlab_file.label}: {error}")
+        file_node = self.get_tree_file_node(testlab_file)
+        self.tree_text[file_node] = f"{testlab_file.label} (failed: {error})"
+        if self.tree.exists(file_node):
+            self.tree.item(file_node, text=self.tree_text[file_node])
+
+    def finish_loading(self, **span_args):
+        self.load_span.end(**span_args)
+        self.load_span = emav_perf.NULL_SPAN
+        self.loading = False
+        self.load_cancel_event = None
+        self.cancel_load_button.config(state=tk.DISABLED)
+
+    def stop_loading(self):
+        """Stops any running Testlab load and ignores the messages it still has queued."""
+        if self.load_cancel_event is not None:
+            self.load_cancel_event.set()
+        self.load_id += 1
+        self.finish_loading()
+
+    def cancel_load(self):
+        """Asks the running Testlab load to stop; records already loaded stay browsable."""
+        if self.load_cancel_event is not None:
+            self.load_cancel_event.set()
+            self.cancel_load_button.config(state=tk.DISABLED)
+
+    def on_watch_toggled(self):
+        if self.watch_var.get():
+            self.start_watching()
+        elif self.file_watcher is not None:
+            self.stop_watching()
+            self.file_label.config(text=f"Loaded: {self.library.files[0].label} ({len(self.record_map)} records)")
+            # The file was not cached while it was watched; a running append scan caches it when it is done
+            if not self.loading:
+                self.start_cache_write(self.library.files[0])
+
+    def start_watching(self):
+        """
+        Starts polling the loaded .unv file for appended datasets if watch
+        mode is on. Only a single .unv file that has finished loading is
+        watched; a load started later calls this again once it is done.
+        """
+        self.stop_watching()
+        if not self.watch_var.get() or self.loading or len(self.library) != 1:
+            return
+        testlab_file = self.library.files[0]
+        if testlab_file.type != 'unv' or testlab_file.data is None or testlab_file.path != self.current_testlab_filepath:
+            return
+        offset = testlab_file.data[-1]['end_offset'] if testlab_file.data else 0
+        try:
+            self.file_watcher = emav_watch.FileWatcher(testlab_file.path, offset)
+        except OSError as e:
+            print(f"Cannot watch {testlab_file.path}: {e}")
+            return
+        self.file_label.config(text=f"Loaded: {testlab_file.label} ({len(self.record_map)} records, watching)")
+        self.watch_after_id = self.root.after(WATCH_POLL_MS, self.poll_watched_file)
+
+    def stop_watching(self):
+        if self.watch_after_id is not None:
+            self.root.after_cancel(self.watch_after_id)
+            self.watch_after_id = None
+        self.file_watcher = None
+
+    def poll_watched_file(self):
+        """
+        Indexes the datasets appended to the watched file since the last poll,
+        keeping the tree, selection and plot as they are. A file that was
+        truncated or rewritten is loaded again from scratch.
+        """
+        self.watch_after_id = None
+        if self.file_watcher is None:
+            return
+        # Waits for a previous append scan to finish
+        if not self.loading:
+            change = self.file_watcher.check()
+            if change == emav_watch.REPLACED:
+                self.open_testlab_file(self.file_watcher.path)
+                return
+            if change == emav_watch.GROWN:
+                testlab_file = self.library.files[0]
+                self.load_span = emav_perf.span('testlab.append', file=testlab_file.path, offset=self.file_watcher.offset)
+                self.start_loading(self.testlab_append_worker, testlab_file.path, self.file_watcher.offset,
+                                   len(testlab_file.data))
+        self.watch_after_id = self.root.after(WATCH_POLL_MS, self.poll_watched_file)
+
+    def load_cache_entry(self, filepath):
+        """Returns the up-to-date cache entry for filepath, or None."""
+        with emav_perf.span('cache.load', file=filepath) as span:
+            try:
+                entry = self.cache.load(filepath)
+            except Exception as e:
+                print(f"Ignoring unreadable cache entry: {e}")
+                return None
+            span.set(hit=entry is not None)
+        return entry
+
+    def start_cache_write(self, testlab_file):
+        """Writes the cache entry for the TestlabFile just loaded in a background thread."""
+        if testlab_file.signature is None:
+            # Loaded from the cache, or its records do not cover a whole scan
+            return
+        if isinstance(testlab_file.data, emav_mat.MatFileV73):
+            # Nothing went wrong, so this is shown in the Performance panel rather than printed
+            emav_perf.span('cache.store', file=testlab_file.path, skipped="MATLAB v7.3 records are read on demand").end()
+            return
+        contents = emav_cache.cache_contents(testlab_file.path, testlab_file.type, testlab_file.data)
+        if contents is None:
+            emav_perf.span('cache.store', file=testlab_file.path, skipped="contents cannot be cached").end()
+            return
+        thread = threading.Thread(target=self.write_cache,
+                                  args=(testlab_file.path, testlab_file.type, testlab_file.signature, *contents), daemon=True)
+        thread.start()
+
+    def write_cache(self, filepath, kind, signature, records, slots, read_xy):
+        """Background worker for start_cache_write. Must not touch any Tk widget."""
+        try:
+            with emav_perf.span('cache.store', file=filepath, records=len(slots)):
+                self.cache.store(filepath, kind, signature, records, slots, read_xy)
+        except Exception as e:
+            print(f"Could not write cache for {filepath}: {e}")
+
+    def clear_cache(self):
+        """Deletes all cached Testlab files."""
+        if not messagebox.askyesno("Clear Cache", f"Delete all cached Testlab files in\n{self.cache.cache_dir}?"):
+            return
+        freed = self.cache.clear()
+        messagebox.showinfo("Clear Cache", f"Freed {freed / 1024 ** 2:.1f} MB of cached data.")
 
     def load_reconstructed_file(self):
         """Loads a single reconstructed FRF .unv file into the top plot."""
@@ -212,63 +857,51 @@ class EMAVApp:
         )
         if not filepath: return
         
-        temp_filepath = None
+        self.recon_load_span.end(superseded=True)
+        self.recon_load_span = emav_perf.span('recon.load', file=filepath)
+        self.recon_load_id += 1
+        self.open_recon_button.config(state=tk.DISABLED)
+        worker = threading.Thread(target=self.reconstructed_load_worker, args=(self.recon_load_id, filepath), daemon=True)
+        worker.start()
+
+    def reconstructed_load_worker(self, load_id, filepath):
+        """Background worker for load_reconstructed_file. Must not touch any Tk widget."""
         try:
-            print(f"--- Loading Reconstructed File: {filepath} ---")
-            
-            print("Pre-processing .unv file to remove dataset 151...")
-            with open(filepath, 'r') as f:
-                lines = f.readlines()
-            
-            output_lines = []
-            i = 0
-            in_151 = False
-            while i < len(lines):
-                line = lines[i].strip()
-                if line == '151' and i > 0 and lines[i-1].strip() == '-1':
-                    in_151 = True
-                    print(f"Found and skipping dataset 151 starting at line {i+1}.")
-                    i += 1 # Skip the 151 line
-                    while i < len(lines):
-                        if lines[i].strip() == '-1':
-                            break
-                        i += 1
-                else:
-                    output_lines.append(lines[i])
-                i += 1
+            # Dataset 151 and any other non-function datasets are skipped while streaming
+            data = emav_unv.read_unv58(filepath, max_records=1)
+            self.ui_queue.put(('recon', load_id, 'done', (filepath, data)))
+        except Exception as e:
+            self.ui_queue.put(('recon', load_id, 'error', (e, traceback.format_exc())))
 
-            filtered_content = "".join(output_lines)
-            
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.unv', encoding='utf-8') as temp_f:
-                temp_f.write(filtered_content)
-                temp_filepath = temp_f.name
-            print(f"Pre-processing complete. Wrote cleaned data to temp file: {temp_filepath}")
+    def handle_reconstructed_message(self, kind, payload):
+        self.open_recon_button.config(state=tk.NORMAL)
+        if kind == 'done':
+            self.on_reconstructed_loaded(*payload)
+        else:
+            self.on_reconstructed_load_error(*payload)
+        self.recon_load_span.end()
+        self.recon_load_span = emav_perf.NULL_SPAN
 
-            uff_file = pyuff.UFF(temp_filepath)
-            data = uff_file.read_sets()
-            
-            print(f"pyuff read_sets result type: {type(data)}")
-            if isinstance(data, dict):
-                print("Single dataset found, wrapping it in a list.")
-                data = [data]
-            
-            if not data or not isinstance(data, list) or len(data) == 0:
+    def on_reconstructed_loaded(self, filepath, data):
+        """Plots the first function dataset read by the reconstructed file worker."""
+        try:
+            if not data:
                  raise ValueError("No valid data sets found in the file.")
 
-            print("File contains one or more datasets. Processing the first one.")
+            # The first function dataset in the file is used
             self.reconstructed_data = data[0]
-            print("Successfully extracted first dataset.")
             
-            self.recon_x_data = self.reconstructed_data['x']
+            self.recon_x_data = np.asarray(self.reconstructed_data['x'])
             y_data_raw = self.reconstructed_data['data']
-            print(f"Reconstructed Y-data shape: {y_data_raw.shape}")
+            self.recon_load_span.set(shape=str(y_data_raw.shape))
 
             if y_data_raw.ndim == 2:
-                print("Y-data is 2D, taking first column for amplitude.")
+                # 2D data: the first column is the amplitude
                 self.recon_y_data = y_data_raw[:, 0]
             else:
-                print("Y-data is 1D, using as is.")
                 self.recon_y_data = y_data_raw
+            with emav_perf.span('lod.build', points=len(self.recon_x_data)):
+                self.recon_lod = emav_lod.MinMaxPyramid(self.recon_x_data, np.real(self.recon_y_data))
 
             self.plot_reconstructed(f"Reconstructed: {filepath.split('/')[-1]}")
             
@@ -281,20 +914,18 @@ class EMAVApp:
 
             for widget in [self.recon_xmin_entry, self.recon_xmax_entry, self.recon_ymin_entry, self.recon_ymax_entry, self.apply_scale_button, self.reset_scale_button]:
                 widget.config(state=tk.NORMAL)
-                
-            print("--- Reconstructed file loaded and plotted successfully ---")
 
         except Exception as e:
-            print("--- ERROR DETAILS (Reconstructed File) ---")
-            print(f"Error Type: {type(e).__name__}")
-            print(f"Error Message: {e}")
-            traceback.print_exc()
-            print("---------------------------------")
-            messagebox.showerror("Error", f"Failed to load Reconstructed FRF file. See console for details.\n{e}")
-        finally:
-            if temp_filepath and os.path.exists(temp_filepath):
-                print(f"Deleting temporary file: {temp_filepath}")
-                os.remove(temp_filepath)
+            self.on_reconstructed_load_error(e, traceback.format_exc())
+
+    def on_reconstructed_load_error(self, e, details):
+        print("--- ERROR DETAILS (Reconstructed File) ---")
+        print(f"Error Type: {type(e).__name__}")
+        print(f"Error Message: {e}")
+        print(details, end="")
+        print("---------------------------------")
+        self.recon_load_span.set(error=f"{type(e).__name__}: {e}")
+        messagebox.showerror("Error", f"Failed to load Reconstructed FRF file. See console for details.\n{e}")
 
 
     def plot_reconstructed(self, title):
@@ -303,13 +934,16 @@ class EMAVApp:
             return
             
         self.ax_recon.clear()
-        self.ax_recon.plot(self.recon_x_data, self.recon_y_data)
+        # The full range is drawn from the pyramid; its min/max points give the same autoscale
+        x_data, y_data = self.recon_lod.view(n_pixels=axes_width_pixels(self.ax_recon))
+        self.recon_line, = self.ax_recon.plot(x_data, y_data)
         self.ax_recon.set_title(title)
         self.ax_recon.set_xlabel("Frequency (Hz)")
         self.ax_recon.set_ylabel("Amplitude")
         self.ax_recon.grid(True, linestyle='--')
-        self.fig_recon.tight_layout()
-        self.canvas_recon.draw()
+        with emav_perf.span('plot.draw', figure='recon'):
+            self.fig_recon.tight_layout()
+            self.canvas_recon.draw()
 
     def apply_recon_scale(self):
         """Applies the manual axis limits from the entry boxes to the reconstructed plot."""
@@ -321,7 +955,9 @@ class EMAVApp:
             
             self.ax_recon.set_xlim(xmin, xmax)
             self.ax_recon.set_ylim(ymin, ymax)
-            self.canvas_recon.draw()
+            self.update_recon_detail()
+            with emav_perf.span('plot.draw', figure='recon'):
+                self.canvas_recon.draw()
         except (ValueError, TypeError):
             messagebox.showerror("Input Error", "Please enter valid numbers for all axis limits.")
 
@@ -336,187 +972,759 @@ class EMAVApp:
             self.recon_ymin_var.set(f"{ymin:.2f}")
             self.recon_ymax_var.set(f"{ymax:.2f}")
 
-    def populate_tree_mat(self):
-        filename = self.current_testlab_filepath.split('/')[-1]
-        file_node = self.tree.insert("", "end", text=filename, open=True)
-        if not self.testlab_data: return
-        for key, value in self.testlab_data.items():
-            if key.startswith('__'): continue
-            def process_record(record, iid, parent):
-                if hasattr(record, 'Name') and hasattr(record, 'X_Data') and hasattr(record, 'Y_Data'):
-                    record_name = getattr(record, 'Name', f'Record {iid}')
-                    self.record_map[iid] = record
-                    self.tree.insert(parent, "end", text=record_name, iid=iid)
-                    return True
-                return False
-            if isinstance(value, np.ndarray) and value.dtype.kind == 'O':
-                parent_node = self.tree.insert(file_node, "end", text=key, open=True)
-                for i, record in enumerate(value):
-                    process_record(record, f"{key}_{i}", parent_node)
-            elif hasattr(value, '_fieldnames'):
-                parent_node = file_node
-                process_record(value, key, parent_node)
-
-    def populate_tree_unv(self):
-        filename = self.current_testlab_filepath.split('/')[-1]
-        file_node = self.tree.insert("", "end", text=filename, open=True)
-        type_nodes = {}
-        
-        data_to_process = self.testlab_data
-        if isinstance(data_to_process, dict):
-            data_to_process = [data_to_process]
-            
-        for i, dataset in enumerate(data_to_process):
-            if dataset.get('type') == 58:
-                node_key = 58
-                node_text = "Functions (Type 58)"
-                try:
-                    record_name = f"Resp:{dataset.get('rsp_node',0)}:{dataset.get('rsp_dir',0)}/Ref:{dataset.get('ref_node',0)}:{dataset.get('ref_dir',0)}"
-                except:
-                    record_name = f"Record {i+1}"
-                if node_key not in type_nodes:
-                    type_nodes[node_key] = self.tree.insert(file_node, "end", text=node_text, open=True)
-                iid = str(i)
-                self.record_map[iid] = dataset
-                self.tree.insert(type_nodes[node_key], "end", text=record_name, iid=iid)
+    def update_recon_detail(self):
+        """Swaps the reconstructed line data for the pyramid level matching the visible x range."""
+        if self.recon_line is None or self.recon_lod is None:
+            return
+        xmin, xmax = self.ax_recon.get_xlim()
+        self.recon_line.set_data(*self.recon_lod.view(xmin, xmax, axes_width_pixels(self.ax_recon)))
+
+    def on_recon_resize(self, event):
+        self.update_recon_detail()
+
+    def get_tree_file_node(self, testlab_file):
+        """
+        Returns the top-level tree node of a TestlabFile, creating it on first use.
+
+        A single file starts expanded, the files of a folder collapsed.
+        """
+        iid = f"{TREE_FILE_NODE}{testlab_file.number}"
+        if iid not in self.tree_children:
+            if len(self.library) == 1:
+                self.tree_expanded.add(iid)
+            self.get_tree_group_node('', iid, testlab_file.label)
+        return iid
+
+    def get_tree_group_node(self, parent, iid, text):
+        if iid not in self.tree_children:
+            self.tree_children[iid] = []
+            self.add_tree_item(parent, iid, text)
+        return iid
+
+    def get_tree_point_node(self, file_node, rsp_node, ref_node, ref_dir):
+        """Returns the group of a record in a file by reference point, then response node."""
+        ref_group = self.get_tree_group_node(file_node, f"{file_node}/ref{ref_node}:{ref_dir}",
+                                             f"Ref {ref_node}:{emav_unv.format_direction(ref_dir)}")
+        return self.get_tree_group_node(ref_group, f"{ref_group}/rsp{rsp_node}", f"Resp {rsp_node}")
+
+    def add_tree_item(self, parent, iid, text):
+        """Adds an item to the tree model; it is inserted into the Treeview once its parent is expanded."""
+        self.tree_text[iid] = text
+        self.tree_parent[iid] = parent
+        self.tree_children[parent].append(iid)
+        if self.tree_visible is None and parent in self.tree_shown:
+            self.schedule_tree_inserts()
+
+    def view_children(self, group):
+        """The children of group that the Treeview shows, i.e. those passing the filter."""
+        if self.tree_visible is None:
+            return self.tree_children[group]
+        return self.tree_visible.get(group, [])
+
+    def schedule_tree_inserts(self):
+        if not self.tree_insert_scheduled:
+            self.tree_insert_scheduled = True
+            self.root.after(TREE_INSERT_MS, self.insert_tree_items)
+
+    def insert_tree_items(self):
+        """Inserts the next batch of children of the expanded groups, and reschedules itself while some are left."""
+        self.tree_insert_scheduled = False
+        budget = TREE_INSERT_BATCH
+        with emav_perf.span('tree.insert') as span:
+            for group in list(self.tree_shown):
+                budget -= self.insert_tree_children(group, budget)
+                if budget == 0:
+                    break
+            span.set(items=TREE_INSERT_BATCH - budget)
+        if budget == 0:
+            self.schedule_tree_inserts()
+
+    def insert_tree_children(self, group, count):
+        """Inserts up to count of the children of an expanded group that are not in the Treeview yet; returns how many."""
+        shown = self.tree_shown[group]
+        children = self.view_children(group)[shown:shown + count]
+        for iid in children:
+            if iid in self.tree_expanded:
+                # Groups the user had expanded stay expanded when the view is rebuilt
+                self.tree.insert(group, "end", iid=iid, text=self.tree_text[iid], open=True)
+                self.tree_shown[iid] = 0
+                self.schedule_tree_inserts()
+            else:
+                self.tree.insert(group, "end", iid=iid, text=self.tree_text[iid])
+                if iid in self.tree_children:
+                    # A collapsed group only gets a placeholder, so that it can be expanded
+                    self.tree.insert(iid, "end", iid=iid + TREE_PENDING_SUFFIX, text="...")
+        self.tree_shown[group] = shown + len(children)
+        return len(children)
+
+    def expand_tree_group(self, group):
+        """Replaces the placeholder of a group by its children (inserted in batches)."""
+        if group not in self.tree_children:
+            return
+        self.tree_expanded.add(group)
+        if group in self.tree_shown:
+            return
+        self.tree.delete(group + TREE_PENDING_SUFFIX)
+        self.tree_shown[group] = 0
+        self.schedule_tree_inserts()
+
+    def on_tree_open(self, event=None):
+        self.expand_tree_group(self.tree.focus())
+
+    def on_tree_close(self, event=None):
+        self.tree_expanded.discard(self.tree.focus())
+
+    def rebuild_tree_view(self):
+        """Replaces the Treeview by a new one showing the model; expanded groups are filled in again in batches."""
+        self.tree.destroy()
+        self.create_tree()
+        self.tree_shown = {'': 0}
+        self.schedule_tree_inserts()
+
+    def reveal_tree_item(self, iid):
+        """Expands the groups above iid and inserts the items needed to show it in the Treeview."""
+        if self.tree_visible_items is not None and iid not in self.tree_visible_items:
+            self.clear_filter()
+        path = [iid]
+        while path[-1] in self.tree_parent:
+            path.append(self.tree_parent[path[-1]])
+        for group, child in zip(path[:0:-1], path[-2::-1]):
+            self.expand_tree_group(group)
+            needed = self.view_children(group).index(child) + 1 - self.tree_shown[group]
+            if needed > 0:
+                self.insert_tree_children(group, needed)
+            if group:
+                self.tree.item(group, open=True)
+
+    def populate_tree_mat(self, testlab_file, batch):
+        """
+        Adds a batch of (key, index, record, name, metadata) items of a .mat
+        TestlabFile to the tree. Records scanned by a library worker come
+        without their struct and are kept as (key, index) until they are read.
+        """
+        with emav_perf.span('tree.insert', records=len(batch)):
+            file_node = self.get_tree_file_node(testlab_file)
+            first_row = len(self.metadata_index)
+            for key, index, record, name, metadata in batch:
+                record_id = key if index is None else f"{key}_{index}"
+                iid = f"{testlab_file.number}:{record_id}"
+                record_name = f'Record {record_id}' if name is None else name
+                if metadata['ref_node']:
+                    parent_node = self.get_tree_point_node(file_node, metadata['rsp_node'], metadata['ref_node'], metadata['ref_dir'])
+                elif index is None:
+                    parent_node = file_node
+                else:
+                    # Names without response and reference points are grouped by variable
+                    parent_node = self.get_tree_group_node(file_node, f"{file_node}/var{key}", key)
+                self.record_map[iid] = (key, index) if record is None else record
+                self.record_files[iid] = testlab_file
+                self.metadata_index.add(iid, record_name, metadata)
+                self.add_tree_item(parent_node, iid, record_name)
+            self.filter_new_records(first_row)
+
+    def populate_tree_unv(self, testlab_file, batch):
+        """Adds a batch of (index, dataset) pairs from the .unv index of a TestlabFile to the tree."""
+        with emav_perf.span('tree.insert', records=len(batch)):
+            file_node = self.get_tree_file_node(testlab_file)
+            first_row = len(self.metadata_index)
+            for i, dataset in batch:
+                if dataset.get('type') == 58:
+                    parent_node = self.get_tree_point_node(file_node, dataset.get('rsp_node', 0), dataset.get('ref_node', 0),
+                                                           dataset.get('ref_dir', 0))
+                    iid = f"{testlab_file.number}:{i}"
+                    record_name = emav_export.record_label(dataset, i)
+                    self.record_map[iid] = dataset
+                    self.record_files[iid] = testlab_file
+                    self.metadata_index.add(iid, record_name, emav_index.unv_metadata(dataset))
+                    self.add_tree_item(parent_node, iid, record_name)
+            self.filter_new_records(first_row)
+
+    def set_tree_query(self, terms):
+        """Shows only the records matching the emav_index.parse_query() terms in the tree; all of them for no terms."""
+        with emav_perf.span('tree.filter', records=len(self.metadata_index)) as span:
+            self.tree_query = terms or None
+            if self.tree_query is None:
+                self.tree_visible = None
+                self.tree_visible_items = None
+                self.tree_match_count = len(self.metadata_index)
+            else:
+                self.tree_visible = {}
+                self.tree_visible_items = {''}
+                self.tree_match_count = 0
+                self.filter_new_records(0)
+            self.rebuild_tree_view()
+            span.set(matches=self.tree_match_count)
+
+    def filter_new_records(self, first_row):
+        """Adds the records of the metadata index from first_row onwards that match the filter to the tree view."""
+        if self.tree_query is None:
+            return
+        rows = self.metadata_index.match(self.tree_query, first_row)
+        self.tree_match_count += len(rows)
+        for row in rows:
+            self.show_filtered_item(self.metadata_index.keys[row])
+
+    def show_filtered_item(self, iid):
+        """Makes iid, and any groups above it that were hidden, visible in the filtered tree."""
+        while iid not in self.tree_visible_items:
+            self.tree_visible_items.add(iid)
+            parent = self.tree_parent[iid]
+            self.tree_visible.setdefault(parent, []).append(iid)
+            if parent in self.tree_shown:
+                self.schedule_tree_inserts()
+            iid = parent
+
+    def on_filter_changed(self, *args):
+        if self.filter_after_id is not None:
+            self.root.after_cancel(self.filter_after_id)
+        self.filter_after_id = self.root.after(FILTER_DELAY_MS, self.apply_filter)
+
+    def apply_filter(self):
+        """Filters the tree by the query in the filter box, keeping the selected record selected if it still matches."""
+        if self.filter_after_id is not None:
+            self.root.after_cancel(self.filter_after_id)
+            self.filter_after_id = None
+        try:
+            terms = emav_index.parse_query(self.filter_var.get())
+        except ValueError as e:
+            self.filter_status.config(text=str(e))
+            return
+        self.set_tree_query(terms)
+        self.update_filter_status()
+        iid = self.selected_record_iid
+        if iid is not None and (self.tree_visible_items is None or iid in self.tree_visible_items):
+            self.reveal_tree_item(iid)
+            self.tree.see(iid)
+            self.tree.focus(iid)
+            self.tree.selection_set(iid)
+
+    def clear_filter(self):
+        """Empties the filter box and shows every record again."""
+        self.filter_var.set("")
+        self.apply_filter()
+
+    def update_filter_status(self):
+        if self.tree_query is None:
+            self.filter_status.config(text=f"{len(self.metadata_index)} records")
+        else:
+            self.filter_status.config(text=f"{self.tree_match_count} of {len(self.metadata_index)} records match")
+
+    def load_record_data(self, iid):
+        """Returns the record for iid with its numeric data, parsing it from its file if needed."""
+        return self.library.read_record(self.record_files[iid], self.record_map[iid])
+
+    def build_match_index(self):
+        """Stacks the magnitudes of every loaded Testlab record for vectorized matching."""
+        with emav_perf.span('match.index', records=len(self.record_map)) as span:
+            index = emav_match.MatchIndex()
+            file_records = {}
+            for iid in self.record_map:
+                file_records.setdefault(self.record_files[iid], []).append(iid)
+            # File by file, so that each .mat file of a folder is opened only once. Records held
+            # in a RecordStore are added a whole frequency axis at a time.
+            for testlab_file in sorted(file_records, key=lambda testlab_file: testlab_file.number):
+                stored = {}
+                for iid in file_records[testlab_file]:
+                    try:
+                        located = self.library.record_slot(testlab_file, self.record_map[iid])
+                        if located is None:
+                            x_data, y_data = emav_core.record_xy(self.load_record_data(iid), testlab_file.type)
+                    except Exception as e:
+                        print(f"Skipping record {iid} in match index: {e}")
+                        continue
+                    if located is None:
+                        index.add(iid, x_data, y_data)
+                    else:
+                        store, slot = located
+                        iids, slots = stored.setdefault(id(store), (store, [], []))[1:]
+                        iids.append(iid)
+                        slots.append(slot)
+                for store, iids, slots in stored.values():
+                    for x_data, positions, y_data in store.axis_groups(slots):
+                        index.add_rows([iids[position] for position in positions], x_data, y_data)
+            index.finalize()
+            span.set(indexed=len(index))
+        return index
+
+    def find_best_matches(self):
+        """Ranks every Testlab record against the reconstructed FRF and lists the best ones."""
+        if self.recon_x_data is None or self.recon_y_data is None:
+            messagebox.showwarning("Match Error", "Please load a reconstructed FRF first.")
+            return
+        if not self.record_map:
+            messagebox.showwarning("Match Error", "Please load a Testlab file first.")
+            return
+        if self.loading:
+            messagebox.showwarning("Match Error", "The Testlab file is still loading. Please wait or cancel the load.")
+            return
+
+        try:
+            if self.match_index is None:
+                self.root.config(cursor="watch")
+                self.root.update_idletasks()
+                self.match_index = self.build_match_index()
+            with emav_perf.span('match.score', records=len(self.match_index)):
+                matches = self.match_index.best_matches(self.recon_x_data, self.recon_y_data, top_n=MATCH_TOP_N)
+        except Exception as e:
+            traceback.print_exc()
+            messagebox.showerror("Match Error", f"Failed to search for matching records.\n{e}")
+            return
+        finally:
+            self.root.config(cursor="")
+
+        if not matches:
+            messagebox.showinfo("No Matches", "No Testlab record overlaps the frequency range of the reconstructed FRF.")
+            return
+        self.show_match_results(matches)
+
+    def show_match_results(self, matches):
+        """Shows the ranked matches in a window; selecting one selects the record in the main tree."""
+        if self.match_window is not None and self.match_window.winfo_exists():
+            self.match_window.destroy()
+        self.match_window = tk.Toplevel(self.root)
+        self.match_window.title("Best Matches")
+        self.match_window.geometry("520x400")
+
+        match_tree = ttk.Treeview(self.match_window, columns=("record", "frac", "log_rms"), show="headings")
+        match_tree.heading("record", text="Record")
+        match_tree.heading("frac", text="FRAC")
+        match_tree.heading("log_rms", text="Log RMS Error")
+        match_tree.column("record", width=260)
+        match_tree.column("frac", width=100, anchor=tk.E)
+        match_tree.column("log_rms", width=120, anchor=tk.E)
+        match_tree.pack(side=tk.LEFT, expand=True, fill=tk.BOTH)
+
+        match_scrollbar = ttk.Scrollbar(self.match_window, orient="vertical", command=match_tree.yview)
+        match_tree.configure(yscrollcommand=match_scrollbar.set)
+        match_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        for iid, frac, log_rms in matches:
+            name = self.tree_text[iid]
+            match_tree.insert("", "end", iid=iid, values=(name, f"{frac:.4f}", f"{log_rms:.4f}"))
+
+        def on_match_select(event=None):
+            iid = match_tree.focus()
+            if iid in self.record_map:
+                self.reveal_tree_item(iid)
+                self.tree.see(iid)
+                self.tree.focus(iid)
+                self.tree.selection_set(iid)
+
+        match_tree.bind("<<TreeviewSelect>>", on_match_select)
+
+    def toggle_perf_recording(self):
+        emav_perf.recorder.enabled = self.perf_enabled_var.get()
+
+    def toggle_perf_capture(self):
+        """Applies the capture options of the Performance menu; saves the profile when profiling stops."""
+        stats = emav_perf.recorder.set_capture(profile=self.perf_profile_var.get(), memory=self.perf_memory_var.get())
+        if stats is None:
+            return
+        save_path = filedialog.asksaveasfilename(
+            title="Save cProfile Statistics",
+            defaultextension=".prof", filetypes=(("Profile statistics", "*.prof"),),
+            initialfile="emav_profile.prof"
+        )
+        if save_path:
+            stats.dump_stats(save_path)
+
+    def show_perf_panel(self):
+        """Lists the most recent timed operations in a window that follows new timings."""
+        if self.perf_window is not None and self.perf_window.winfo_exists():
+            self.perf_window.lift()
+            return
+        self.perf_window = tk.Toplevel(self.root)
+        self.perf_window.title("Performance")
+        self.perf_window.geometry("760x400")
+
+        self.perf_tree = ttk.Treeview(self.perf_window, columns=("operation", "ms", "thread", "details"), show="headings")
+        self.perf_tree.heading("operation", text="Operation")
+        self.perf_tree.heading("ms", text="Time (ms)")
+        self.perf_tree.heading("thread", text="Thread")
+        self.perf_tree.heading("details", text="Details")
+        self.perf_tree.column("operation", width=130)
+        self.perf_tree.column("ms", width=90, anchor=tk.E)
+        self.perf_tree.column("thread", width=100)
+        self.perf_tree.column("details", width=420)
+        self.perf_tree.pack(side=tk.LEFT, expand=True, fill=tk.BOTH)
+
+        perf_scrollbar = ttk.Scrollbar(self.perf_window, orient="vertical", command=self.perf_tree.yview)
+        self.perf_tree.configure(yscrollcommand=perf_scrollbar.set)
+        perf_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.perf_version = None
+        self.refresh_perf_panel()
+
+    def refresh_perf_panel(self):
+        """Relists the operations when new ones were recorded, newest first, then reschedules itself."""
+        if self.perf_window is None or not self.perf_window.winfo_exists():
+            self.perf_window = None
+            return
+        if emav_perf.recorder.version != self.perf_version:
+            self.perf_version = emav_perf.recorder.version
+            self.perf_tree.delete(*self.perf_tree.get_children())
+            for span in reversed(emav_perf.recorder.recent(PERF_PANEL_ROWS)):
+                details = ", ".join(f"{key}={value}" for key, value in span['args'].items())
+                self.perf_tree.insert("", "end", values=(span['name'], f"{span['duration'] * 1e3:.2f}", span['thread'], details))
+        self.perf_window.after(PERF_PANEL_REFRESH_MS, self.refresh_perf_panel)
+
+    def export_perf_trace(self):
+        """Saves the recorded timings as a Chrome trace (chrome://tracing or ui.perfetto.dev)."""
+        save_path = filedialog.asksaveasfilename(
+            title="Export Chrome Trace",
+            defaultextension=".json", filetypes=(("Trace files", "*.json"),),
+            initialfile="emav_trace.json"
+        )
+        if not save_path: return
+        try:
+            emav_perf.recorder.export_chrome_trace(save_path)
+        except Exception as e:
+            messagebox.showerror("Export Error", f"Failed to export the trace.\n{e}")
+            return
+        messagebox.showinfo("Trace Exported", f"Exported {len(emav_perf.recorder.recent())} operations to:\n{save_path}")
+
+    def clear_perf(self):
+        emav_perf.recorder.clear()
 
     def on_tree_select(self, event=None):
         selected_iid = self.tree.focus()
+        if self.overlay_var.get():
+            self.overlay_iids = self.selected_tree_records()
+            if len(self.overlay_iids) > 1:
+                self.selected_record_iid = selected_iid if selected_iid in self.record_map else None
+                # Saves every overlaid record
+                self.save_button.config(state=tk.NORMAL)
+                self.schedule_testlab_update()
+                return
         if not selected_iid or selected_iid not in self.record_map:
             self.save_button.config(state=tk.DISABLED)
             self.selected_record_iid = None
             return
         self.selected_record_iid = selected_iid
-        self.update_testlab_plots()
         self.save_button.config(state=tk.NORMAL)
-    
+        self.schedule_testlab_update()
+
+    def schedule_testlab_update(self):
+        """Plots the selection once it has not changed for SELECT_DELAY_MS."""
+        if self.select_after_id is not None:
+            self.root.after_cancel(self.select_after_id)
+        self.select_after_id = self.root.after(SELECT_DELAY_MS, self.show_selection)
+
+    def show_selection(self):
+        """Plots the selected record(s) and starts preparing the records around it."""
+        self.select_after_id = None
+        self.update_testlab_plots()
+        iid = self.selected_record_iid
+        if iid is None or (self.overlay_var.get() and len(self.overlay_iids) > 1):
+            return
+        following = itertools.islice(self.tree_records_from(iid), PREFETCH_NEIGHBOURS)
+        preceding = itertools.islice(self.tree_records_from(iid, reverse=True), PREFETCH_NEIGHBOURS)
+        # Nearest first, alternating between the next and the previous records
+        neighbours = [n for pair in itertools.zip_longest(following, preceding) for n in pair if n is not None]
+        self.prefetcher.request(neighbours)
+
+    def tree_records_from(self, iid, reverse=False):
+        """
+        Yields the records after iid (before it with reverse, nearest first) in
+        the order the tree lists them with every group expanded and the filter applied.
+        """
+        while iid in self.tree_parent:
+            parent = self.tree_parent[iid]
+            siblings = self.view_children(parent)
+            position = siblings.index(iid)
+            for sibling in (reversed(siblings[:position]) if reverse else siblings[position + 1:]):
+                yield from self.tree_group_records(sibling, reverse)
+            iid = parent
+
+    def tree_group_records(self, iid, reverse=False):
+        """Yields iid if it is a record, otherwise the records in the group iid, in tree order."""
+        if iid in self.record_map:
+            yield iid
+        elif iid in self.tree_children:
+            children = self.view_children(iid)
+            for child in (reversed(children) if reverse else children):
+                yield from self.tree_group_records(child, reverse)
+
+    def selected_tree_records(self):
+        """
+        The records selected in the tree for the overlay, in tree order:
+        selected records and the records under selected groups that pass the
+        filter, up to OVERLAY_MAX_RECORDS.
+        """
+        iids = []
+        seen = set()
+        pending = list(reversed(self.tree.selection()))
+        while pending and len(iids) < OVERLAY_MAX_RECORDS:
+            iid = pending.pop()
+            if iid in seen:
+                continue
+            seen.add(iid)
+            if iid in self.record_map:
+                iids.append(iid)
+            elif iid in self.tree_children:
+                pending.extend(reversed(self.view_children(iid)))
+        return iids
+
     def update_testlab_plots(self):
+        if self.overlay_var.get() and len(self.overlay_iids) > 1:
+            self.plot_overlay(self.overlay_iids)
+            return
         if not self.selected_record_iid: return
             
-        record = self.record_map[self.selected_record_iid]
-        name = self.tree.item(self.selected_record_iid, 'text')
-        
-        for ax in self.axes_testlab: ax.clear()
+        iid = self.selected_record_iid
+        name = self.tree_text[iid]
+        with emav_perf.span('record.show', record=name) as span:
+            try:
+                prepared = self.prefetcher.get(iid)
+                span.set(prefetched=prepared is not None)
+                if prepared is None:
+                    prepared = self.prepare_record(iid)
+                    self.prefetcher.put(iid, prepared)
+                self.plot_prepared_record(prepared, name)
 
-        try:
-            raw_y_data = None
-            if self.file_type == 'mat':
-                x_data = record.X_Data
-                raw_y_data = record.Y_Data
-                x_label = f"{getattr(record, 'X_Label', 'Freq')} ({getattr(record, 'X_Units', 'Hz')})"
-            elif self.file_type == 'unv':
-                x_data = record['x']
-                raw_y_data = record['data']
-                x_label = f"{record.get('xlabel', 'Abscissa')} ({record.get('xunits_description', '')})"
-
-            is_complex = np.iscomplexobj(raw_y_data)
-            is_unv_frf = (self.file_type == 'unv' and raw_y_data.ndim == 2 and raw_y_data.shape[1] >= 2)
-
-            if is_complex or is_unv_frf:
-                if is_unv_frf:
-                    complex_y_data = raw_y_data[:, 0] + 1j * raw_y_data[:, 1]
-                else:
-                    complex_y_data = raw_y_data
-                
-                mag = np.abs(complex_y_data)
-                phase = np.angle(complex_y_data, deg=True)
-                self.plot_frf(x_data, mag, phase, name, x_label)
-            else:
-                self.plot_real(x_data, raw_y_data, name, x_label)
+            except Exception as e:
+                messagebox.showwarning("Plot Error", f"Could not plot selected record.\nDetails: {e}")
+                self.clear_testlab_plot(f"Could not plot record: {name}")
+                self.save_button.config(state=tk.DISABLED)
 
-        except Exception as e:
-            messagebox.showwarning("Plot Error", f"Could not plot selected record.\nDetails: {e}")
-            for ax in self.axes_testlab: ax.clear()
-            self.axes_testlab[0].set_title(f"Could not plot record: {name}")
-            self.canvas_testlab.draw()
-            self.save_button.config(state=tk.DISABLED)
-
-    def plot_frf(self, x, mag, phase, name, xlabel):
-        self.axes_testlab[0].set_visible(True)
-        self.axes_testlab[1].set_visible(True)
+    def prepare_record(self, iid):
+        """
+        Reads a record and computes what plotting it takes: magnitude and phase
+        (the values of a real record) and their min/max pyramids.
 
-        self.axes_testlab[0].plot(x, mag)
-        self.axes_testlab[0].set_title(f"Testlab: {name}")
-        self.axes_testlab[0].set_ylabel("Amplitude")
-        
-        if self.log_scale_var.get():
-            self.axes_testlab[0].set_yscale('log')
-            self.axes_testlab[0].set_ylim(1e-3, 1e2)
-            self.axes_testlab[0].grid(True, which='both', linestyle='--')
+        Also runs on the prefetch thread, so it must not touch any widget.
+        """
+        testlab_file = self.record_files[iid]
+        record = self.library.read_record(testlab_file, self.record_map[iid])
+        x_data, y_data = emav_core.record_xy(record, testlab_file.type)
+        prepared = {'x': np.asarray(x_data), 'xlabel': emav_core.record_xlabel(record, testlab_file.type)}
+        if np.iscomplexobj(y_data):
+            with emav_perf.span('record.magphase', points=len(y_data)):
+                mag = np.abs(y_data)
+                phase = np.angle(y_data, deg=True)
+            with emav_perf.span('lod.build', points=len(x_data)):
+                prepared.update(mode='frf', y=mag, lods=(emav_lod.MinMaxPyramid(x_data, mag),
+                                                         emav_lod.MinMaxPyramid(x_data, phase)))
         else:
-            self.axes_testlab[0].set_yscale('linear')
-            self.axes_testlab[0].grid(True, linestyle='--')
+            with emav_perf.span('lod.build', points=len(x_data)):
+                prepared.update(mode='real', y=np.asarray(y_data), lods=(emav_lod.MinMaxPyramid(x_data, y_data),))
+        return prepared
 
-        self.axes_testlab[1].plot(x, phase)
-        self.axes_testlab[1].set_ylabel("Phase (deg)")
-        self.axes_testlab[1].set_xlabel(xlabel)
-        self.axes_testlab[1].grid(True, linestyle='--')
-        
-        self.fig_testlab.tight_layout(h_pad=0.5)
-        self.canvas_testlab.draw()
+    def plot_prepared_record(self, prepared, name):
+        """Shows a prepare_record() result on the persistent Testlab lines."""
+        self.clear_testlab_lines()
+        self.testlab_lods = dict(zip((self.mag_line, self.phase_line), prepared['lods']))
+        self.set_line_detail()
+        self.show_testlab_record(prepared['mode'], prepared['x'], prepared['y'], name, prepared['xlabel'])
 
-    def plot_real(self, x, y, name, xlabel):
-        self.axes_testlab[0].set_visible(True)
-        self.axes_testlab[1].set_visible(False)
-        
-        self.axes_testlab[0].plot(x, y)
+    def plot_overlay(self, iids):
+        """
+        Draws the records iids on top of each other, with the envelope of their
+        magnitudes and the reconstructed FRF if those are enabled.
+
+        FRFs are shown as magnitude and phase when every record is complex,
+        otherwise the values (magnitudes of complex records) are shown alone.
+        """
+        with emav_perf.span('overlay.show', records=len(iids)) as span:
+            curves = []
+            x_label = ""
+            for iid in iids:
+                try:
+                    testlab_file = self.record_files[iid]
+                    record = self.load_record_data(iid)
+                    x_data, y_data = emav_core.record_xy(record, testlab_file.type)
+                except Exception as e:
+                    print(f"Skipping record {iid} in overlay: {e}")
+                    continue
+                if not curves:
+                    x_label = emav_core.record_xlabel(record, testlab_file.type)
+                curves.append((np.asarray(x_data), np.asarray(y_data)))
+            span.set(drawn=len(curves))
+            if not curves:
+                self.clear_testlab_plot("Could not plot the selected records")
+                return
+
+            is_frf = all(np.iscomplexobj(y) for _, y in curves)
+            magnitudes = [(x, np.abs(y) if np.iscomplexobj(y) else y) for x, y in curves]
+            self.clear_testlab_lines()
+            with emav_perf.span('lod.build', points=sum(len(x) for x, _ in curves)):
+                self.overlay_lods = {self.overlay_mag: emav_overlay.OverlayCurves(magnitudes)}
+                if is_frf:
+                    self.overlay_lods[self.overlay_phase] = emav_overlay.OverlayCurves(
+                        [(x, np.angle(y, deg=True)) for x, y in curves])
+                if self.overlay_envelope_var.get():
+                    self.overlay_envelope = emav_overlay.Envelope.from_curves(magnitudes)
+                    if self.overlay_envelope is not None:
+                        self.testlab_lods[self.overlay_mean_line] = self.overlay_envelope.mean
+                if self.overlay_recon_var.get() and self.recon_x_data is not None:
+                    self.testlab_lods[self.overlay_recon_line] = emav_lod.MinMaxPyramid(self.recon_x_data, np.abs(self.recon_y_data))
+            from matplotlib import rcParams
+            colors = rcParams['axes.prop_cycle'].by_key()['color']
+            colors = [colors[i % len(colors)] for i in range(len(curves))]
+            for collection in self.overlay_lods:
+                collection.set_color(colors)
+            self.set_line_detail()
+
+            x_ends = np.array([[np.nanmin(x), np.nanmax(x)] for x, _ in curves if len(x)]).ravel()
+            y_ends = np.array([[np.nanmin(y), np.nanmax(y)] for _, y in magnitudes if len(y)]).ravel()
+            name = f"{len(curves)} records overlaid"
+            if len(iids) == OVERLAY_MAX_RECORDS:
+                name += f" (overlay limit {OVERLAY_MAX_RECORDS})"
+            self.show_testlab_record('frf' if is_frf else 'real', x_ends, y_ends, name, x_label)
+
+    def set_line_detail(self):
+        """
+        Sets the data of the persistent Testlab lines and overlay collections from their pyramids.
+
+        The Testlab plot always shows the whole record, so the level is chosen
+        for the full range and the current width of the axes.
+        """
+        for line, lod in self.testlab_lods.items():
+            line.set_data(*lod.view(n_pixels=axes_width_pixels(line.axes)))
+        for collection, curves in self.overlay_lods.items():
+            collection.set_segments(curves.segments(axes_width_pixels(collection.axes)))
+        if self.overlay_envelope is not None:
+            self.overlay_band.set_verts([self.overlay_envelope.band(axes_width_pixels(self.overlay_band.axes))])
+
+    def clear_testlab_lines(self):
+        """Empties the persistent lines and overlay collections, and forgets their pyramids."""
+        for line in (self.mag_line, self.phase_line, self.overlay_mean_line, self.overlay_recon_line):
+            line.set_data([], [])
+        for collection in (self.overlay_mag, self.overlay_phase):
+            collection.set_segments([])
+        self.overlay_band.set_verts([])
+        self.testlab_lods = {}
+        self.overlay_lods = {}
+        self.overlay_envelope = None
+
+    def show_testlab_record(self, mode, x, y, name, xlabel):
+        """Stores what the persistent lines now show and refreshes the Testlab plot."""
+        self.testlab_plot_mode = mode
+        self.testlab_plot = {
+            'xlim': nice_xlim(x),
+            'y': y,
+            'xlabel': xlabel,
+        }
         self.axes_testlab[0].set_title(f"Testlab: {name}")
-        self.axes_testlab[0].set_ylabel("Value")
-        self.axes_testlab[0].set_xlabel(xlabel)
-        self.axes_testlab[0].set_yscale('linear')
-        self.axes_testlab[0].grid(True, linestyle='--')
-        
-        self.fig_testlab.tight_layout()
-        self.canvas_testlab.draw()
+        self.refresh_testlab_plot()
+
+    def clear_testlab_plot(self, title):
+        """Empties the persistent lines and shows title instead of a record."""
+        self.clear_testlab_lines()
+        self.axes_testlab[0].set_title(title)
+        self.testlab_plot_mode = None
+        self.testlab_plot = {}
+        self.testlab_view_state = None
+        self.testlab_background = None
+        self.request_testlab_draw()
+
+    def refresh_testlab_plot(self):
+        """
+        Applies the axis settings for the record shown and redraws the Testlab plot.
+
+        When scale, limits and labels are the same as for the previous record,
+        only the animated artists are blitted over the saved background; a full
+        redraw happens only when the axes themselves change.
+        """
+        if self.testlab_plot_mode is None:
+            return
+        ax_mag, ax_phase = self.axes_testlab
+        is_frf = self.testlab_plot_mode == 'frf'
+        log_scale = is_frf and self.log_scale_var.get()
+        ylim = LOG_SCALE_YLIM if log_scale else nice_ylim(self.testlab_plot['y'])
+        state = (self.testlab_plot_mode, log_scale, self.testlab_plot['xlim'], ylim, self.testlab_plot['xlabel'])
+
+        if state == self.testlab_view_state and self.testlab_background is not None:
+            self.blit_testlab()
+            return
+
+        mode_changed = self.testlab_view_state is None or self.testlab_view_state[0] != self.testlab_plot_mode
+        self.testlab_view_state = state
+        ax_phase.set_visible(is_frf)
+        ax_mag.set_yscale('log' if log_scale else 'linear')
+        ax_mag.set_xlim(*self.testlab_plot['xlim'])
+        ax_mag.set_ylim(*ylim)
+        ax_mag.set_ylabel("Amplitude" if is_frf else "Value")
+        # The shared x axis is labelled on the lowest visible axes only
+        ax_mag.set_xlabel("" if is_frf else self.testlab_plot['xlabel'])
+        ax_mag.tick_params(labelbottom=not is_frf)
+        ax_phase.set_xlabel(self.testlab_plot['xlabel'])
+        if mode_changed:
+            self.fig_testlab.tight_layout(h_pad=0.5)
+        self.testlab_background = None
+        self.request_testlab_draw()
+
+    def request_testlab_draw(self):
+        """Schedules a full redraw of the Testlab plot; its timing span ends in on_testlab_draw."""
+        if self.testlab_draw_span is emav_perf.NULL_SPAN:
+            self.testlab_draw_span = emav_perf.span('plot.draw', figure='testlab')
+        self.canvas_testlab.draw_idle()
+
+    def blit_testlab(self):
+        """Redraws only the animated artists on top of the saved Testlab background."""
+        with emav_perf.span('plot.blit', figure='testlab'):
+            self.canvas_testlab.restore_region(self.testlab_background)
+            self.draw_testlab_animated()
+            self.canvas_testlab.blit(self.fig_testlab.bbox)
+
+    def draw_testlab_animated(self):
+        for artist in self.testlab_animated:
+            if artist.get_visible() and artist.axes.get_visible():
+                self.fig_testlab.draw_artist(artist)
+
+    def on_testlab_draw(self, event):
+        """After every full redraw: saves the static background and draws the animated artists on it."""
+        self.testlab_background = self.canvas_testlab.copy_from_bbox(self.fig_testlab.bbox)
+        self.draw_testlab_animated()
+        self.testlab_draw_span.end()
+        self.testlab_draw_span = emav_perf.NULL_SPAN
+
+    def on_testlab_resize(self, event):
+        """The only place, besides a change of plot mode, where the Testlab layout is recomputed."""
+        if self.testlab_plot_mode is not None:
+            self.fig_testlab.tight_layout(h_pad=0.5)
+            self.set_line_detail()
+        self.testlab_background = None
 
     def save_selected_record(self):
-        if not self.selected_record_iid:
+        """Saves the selected record as linear amplitude; in overlay mode every overlaid record, into one file."""
+        if self.overlay_var.get() and len(self.overlay_iids) > 1:
+            iids = self.overlay_iids
+            initial_filename = f"Linear_{len(iids)}_records.unv"
+        elif self.selected_record_iid:
+            iids = [self.selected_record_iid]
+            initial_filename = emav_export.export_filename(self.tree_text[self.selected_record_iid])
+        else:
             messagebox.showwarning("Save Error", "No record selected.")
             return
 
-        original_record = self.record_map.get(self.selected_record_iid)
-        
-        initial_filename = self.tree.item(self.selected_record_iid, 'text').replace(":","_").replace("/","-").strip()
         save_path = filedialog.asksaveasfilename(
-            title="Save Transformed Record as .unv",
+            title="Save Transformed Record as .unv" if len(iids) == 1 else f"Save {len(iids)} Transformed Records as .unv",
             defaultextension=".unv", filetypes=(("Universal files", "*.unv"),),
-            initialfile=f"Linear_{initial_filename}.unv"
+            initialfile=initial_filename
         )
         if not save_path: return
 
         try:
-            if self.file_type == 'unv' and original_record.get('type') == 58:
-                y_data_raw = original_record['data']
-                
-                # Ensure we have complex data to transform
-                if y_data_raw.ndim == 2 and y_data_raw.shape[1] >= 2:
-                    complex_y = y_data_raw[:, 0] + 1j * y_data_raw[:, 1]
-                    linear_magnitude = np.abs(complex_y)
-
-                    # Create a new dataset dictionary for saving
-                    new_record = original_record.copy()
-                    
-                    # Reshape for saving as a 2-column array (value, 0)
-                    save_data = np.zeros((len(linear_magnitude), 2))
-                    save_data[:, 0] = linear_magnitude
-
-                    new_record['data'] = save_data
-                    new_record['data_type'] = 2  # Set to Real
-                    new_record['z_def_type'] = 0 # No longer complex
-                    new_record['num_values_per_point'] = 2
-                    new_record['ylabel'] = 'AMPLITUDE' # Match reconstructed format
-                    
-                    uff_out = pyuff.UFF(save_path, 'w')
-                    uff_out.write_sets(new_record)
-                    messagebox.showinfo("Success", f"Successfully saved transformed record to:\n{save_path}")
-
-                else: # Handle cases like PSD or Coherence
-                     uff_out = pyuff.UFF(save_path, 'w')
-                     uff_out.write_sets(original_record)
-                     messagebox.showinfo("Success", f"Record was not a complex FRF. Saved original data to:\n{save_path}")
-
-            elif self.file_type == 'mat':
-                messagebox.showwarning("Not Implemented", "Saving transformed FRF from .mat is not yet supported. Please use .unv files for this feature.")
+            with emav_perf.span('export.record', file=save_path, records=len(iids)):
+                new_records = []
+                converted = True
+                for iid in iids:
+                    try:
+                        new_record, record_converted = emav_core.linear_unv_record(self.load_record_data(iid), self.record_files[iid].type)
+                    except ValueError as e:
+                        messagebox.showwarning("Save Error", f"{self.tree_text[iid]}: {e}")
+                        return
+                    new_records.append(new_record)
+                    converted = converted and record_converted
+                emav_export.write_unv58(save_path, new_records)
+            if len(new_records) > 1:
+                note = "" if converted else "\nRecords that were not complex FRFs were saved unchanged."
+                messagebox.showinfo("Success", f"Successfully saved {len(new_records)} transformed records to:\n{save_path}{note}")
+            elif converted:
+                messagebox.showinfo("Success", f"Successfully saved transformed record to:\n{save_path}")
+            else: # Handle cases like PSD or Coherence
+                messagebox.showinfo("Success", f"Record was not a complex FRF. Saved original data to:\n{save_path}")
 
         except Exception as e:
             messagebox.showerror("Save Error", f"Failed to save to .unv file.\n{e}")
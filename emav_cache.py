@@ -0,0 +1,248 @@
+# EMAV - Persistent cache of parsed Testlab files
+# Stores the records of a parsed .unv/.mat file as a RecordStore (stacked .npy
+# arrays) plus a small JSON metadata table so that reopening the same file is
+# near-instant.
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import emav_mat
+import emav_store
+import emav_unv
+
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Bytes read from the start and the end of a file for its content hash
+HASH_SAMPLE_BYTES = 1024 * 1024
+
+META_FILE = 'meta.json'
+# Ordinate data types of dataset 58 records and the precision they are cached with
+UNV_ORDINATE_DTYPES = {2: 'float32', 4: 'float64', 5: 'complex64', 6: 'complex128'}
+
+
+def default_cache_dir():
+    """Per-user cache directory; can be overridden with the EMAV_CACHE_DIR environment variable."""
+    if os.environ.get('EMAV_CACHE_DIR'):
+        return os.environ['EMAV_CACHE_DIR']
+    if os.environ.get('LOCALAPPDATA'):
+        return os.path.join(os.environ['LOCALAPPDATA'], 'EMAV', 'cache')
+    return os.path.join(os.path.expanduser('~'), '.cache', 'emav')
+
+
+def file_signature(filepath):
+    """
+    Identifies the current content of a file by path, size, mtime and a content hash.
+
+    The hash covers the first and last HASH_SAMPLE_BYTES of the file so that it
+    stays cheap for multi-GB exports.
+    """
+    stat = os.stat(filepath)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        digest.update(f.read(HASH_SAMPLE_BYTES))
+        if stat.st_size > 2 * HASH_SAMPLE_BYTES:
+            f.seek(-HASH_SAMPLE_BYTES, os.SEEK_END)
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+        elif stat.st_size > HASH_SAMPLE_BYTES:
+            digest.update(f.read())
+    return {
+        'path': os.path.abspath(filepath),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'hash': digest.hexdigest(),
+    }
+
+
+def _dir_size(path):
+    total = 0
+    for name in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+class CacheEntry:
+    """
+    A validated cache entry. Its record store is memory-mapped, so record
+    arrays are only paged in when a record is accessed.
+    """
+    def __init__(self, path, meta):
+        self.path = path
+        self.kind = meta['kind']
+        self.records = meta['records']
+        self.store = emav_store.RecordStore.load(path)
+
+    def xy(self, slot):
+        """Returns the (x, y) arrays of a cached record as read-only memory-mapped views."""
+        return self.store.xy(slot)
+
+
+class TestlabCache:
+    """
+    Directory of cache entries, one per source file, with LRU eviction.
+
+    Each entry holds:
+        meta.json       - source file signature and per-record metadata
+        x.npy           - deduplicated abscissa arrays, concatenated
+        y_<dtype>.npy   - ordinates of each precision, concatenated
+        slots.npy       - where each record's arrays are (see emav_store)
+    """
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def entry_path(self, filepath):
+        key = hashlib.blake2b(os.path.abspath(filepath).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, filepath):
+        """Returns the CacheEntry for filepath, or None if missing or out of date."""
+        path = self.entry_path(filepath)
+        meta_path = os.path.join(path, META_FILE)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != CACHE_VERSION:
+            return None
+        cached = meta['signature']
+        stat = os.stat(filepath)
+        if cached['size'] != stat.st_size or cached['mtime_ns'] != stat.st_mtime_ns:
+            return None
+        if cached['hash'] != file_signature(filepath)['hash']:
+            return None
+        # Mark as recently used for LRU eviction
+        os.utime(meta_path)
+        return CacheEntry(path, meta)
+
+    def store(self, filepath, kind, signature, records, slots, read_xy):
+        """
+        Writes a cache entry for filepath.
+
+        signature is the file_signature() taken before the file was scanned:
+        if the file changed since, the entry is out of date at once instead
+        of holding only the records that were scanned.
+        records is the JSON-serialisable metadata table. slots is a list of
+        (record_position, num_pts, dtype) for the records that carry data and
+        read_xy(record_position) returns their (x, y) arrays; each of those
+        records gets a 'cache_slot' entry pointing at its arrays.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        final_path = self.entry_path(filepath)
+        tmp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_path)
+        try:
+            emav_store.RecordStore.write(tmp_path, [(num_pts, dtype) for _, num_pts, dtype in slots],
+                                         lambda slot: read_xy(slots[slot][0]))
+            for slot, (position, _, _) in enumerate(slots):
+                records[position]['cache_slot'] = slot
+
+            meta = {'version': CACHE_VERSION, 'kind': kind, 'signature': signature, 'records': records}
+            with open(os.path.join(tmp_path, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+            shutil.rmtree(final_path, ignore_errors=True)
+            os.replace(tmp_path, final_path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self.evict(keep=final_path)
+
+    def entries(self):
+        """Returns [(path, size_in_bytes, last_used_time)] for every cache entry."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(path, META_FILE)
+            if name.endswith('.tmp') or not os.path.isfile(meta_path):
+                continue
+            entries.append((path, _dir_size(path), os.path.getmtime(meta_path)))
+        return entries
+
+    def total_size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Deletes every cache entry and leftover partial writes. Returns the number of bytes freed."""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        freed = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(path):
+                continue
+            size = _dir_size(path)
+            # Entries still memory-mapped by the open file cannot be deleted on Windows
+            shutil.rmtree(path, ignore_errors=True)
+            if not os.path.exists(path):
+                freed += size
+        return freed
+
+
+def cache_contents(filepath, kind, data):
+    """
+    Returns the (records, slots, read_xy) arguments of TestlabCache.store() for a parsed file.
+
+    data is the list of .unv index datasets or the load_mat() result of
+    filepath; .unv record data is read from the file as the entry is written.
+    Returns None for contents the cache cannot represent, and for MATLAB v7.3
+    files, whose records are read lazily anyway.
+    """
+    if kind == 'unv':
+        records = [dict(dataset) for dataset in data]
+        slots = [(i, dataset['num_pts'], UNV_ORDINATE_DTYPES.get(dataset['ord_data_type'], 'float64'))
+                 for i, dataset in enumerate(records)
+                 if dataset['type'] == 58 and 'num_pts' in dataset and 'ord_data_type' in dataset]
+
+        def read_xy(i):
+            record = emav_unv.read_unv_record(filepath, records[i])
+            return record['x'], record['data']
+        return records, slots, read_xy
+    if isinstance(data, emav_mat.MatFileV73):
+        return None
+    prepared = mat_cache_records(data)
+    if prepared is None:
+        return None
+    records, slots, arrays = prepared
+    return records, slots, arrays.__getitem__
+
+
+# --- .mat support ---
+
+def mat_cache_records(mat_data):
+    """
+    Builds the metadata table and slots for the records of a loadmat() dict.
+
+    Records are enumerated with emav_mat.record_table(). Returns (records,
+    slots, arrays) or None if the file holds data that the cache cannot
+    represent. Slot i is records[i].
+    """
+    table = emav_mat.record_table(mat_data)
+    if table is None:
+        return None
+    records, arrays = table
+    slots = [(i, len(y), y.dtype) for i, (_, y) in enumerate(arrays)]
+    return records, slots, arrays
+
+
+def mat_data_from_cache(entry):
+    """Rebuilds a loadmat()-like dict of record structs from a .mat cache entry."""
+    return emav_mat.mat_data_from_store(entry.store, entry.records)
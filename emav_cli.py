@@ -0,0 +1,70 @@
+# EMAV - Command-line interface
+# Headless entry point for batch jobs; it does not import tkinter or matplotlib.
+#
+#   python emav_cli.py export data/*.unv -o exported --type FRF --dir +Z
+#
+# On Windows, emav.bat runs this script inside the EMAV virtual environment.
+import argparse
+import sys
+import emav_unv
+import emav_export
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def _direction_list(text):
+    return [emav_unv.parse_direction(value) for value in text.split(',')]
+
+
+def _function_type_list(text):
+    return [emav_unv.parse_function_type(value) for value in text.split(',')]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='emav', description="EMAV (Experimental Modal Analysis Viewer) batch tools.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser(
+        'export', help="Export Testlab records to linear-amplitude .unv files.",
+        description="Converts every selected dataset 58 record of the input files into a "
+                    "linear-amplitude .unv file, like 'Save Selected Testlab Record'. "
+                    "Outputs that are newer than their source file are skipped.")
+    export.add_argument('inputs', nargs='+', help=".unv/.mat files or glob patterns (e.g. 'data/**/*.unv')")
+    export.add_argument('-o', '--output', required=True, help="Output folder; each input file gets a sub-folder.")
+    export.add_argument('--node', type=_int_list, help="Response or reference node(s), comma separated.")
+    export.add_argument('--rsp-node', type=_int_list, help="Response node(s), comma separated.")
+    export.add_argument('--ref-node', type=_int_list, help="Reference node(s), comma separated.")
+    export.add_argument('--dir', type=_direction_list, help="Response direction(s), e.g. +Z or X,-Y.")
+    export.add_argument('--ref-dir', type=_direction_list, help="Reference direction(s).")
+    export.add_argument('--type', type=_function_type_list,
+                        help="Function type(s) by name (FRF, COHERENCE, PSD, ...) or UNV code.")
+    export.add_argument('-j', '--jobs', type=int, default=None, help="Worker processes (default: one per CPU).")
+    export.add_argument('--force', action='store_true', help="Rewrite outputs even if they are up to date.")
+    export.add_argument('--binary', action='store_true', help="Write binary dataset 58b instead of ASCII.")
+    return parser
+
+
+def run_export(args):
+    files = emav_export.expand_inputs(args.inputs)
+    if not files:
+        print("No .unv or .mat files matched the inputs.")
+        return 1
+    record_filter = emav_export.RecordFilter(
+        nodes=args.node, rsp_nodes=args.rsp_node, ref_nodes=args.ref_node,
+        rsp_dirs=args.dir, ref_dirs=args.ref_dir, func_types=args.type)
+    totals = emav_export.batch_export(files, args.output, record_filter, jobs=args.jobs, force=args.force,
+                                         binary=args.binary)
+    return 1 if totals['failed'] else 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'export':
+        return run_export(args)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
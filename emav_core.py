@@ -0,0 +1,82 @@
+# EMAV - Data core
+# Reading Testlab files, converting and exporting their records: everything
+# EMAV does with the data that needs no window. The application is built on
+# it, and scripts and notebooks can import it alone:
+#
+#   import emav_core
+#   for name, metadata, record in emav_core.iter_records('run1.unv'):
+#       x, y = emav_core.record_xy(record, 'unv')
+#
+# Importing it loads numpy and EMAV's own modules only. It never imports
+# tkinter or matplotlib; scipy.io and h5py are imported when a .mat file that
+# needs them is first read.
+import numpy as np
+import emav_index
+from emav_export import (RecordFilter, batch_export, export_filename, linear_amplitude_record, mat_record_to_unv,
+                         record_label, write_unv58)
+from emav_library import Library, TestlabFile, file_type, library_files, scan_file
+from emav_mat import close_mat, iter_mat_records, load_mat
+from emav_store import RecordStore
+from emav_unv import iter_unv58, iter_unv_index, read_unv58, read_unv_record
+
+
+def record_xy(record, file_type):
+    """Returns (x, y) for a loaded record, with two-column UNV data combined into complex values."""
+    if file_type == 'mat':
+        return np.asarray(record.X_Data), np.asarray(record.Y_Data)
+    x_data = record['x']
+    y_data = record['data']
+    if y_data.ndim == 2 and y_data.shape[1] >= 2:
+        y_data = y_data[:, 0] + 1j * y_data[:, 1]
+    return x_data, y_data
+
+
+def record_xlabel(record, file_type):
+    """Abscissa label of a loaded record, with its units."""
+    if file_type == 'mat':
+        return f"{getattr(record, 'X_Label', 'Freq')} ({getattr(record, 'X_Units', 'Hz')})"
+    return f"{record.get('xlabel', 'Abscissa')} ({record.get('xunits_description', '')})"
+
+
+def linear_unv_record(record, file_type):
+    """
+    Returns (dataset, converted): a loaded record as the linear-amplitude
+    dataset 58 that "Save Selected Testlab Record" writes. converted is False
+    for records that are not complex (saved unchanged). Raises ValueError for
+    .unv records that are not function records.
+    """
+    if file_type == 'mat':
+        record = mat_record_to_unv(record)
+    elif record.get('type') != 58:
+        raise ValueError("Only function records (dataset 58) can be saved.")
+    return linear_amplitude_record(record)
+
+
+def iter_records(filepath, record_filter=None):
+    """
+    Yields (name, metadata, record) for the records of a .unv or .mat file, with their data read.
+
+    name and metadata are those of the tree and the filter box (see
+    emav_index); record_filter, e.g. a RecordFilter, selects records by
+    metadata. .unv files are read in one pass; .mat files are loaded whole,
+    except v7.3 files, whose records read their fields from the file when
+    accessed: use them before the iteration ends, which closes the file.
+    """
+    kind = file_type(filepath)
+    if kind == 'unv':
+        for position, dataset in enumerate(iter_unv58(filepath)):
+            metadata = emav_index.unv_metadata(dataset)
+            if record_filter is None or record_filter(metadata):
+                yield record_label(dataset, position), metadata, dataset
+    elif kind == 'mat':
+        mat_data = load_mat(filepath)
+        try:
+            for key, index, record in iter_mat_records(mat_data):
+                name = str(getattr(record, 'Name', f'Record {key if index is None else f"{key}_{index}"}'))
+                metadata = emav_index.mat_metadata(record, name)
+                if record_filter is None or record_filter(metadata):
+                    yield name, metadata, record
+        finally:
+            close_mat(mat_data)
+    else:
+        raise ValueError(f"{filepath} is not a .unv or .mat file.")
@@ -0,0 +1,285 @@
+# EMAV - Export of Testlab records to linear-amplitude UNV
+# Shared by the "Save Selected Testlab Record" button and the `emav export`
+# batch command, so both write exactly the same files. No GUI imports here.
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import emav_unv
+import emav_mat
+import emav_perf
+
+# Records per task handed to a worker process when exporting a .unv file
+EXPORT_CHUNK_SIZE = 64
+# "12:+Z" style point labels in .mat record names (response first, then reference)
+_POINT_PATTERN = re.compile(r'(\d+)\s*:\s*([+-]?R?[XYZ])\b', re.IGNORECASE)
+
+
+def record_label(dataset, position):
+    """Display name of a .unv dataset, as used in the tree and for export file names."""
+    if dataset.get('type') == 58:
+        return f"Resp:{dataset.get('rsp_node',0)}:{dataset.get('rsp_dir',0)}/Ref:{dataset.get('ref_node',0)}:{dataset.get('ref_dir',0)}"
+    return f"Record {position+1}"
+
+
+def export_filename(name):
+    """Default file name of an exported record."""
+    return f"Linear_{name.replace(':', '_').replace('/', '-').strip()}.unv"
+
+
+def mat_name_points(name):
+    """The (node, direction code) pairs of the "node:direction" labels in a .mat record name, in order."""
+    return [(int(node), emav_unv.parse_direction(direction)) for node, direction in _POINT_PATTERN.findall(str(name))]
+
+
+def mat_record_metadata(record):
+    """
+    Dataset 58 style metadata of a .mat record, for filtering.
+
+    Nodes and directions are taken from the first two "node:direction" labels
+    of the record name (response, then reference); complex records count as
+    FRFs and real ones as general functions. The ordinate data of lazy
+    (v7.3) records is not read.
+    """
+    points = mat_name_points(getattr(record, 'Name', ''))
+    is_complex = emav_mat.field_summary(record, 'Y_Data', ends=False)[1]
+    metadata = {'type': 58, 'func_type': 4 if is_complex else 0,
+                'rsp_node': 0, 'rsp_dir': 0, 'ref_node': 0, 'ref_dir': 0}
+    for prefix, (node, direction) in zip(('rsp', 'ref'), points):
+        metadata[f'{prefix}_node'] = node
+        metadata[f'{prefix}_dir'] = direction
+    return metadata
+
+
+def mat_record_to_unv(record):
+    """Converts a .mat record struct into a dataset 58 dict that can be written as .unv."""
+    x = np.asarray(record.X_Data, dtype=float).ravel()
+    y = np.asarray(record.Y_Data).ravel()
+    dataset = mat_record_metadata(record)
+    steps = np.diff(x)
+    is_even = len(steps) > 0 and np.allclose(steps, steps[0])
+    dataset.update({
+        'binary': 0,
+        'id1': str(getattr(record, 'Name', 'NONE'))[:80],
+        'abscissa_spacing': int(is_even),
+        'abscissa_spec_data_type': 18 if str(getattr(record, 'X_Units', '')).lower() == 'hz' else 0,
+        'abscissa_axis_lab': str(getattr(record, 'X_Label', 'NONE'))[:20],
+        'abscissa_axis_units_lab': str(getattr(record, 'X_Units', 'NONE'))[:20],
+        'x': x,
+        'data': y,
+    })
+    return dataset
+
+
+def linear_amplitude_record(dataset):
+    """
+    Returns (record, converted) for a dataset 58 dict.
+
+    Complex FRFs become a real record holding the linear magnitude, matching
+    the format of reconstructed files. Real records (PSD, coherence, ...) are
+    returned unchanged with converted=False.
+    """
+    y = np.asarray(dataset['data'])
+    if y.ndim == 2 and y.shape[1] >= 2:
+        y = y[:, 0] + 1j * y[:, 1]
+    if not np.iscomplexobj(y):
+        return dataset, False
+    record = dict(dataset)
+    # In double precision, like the record type written, also for single precision (complex64) data
+    record['data'] = np.abs(y.astype(np.complex128))
+    record['ord_data_type'] = 4  # Real, double precision
+    record['ordinate_axis_lab'] = 'AMPLITUDE'  # Match reconstructed format
+    return record, True
+
+
+def write_unv58(filepath, records, binary=False):
+    """
+    Writes dataset 58 records to a new .unv file, as ASCII or binary 58b (see emav_unv.write_unv58).
+
+    The file is written under a temporary name and renamed when complete, so
+    an interrupted export never leaves a partial file that looks up to date.
+    """
+    tmp_path = f"{os.path.splitext(filepath)[0]}.{os.getpid()}.partial.unv"
+    with emav_perf.span('unv.write', file=filepath, records=len(records), binary=bool(binary)):
+        try:
+            emav_unv.write_unv58(tmp_path, records, binary=binary)
+            os.replace(tmp_path, filepath)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+# --- Batch export ---
+
+class RecordFilter:
+    """
+    Selects records by node, direction and function type.
+
+    Every criterion is a collection of accepted values, or None to accept
+    anything. nodes matches either the response or the reference node.
+    """
+    def __init__(self, nodes=None, rsp_nodes=None, ref_nodes=None, rsp_dirs=None, ref_dirs=None, func_types=None):
+        self.criteria = [
+            (('rsp_node', 'ref_node'), nodes),
+            (('rsp_node',), rsp_nodes),
+            (('ref_node',), ref_nodes),
+            (('rsp_dir',), rsp_dirs),
+            (('ref_dir',), ref_dirs),
+            (('func_type',), func_types),
+        ]
+
+    def __call__(self, metadata):
+        if metadata.get('type') != 58:
+            return False
+        for keys, accepted in self.criteria:
+            if accepted is not None and not any(metadata.get(key) in accepted for key in keys):
+                return False
+        return True
+
+
+def expand_inputs(patterns):
+    """Expands file names and glob patterns into a sorted list of .unv/.mat files."""
+    files = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for path in sorted(matches):
+            if path.lower().endswith(('.unv', '.mat')) and os.path.isfile(path) and path not in files:
+                files.append(path)
+    return files
+
+
+def output_paths(names, output_dir):
+    """Export paths for a file's record names; repeated names get a _2, _3, ... suffix."""
+    paths, seen = [], {}
+    for name in names:
+        filename = export_filename(name)
+        count = seen.get(filename, 0) + 1
+        seen[filename] = count
+        if count > 1:
+            filename = f"{filename[:-4]}_{count}.unv"
+        paths.append(os.path.join(output_dir, filename))
+    return paths
+
+
+def is_up_to_date(output_path, source_mtime):
+    try:
+        return os.path.getmtime(output_path) >= source_mtime
+    except OSError:
+        return False
+
+
+def export_unv_chunk(filepath, tasks, binary=False):
+    """Worker: exports [(dataset, output_path)] of one .unv file. Returns (written, bytes, failures)."""
+    written, size, failures = 0, 0, []
+    for dataset, output_path in tasks:
+        try:
+            record, _ = linear_amplitude_record(emav_unv.read_unv_record(filepath, dataset))
+            write_unv58(output_path, [record], binary)
+            written += 1
+            size += os.path.getsize(output_path)
+        except Exception as e:
+            failures.append((output_path, f"{type(e).__name__}: {e}"))
+    return written, size, failures
+
+
+def export_mat_file(filepath, output_dir, record_filter, force, binary=False):
+    """Worker: exports the selected records of one .mat file. Returns (written, skipped, bytes, failures)."""
+    mat_data = emav_mat.load_mat(filepath)
+    try:
+        return _export_mat_records(filepath, mat_data, output_dir, record_filter, force, binary)
+    finally:
+        emav_mat.close_mat(mat_data)
+
+
+def _export_mat_records(filepath, mat_data, output_dir, record_filter, force, binary):
+    records = [record for _, _, record in emav_mat.iter_mat_records(mat_data)
+               if record_filter(mat_record_metadata(record))]
+    source_mtime = os.path.getmtime(filepath)
+    paths = output_paths([str(getattr(record, 'Name', '')) for record in records], output_dir)
+    if paths:
+        os.makedirs(output_dir, exist_ok=True)
+    written, skipped, size, failures = 0, 0, 0, []
+    for record, output_path in zip(records, paths):
+        if not force and is_up_to_date(output_path, source_mtime):
+            skipped += 1
+            continue
+        try:
+            converted, _ = linear_amplitude_record(mat_record_to_unv(record))
+            write_unv58(output_path, [converted], binary)
+            written += 1
+            size += os.path.getsize(output_path)
+        except Exception as e:
+            failures.append((output_path, f"{type(e).__name__}: {e}"))
+    return written, skipped, size, failures
+
+
+def batch_export(files, output_dir, record_filter=None, jobs=None, force=False, binary=False):
+    """
+    Exports the selected records of every file to linear-amplitude .unv files (binary 58b if binary is set).
+
+    Each source file gets its own sub-folder of output_dir. .unv files are
+    indexed here and their records exported in chunks by a process pool;
+    .mat files are exported one file per worker. Outputs newer than their
+    source file are skipped unless force is set. Prints progress and
+    throughput; returns a dict of totals.
+    """
+    record_filter = record_filter or RecordFilter()
+    totals = {'files': 0, 'written': 0, 'skipped': 0, 'failed': 0, 'bytes_read': 0, 'bytes_written': 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {}
+        for filepath in files:
+            file_output_dir = os.path.join(output_dir, os.path.splitext(os.path.basename(filepath))[0])
+            totals['files'] += 1
+            totals['bytes_read'] += os.path.getsize(filepath)
+            if filepath.lower().endswith('.mat'):
+                futures[pool.submit(export_mat_file, filepath, file_output_dir, record_filter, force, binary)] = filepath
+                continue
+
+            datasets = [(i, dataset) for i, dataset in enumerate(emav_unv.iter_unv_index(filepath))
+                        if record_filter(dataset)]
+            paths = output_paths([record_label(dataset, i) for i, dataset in datasets], file_output_dir)
+            source_mtime = os.path.getmtime(filepath)
+            tasks = []
+            for (_, dataset), output_path in zip(datasets, paths):
+                if not force and is_up_to_date(output_path, source_mtime):
+                    totals['skipped'] += 1
+                else:
+                    tasks.append((dataset, output_path))
+            print(f"{filepath}: {len(datasets)} records selected, {len(tasks)} to export")
+            if tasks:
+                os.makedirs(file_output_dir, exist_ok=True)
+            for i in range(0, len(tasks), EXPORT_CHUNK_SIZE):
+                futures[pool.submit(export_unv_chunk, filepath, tasks[i:i + EXPORT_CHUNK_SIZE], binary)] = filepath
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"ERROR: {futures[future]}: {type(e).__name__}: {e}")
+                totals['failed'] += 1
+                continue
+            if len(result) == 4:
+                written, skipped, size, failures = result
+                totals['skipped'] += skipped
+                print(f"{futures[future]}: {written + skipped + len(failures)} records selected, {skipped} up to date")
+            else:
+                written, size, failures = result
+            totals['written'] += written
+            totals['bytes_written'] += size
+            totals['failed'] += len(failures)
+            for output_path, message in failures:
+                print(f"ERROR: {output_path}: {message}")
+
+    elapsed = time.perf_counter() - start
+    totals['seconds'] = elapsed
+    rate = totals['written'] / elapsed if elapsed > 0 else 0.0
+    read_rate = totals['bytes_read'] / 1e6 / elapsed if elapsed > 0 else 0.0
+    print(f"Exported {totals['written']} records from {totals['files']} files in {elapsed:.2f} s "
+          f"({totals['skipped']} up to date, {totals['failed']} failed)")
+    print(f"Throughput: {rate:.1f} records/s, {read_rate:.1f} MB/s read, "
+          f"{totals['bytes_written'] / 1e6:.1f} MB written")
+    return totals
@@ -0,0 +1,196 @@
+# EMAV - Record metadata index and filter queries
+# Keeps the header metadata of every loaded record (nodes, directions,
+# function type, data type, length, frequency range, units) in columnar
+# arrays, so that a filter such as "ref=1 dir=+Z type=FRF f>2000" is a few
+# vectorized comparisons instead of a pass over the records. No GUI imports.
+import re
+import numpy as np
+import emav_unv
+import emav_mat
+import emav_export
+
+INT_COLUMNS = ('rsp_node', 'rsp_dir', 'ref_node', 'ref_dir', 'func_type', 'ord_data_type', 'num_pts')
+FLOAT_COLUMNS = ('f_min', 'f_max')
+INITIAL_CAPACITY = 1024
+
+# Query field names and the column(s) they compare. 'node' matches the
+# response or the reference node; 'f' is the frequency range (see match()).
+QUERY_FIELDS = {
+    'node': ('rsp_node', 'ref_node'), 'rsp': ('rsp_node',), 'resp': ('rsp_node',), 'ref': ('ref_node',),
+    'dir': ('rsp_dir',), 'rspdir': ('rsp_dir',), 'refdir': ('ref_dir',),
+    'type': ('func_type',), 'datatype': ('ord_data_type',),
+    'n': ('num_pts',), 'len': ('num_pts',), 'points': ('num_pts',),
+    'f': ('f_min', 'f_max'), 'fmin': ('f_min',), 'fmax': ('f_max',),
+    'units': ('x_units',),
+}
+_QUERY_VALUE_PARSERS = {
+    'rsp_dir': emav_unv.parse_direction, 'ref_dir': emav_unv.parse_direction,
+    'func_type': emav_unv.parse_function_type,
+    'f_min': float, 'f_max': float, 'x_units': lambda text: text.lower(),
+}
+_OPERATORS = ('<=', '>=', '!=', '==', '=', '<', '>')
+_TERM_PATTERN = re.compile(r'^([A-Za-z_]+)(<=|>=|!=|==|=|<|>)(.+)$')
+_OPERATOR_SPACES = re.compile(r'\s*(<=|>=|!=|==|=|<|>)\s*')
+
+
+def unv_metadata(dataset):
+    """Index metadata of a .unv dataset 58 index entry, taken from its header only."""
+    num_pts = dataset.get('num_pts', 0)
+    f_min = f_max = np.nan
+    # Uneven abscissas are stored with the data, so their range is unknown until the record is read
+    if dataset.get('abscissa_spacing', 1) == 1 and 'abscissa_min' in dataset:
+        f_min = dataset['abscissa_min']
+        f_max = f_min + dataset.get('abscissa_inc', 0.0) * max(num_pts - 1, 0)
+    return {
+        'rsp_node': dataset.get('rsp_node', 0), 'rsp_dir': dataset.get('rsp_dir', 0),
+        'ref_node': dataset.get('ref_node', 0), 'ref_dir': dataset.get('ref_dir', 0),
+        'func_type': dataset.get('func_type', 0), 'ord_data_type': dataset.get('ord_data_type', 0),
+        'num_pts': num_pts, 'f_min': f_min, 'f_max': f_max,
+        'x_units': str(dataset.get('abscissa_axis_units_lab', '')),
+    }
+
+
+def mat_metadata(record, name):
+    """
+    Index metadata of a .mat record named name.
+
+    Nodes and directions come from the "node:direction" labels of the name,
+    as for the batch export. Lazy (v7.3) records only read the first and last
+    abscissa value from the file.
+    """
+    points = emav_export.mat_name_points(name)
+    num_pts, _, _, x_first, x_last = emav_mat.field_summary(record, 'X_Data')
+    _, is_complex, is_single, _, _ = emav_mat.field_summary(record, 'Y_Data', ends=False)
+    metadata = {
+        'rsp_node': 0, 'rsp_dir': 0, 'ref_node': 0, 'ref_dir': 0,
+        'func_type': 4 if is_complex else 0,
+        # Dataset 58 ordinate data types: 2/4 real single/double, 5/6 complex single/double
+        'ord_data_type': (5 if is_single else 6) if is_complex else (2 if is_single else 4),
+        'num_pts': num_pts, 'f_min': float(np.real(x_first)), 'f_max': float(np.real(x_last)),
+        'x_units': str(getattr(record, 'X_Units', '')),
+    }
+    for prefix, (node, direction) in zip(('rsp', 'ref'), points):
+        metadata[f'{prefix}_node'] = node
+        metadata[f'{prefix}_dir'] = direction
+    return metadata
+
+
+def parse_query(text):
+    """
+    Parses a filter query into a list of (column names, operator, values) terms.
+
+    Terms are separated by spaces, e.g. "ref=1 dir=+Z,+Y type=FRF f>2000".
+    Several comma-separated values match any of them. A word without an
+    operator must appear in the record name; its term is (None, 'in', word).
+    Raises ValueError for an unknown field or value.
+    """
+    terms = []
+    for word in _OPERATOR_SPACES.sub(r'\1', text.strip()).split():
+        match = _TERM_PATTERN.match(word)
+        if match is None:
+            if any(op in word for op in _OPERATORS):
+                raise ValueError(f"Incomplete filter term: {word}")
+            terms.append((None, 'in', word.lower()))
+            continue
+        field, op, values = match.groups()
+        columns = QUERY_FIELDS.get(field.lower())
+        if columns is None:
+            raise ValueError(f"Unknown filter field: {field}")
+        parse = _QUERY_VALUE_PARSERS.get(columns[0], int)
+        try:
+            values = [parse(value) for value in values.split(',') if value]
+        except ValueError as e:
+            raise ValueError(f"Invalid value in {word}: {e}") from None
+        if not values:
+            raise ValueError(f"Missing value in {word}")
+        if len(values) > 1 and op not in ('=', '==', '!='):
+            raise ValueError(f"Only = and != accept several values: {word}")
+        terms.append((columns, '=' if op == '==' else op, values))
+    return terms
+
+
+class MetadataIndex:
+    """
+    Columnar metadata of the records of a Testlab file, in the order they were added.
+
+    keys[row] is the record key (tree iid) of a row. Columns grow by
+    doubling, so records can be added while a file is still loading.
+    """
+    def __init__(self):
+        self.keys = []
+        self.names = []
+        self.size = 0
+        self.columns = {name: np.zeros(INITIAL_CAPACITY, dtype=np.int64) for name in INT_COLUMNS}
+        self.columns.update({name: np.full(INITIAL_CAPACITY, np.nan) for name in FLOAT_COLUMNS})
+        self.columns['x_units'] = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self.units = {}  # Lower-case unit label -> code in the x_units column
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key, name, metadata):
+        """Appends a record with the metadata of unv_metadata() or mat_metadata()."""
+        if self.size == len(self.columns['num_pts']):
+            for column, values in self.columns.items():
+                grown = np.zeros(2 * len(values), dtype=values.dtype)
+                grown[:self.size] = values
+                self.columns[column] = grown
+        row = self.size
+        for column in INT_COLUMNS + FLOAT_COLUMNS:
+            self.columns[column][row] = metadata[column]
+        units = metadata['x_units'].strip().lower()
+        self.columns['x_units'][row] = self.units.setdefault(units, len(self.units))
+        self.keys.append(key)
+        self.names.append(str(name).lower())
+        self.size += 1
+
+    def column(self, name):
+        return self.columns[name][:self.size]
+
+    def match(self, terms, start=0):
+        """Returns the rows from start onwards that satisfy every parse_query() term."""
+        mask = np.ones(self.size - start, dtype=bool)
+        for columns, op, values in terms:
+            if columns is None:
+                mask &= np.fromiter((values in name for name in self.names[start:]), dtype=bool,
+                                    count=self.size - start)
+            elif columns == QUERY_FIELDS['f']:
+                mask &= self._match_frequency(op, values, start)
+            else:
+                any_column = np.zeros_like(mask)
+                for column in columns:
+                    any_column |= self._compare(column, op, values, start)
+                mask &= any_column
+        return start + np.flatnonzero(mask)
+
+    def _compare(self, column, op, values, start):
+        data = self.columns[column][start:self.size]
+        if column == 'x_units':
+            values = [self.units.get(value, -1) for value in values]
+        if op in ('=', '!='):
+            hit = np.isin(data, values)
+            return ~hit if op == '!=' else hit
+        value = values[0]
+        return {'<': data < value, '<=': data <= value, '>': data > value, '>=': data >= value}[op]
+
+    def _match_frequency(self, op, values, start):
+        """
+        f>v and f>=v: the record reaches above v; f<v and f<=v: it starts below v;
+        f=v1,v2: one of the values lies within its range, f!=v1,v2: none does.
+        Records with an unknown range never match.
+        """
+        f_min = self.columns['f_min'][start:self.size]
+        f_max = self.columns['f_max'][start:self.size]
+        value = values[0]
+        if op == '>':
+            return f_max > value
+        if op == '>=':
+            return f_max >= value
+        if op == '<':
+            return f_min < value
+        if op == '<=':
+            return f_min <= value
+        inside = np.zeros(len(f_min), dtype=bool)
+        for value in values:
+            inside |= (f_min <= value) & (value <= f_max)
+        return ~inside & ~np.isnan(f_min) if op == '!=' else inside
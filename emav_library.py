@@ -0,0 +1,382 @@
+# EMAV - Testlab file library
+# A test campaign is many .unv/.mat files. The files of a folder are scanned in
+# parallel by a process pool whose workers stream record batches back through
+# a bounded queue; only headers and index metadata cross it, the record data
+# stays in the files (or the cache) until a record is viewed. No GUI imports.
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import emav_cache
+import emav_export
+import emav_index
+import emav_mat
+import emav_unv
+
+# Records per message posted by a scan worker
+SCAN_BATCH_SIZE = 500
+# Messages the scan workers may queue ahead of the loading thread; they wait while it is full
+SCAN_QUEUE_SIZE = 16
+# Seconds between checks for cancellation while waiting on the queue
+SCAN_POLL_INTERVAL = 0.1
+# .mat files of a library opened on demand that are kept open at the same time
+MAX_OPEN_FILES = 4
+
+
+def file_type(filepath):
+    """'unv' or 'mat' by file extension, None for other files."""
+    extension = os.path.splitext(filepath)[1].lower()
+    return {'.unv': 'unv', '.mat': 'mat'}.get(extension)
+
+
+def library_files(folder):
+    """The .unv/.mat files in folder and its sub-folders, sorted by path."""
+    return emav_export.expand_inputs([os.path.join(folder, '**', '*')])
+
+
+def scan_file(filepath, file_type, cache_entry=None):
+    """
+    Starts scanning a Testlab file for its records.
+
+    Returns (data, items). items yields (item, progress) pairs, with item an
+    (position, dataset) pair of the .unv index or a (key, index, record,
+    name, metadata) tuple for .mat files. data is the list of .unv index
+    datasets (filled in as items is consumed) or the load_mat() result. The
+    records are read from cache_entry instead of the file when it is given.
+    """
+    if file_type == 'unv':
+        total_bytes = max(os.path.getsize(filepath), 1)
+        data = []
+        source = cache_entry.records if cache_entry is not None else emav_unv.iter_unv_index(filepath)
+
+        def items():
+            for i, dataset in enumerate(source):
+                data.append(dataset)
+                yield (i, dataset), dataset['end_offset'] / total_bytes
+        return data, items()
+
+    if cache_entry is not None:
+        data = emav_cache.mat_data_from_cache(cache_entry)
+    else:
+        data = emav_mat.load_mat(filepath)
+    records = list(emav_mat.iter_mat_records(data))
+
+    def items():
+        for n, (key, index, record) in enumerate(records, 1):
+            # Lazy v7.3 records read their name and index metadata from the file
+            name = getattr(record, 'Name', None)
+            name = None if name is None else str(name)
+            metadata = emav_index.mat_metadata(record, '' if name is None else name)
+            yield (key, index, record, name, metadata), n / len(records)
+    return data, items()
+
+
+# --- Scan workers (run in the pool processes) ---
+
+_worker_messages = None
+_worker_cancel = None
+
+
+def init_scan_worker(messages, cancel):
+    global _worker_messages, _worker_cancel
+    _worker_messages = messages
+    _worker_cancel = cancel
+    # After a cancel nothing reads the queue any more; the process must still be able to exit
+    messages.cancel_join_thread()
+
+
+def _post(*message):
+    """Queues a message for the loading thread; gives up (returns False) once the load is cancelled."""
+    while not _worker_cancel.is_set():
+        try:
+            _worker_messages.put(message, timeout=SCAN_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def scan_worker(file_no, filepath, file_type):
+    """
+    Pool worker: scans one file and posts ('records', file_no, batch, progress)
+    messages, then ('done', file_no, count) or ('error', file_no, error, details).
+
+    .mat records are posted without the record struct, which cannot leave the
+    process; the library opens the file when one of them is viewed.
+    """
+    data = None
+    try:
+        data, items = scan_file(filepath, file_type)
+        batch = []
+        count = 0
+        for item, progress in items:
+            if _worker_cancel.is_set():
+                return
+            if file_type == 'mat':
+                item = item[:2] + (None,) + item[3:]
+            batch.append(item)
+            count += 1
+            if len(batch) >= SCAN_BATCH_SIZE:
+                if not _post('records', file_no, batch, progress):
+                    return
+                batch = []
+        _post('records', file_no, batch, 1.0)
+        _post('done', file_no, count)
+    except Exception as e:
+        _post('error', file_no, f"{type(e).__name__}: {e}", traceback.format_exc())
+    finally:
+        emav_mat.close_mat(data)
+
+
+def cache_worker(filepath, file_type, cache_dir):
+    """Pool worker: parses a file again and writes its cache entry, so that it opens without a worker next time."""
+    data = None
+    try:
+        signature = emav_cache.file_signature(filepath)
+        data, items = scan_file(filepath, file_type)
+        for _ in items:
+            pass
+        contents = emav_cache.cache_contents(filepath, file_type, data)
+        if contents is not None:
+            emav_cache.TestlabCache(cache_dir).store(filepath, file_type, signature, *contents)
+    except Exception as e:
+        print(f"Could not write cache for {filepath}: {e}")
+    finally:
+        emav_mat.close_mat(data)
+
+
+def scan_library(files, post, cancel_event, cache=None, jobs=None):
+    """
+    Scans the TestlabFiles files, posting what is found through post(kind, *payload).
+
+    Files with an up-to-date cache entry are read in the calling thread, the
+    others by a pool of jobs processes (default: one per CPU). Posts, per file,
+    ('records', file_no, batch, progress, count) messages, where progress
+    and count cover the whole library, then ('file_done', file_no, data,
+    cache_entry, count) or ('file_error', file_no, error, details); data is
+    None for files scanned by the pool. Finally posts ('library_done',
+    cancelled). The pool then writes the cache entries of the files it
+    scanned (unless cache is None), and this call returns when it is done.
+    """
+    cached, to_scan = [], []
+    for testlab_file in files:
+        entry = None
+        if cache is not None:
+            try:
+                entry = cache.load(testlab_file.path)
+            except Exception as e:
+                print(f"Ignoring unreadable cache entry: {e}")
+        if entry is not None and entry.kind == testlab_file.type:
+            cached.append((testlab_file, entry))
+        else:
+            to_scan.append(testlab_file)
+
+    if not to_scan:
+        post('library_done', not _read_cached(cached, _RecordPoster(files, post), cancel_event))
+        return
+    # Spawned rather than forked: the loading process runs Tk and other threads
+    context = multiprocessing.get_context('spawn')
+    messages = context.Queue(SCAN_QUEUE_SIZE)
+    cancel = context.Event()
+    pool = ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count() or 1, len(to_scan)), mp_context=context,
+                               initializer=init_scan_worker, initargs=(messages, cancel))
+    try:
+        futures = {pool.submit(scan_worker, testlab_file.number, testlab_file.path, testlab_file.type): testlab_file.number
+                   for testlab_file in to_scan}
+        poster = _RecordPoster(files, post)
+        failed = set()
+        completed = (_read_cached(cached, poster, cancel_event)
+                     and _receive(messages, futures, poster, failed, cancel_event))
+        post('library_done', not completed)
+        if completed and cache is not None:
+            for testlab_file in to_scan:
+                if testlab_file.number not in failed:
+                    pool.submit(cache_worker, testlab_file.path, testlab_file.type, cache.cache_dir)
+    finally:
+        if cancel_event.is_set():
+            cancel.set()
+        pool.shutdown(wait=not cancel_event.is_set(), cancel_futures=cancel_event.is_set())
+
+
+class _RecordPoster:
+    """Posts the record batches of the library files with the progress and record count of the whole library."""
+    def __init__(self, files, post):
+        self.post = post
+        self.progress = {testlab_file.number: 0.0 for testlab_file in files}
+        self.count = 0
+
+    def __call__(self, file_no, batch, file_progress):
+        self.progress[file_no] = file_progress
+        self.count += len(batch)
+        self.post('records', file_no, batch, sum(self.progress.values()) / len(self.progress), self.count)
+
+
+def _read_cached(cached, poster, cancel_event):
+    """Posts the records of the (TestlabFile, cache entry) pairs; returns False if cancelled."""
+    for testlab_file, entry in cached:
+        try:
+            data, items = scan_file(testlab_file.path, testlab_file.type, entry)
+            batch = []
+            count = 0
+            for item, file_progress in items:
+                if cancel_event.is_set():
+                    return False
+                batch.append(item)
+                count += 1
+                if len(batch) >= SCAN_BATCH_SIZE:
+                    poster(testlab_file.number, batch, file_progress)
+                    batch = []
+            poster(testlab_file.number, batch, 1.0)
+            poster.post('file_done', testlab_file.number, data, entry, count)
+        except Exception as e:
+            poster.post('file_error', testlab_file.number, f"{type(e).__name__}: {e}", traceback.format_exc())
+    return True
+
+
+def _receive(messages, futures, poster, failed, cancel_event):
+    """Forwards the messages of the scan workers until every file is scanned; returns False if cancelled."""
+    unfinished = set(futures.values())
+    while unfinished:
+        if cancel_event.is_set():
+            return False
+        try:
+            message = messages.get(timeout=SCAN_POLL_INTERVAL)
+        except queue.Empty:
+            for future, file_no in futures.items():
+                if file_no in unfinished and future.done() and future.exception() is not None:
+                    # The worker process died before it could report
+                    error = future.exception()
+                    unfinished.discard(file_no)
+                    failed.add(file_no)
+                    poster.post('file_error', file_no, f"{type(error).__name__}: {error}", "")
+            continue
+        kind, file_no = message[:2]
+        if kind == 'records':
+            poster(file_no, *message[2:])
+            continue
+        unfinished.discard(file_no)
+        if kind == 'done':
+            poster.post('file_done', file_no, None, None, message[2])
+        else:
+            failed.add(file_no)
+            poster.post('file_error', file_no, *message[2:])
+    return True
+
+
+class TestlabFile:
+    """
+    One Testlab file of the tree.
+
+    data is the list of .unv index datasets or the load_mat() result. It stays
+    None for .mat files scanned by a library worker until one of their records
+    is read; records then maps (key, index) to the record structs.
+    signature is the emav_cache.file_signature() of the file as it was when
+    data was scanned, or None if data did not come from a full scan.
+    """
+    def __init__(self, number, path, file_type, label=None):
+        self.number = number
+        self.path = path
+        self.type = file_type
+        self.label = label or os.path.basename(path)
+        self.data = None
+        self.cache_entry = None
+        self.signature = None
+        self.records = None
+
+
+class Library:
+    """
+    The Testlab files of the tree, numbered in the order they were added.
+
+    Reads the numeric data of their records. .mat files scanned by a worker
+    are opened when a record is first read, and at most max_open of them are
+    kept open, least recently used first to be closed.
+    """
+    def __init__(self, cache=None, max_open=MAX_OPEN_FILES):
+        self.files = []
+        self.cache = cache
+        self.max_open = max_open
+        self._opened = collections.OrderedDict()
+        # Records are also read by the prefetch thread of the application
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.files)
+
+    def add(self, path, file_type, label=None):
+        testlab_file = TestlabFile(len(self.files), path, file_type, label)
+        self.files.append(testlab_file)
+        return testlab_file
+
+    def read_record(self, testlab_file, record):
+        """
+        Returns a record of testlab_file with its numeric data: a .unv dataset
+        with 'x' and 'data', or a .mat record struct. A .mat record scanned by
+        a worker is given as its (key, index).
+        """
+        if testlab_file.type == 'unv':
+            if 'data' in record:
+                return record
+            if testlab_file.cache_entry is not None and 'cache_slot' in record:
+                x_data, y_data = testlab_file.cache_entry.xy(record['cache_slot'])
+                return dict(record, x=x_data, data=y_data)
+            return emav_unv.read_unv_record(testlab_file.path, record)
+        if isinstance(record, tuple):
+            return self._open(testlab_file)[record]
+        return record
+
+    def record_slot(self, testlab_file, record):
+        """
+        Returns the (store, slot) holding the data of a record when it is in a
+        RecordStore (a cache entry or a packed .mat file), otherwise None.
+        """
+        if testlab_file.type == 'unv':
+            if testlab_file.cache_entry is not None and 'cache_slot' in record:
+                return testlab_file.cache_entry.store, record['cache_slot']
+            return None
+        if isinstance(record, tuple):
+            record = self._open(testlab_file)[record]
+        return emav_mat.stored_slot(record)
+
+    def _open(self, testlab_file):
+        """Returns the records of a .mat file opened on demand, opening it if needed."""
+        with self._lock:
+            return self._open_records(testlab_file)
+
+    def _open_records(self, testlab_file):
+        if testlab_file.records is None:
+            entry = None
+            if self.cache is not None:
+                try:
+                    entry = self.cache.load(testlab_file.path)
+                except Exception as e:
+                    print(f"Ignoring unreadable cache entry: {e}")
+            if entry is not None and entry.kind == 'mat':
+                # Cached records keep the key and index they had in the file
+                testlab_file.records = {(record['key'], record['index']):
+                                        emav_mat.StoredMatRecord(entry.store, slot, record['fields'])
+                                        for slot, record in enumerate(entry.records)}
+            else:
+                testlab_file.data = emav_mat.load_mat(testlab_file.path)
+                testlab_file.records = {(key, index): record
+                                        for key, index, record in emav_mat.iter_mat_records(testlab_file.data)}
+            self._opened[testlab_file.number] = testlab_file
+            while len(self._opened) > self.max_open:
+                _, oldest = self._opened.popitem(last=False)
+                emav_mat.close_mat(oldest.data)
+                oldest.data = None
+                oldest.records = None
+        self._opened.move_to_end(testlab_file.number)
+        return testlab_file.records
+
+    def close(self):
+        """Closes every open file."""
+        with self._lock:
+            for testlab_file in self.files:
+                emav_mat.close_mat(testlab_file.data)
+                testlab_file.data = None
+                testlab_file.records = None
+            self._opened.clear()
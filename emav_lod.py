@@ -0,0 +1,67 @@
+# EMAV - Level-of-detail decimation for plotting long records
+# A min/max pyramid lets very long curves be drawn with about two points per
+# screen pixel while keeping every peak exactly where it is in the raw data.
+import numpy as np
+
+# Levels stop being built once they have fewer buckets than this
+MIN_LEVEL_BUCKETS = 256
+# Records shorter than this are always drawn at full resolution
+MIN_DECIMATION_POINTS = 4096
+
+
+class MinMaxPyramid:
+    """
+    Min/max envelope pyramid of a curve y(x), built once per record.
+
+    Level k groups the raw points into buckets of 2**k and keeps, for each
+    bucket, the index of its minimum and of its maximum. view() picks the
+    coarsest level that still has at least one bucket per pixel over the
+    visible range and returns those min/max points in x order, so peaks and
+    resonances are never lost.
+    """
+    def __init__(self, x, y):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.levels = []
+        n = len(self.y)
+        if n < MIN_DECIMATION_POINTS or len(self.x) != n or np.any(np.diff(self.x) < 0):
+            return  # Short or unsorted curves are drawn as they are
+
+        index_dtype = np.int32 if n < 2 ** 31 else np.int64
+        lo = hi = np.arange(n, dtype=index_dtype)
+        bucket = 1
+        while len(lo) > MIN_LEVEL_BUCKETS:
+            if len(lo) % 2:
+                lo = np.append(lo, lo[-1])
+                hi = np.append(hi, hi[-1])
+            lo = np.where(self.y[lo[1::2]] < self.y[lo[0::2]], lo[1::2], lo[0::2])
+            hi = np.where(self.y[hi[1::2]] > self.y[hi[0::2]], hi[1::2], hi[0::2])
+            bucket *= 2
+            self.levels.append((bucket, lo, hi))
+
+    def view(self, x_min=None, x_max=None, n_pixels=1000):
+        """Returns the (x, y) points to draw for the range [x_min, x_max] on n_pixels of width."""
+        n = len(self.y)
+        i0 = 0 if x_min is None else max(int(np.searchsorted(self.x, x_min, side='left')) - 1, 0)
+        i1 = n if x_max is None else min(int(np.searchsorted(self.x, x_max, side='right')) + 1, n)
+        if i1 <= i0:
+            return self.x[:0], self.y[:0]
+
+        max_bucket = (i1 - i0) / max(int(n_pixels), 1)
+        level = None
+        for candidate in self.levels:
+            if candidate[0] > max_bucket:
+                break
+            level = candidate
+        if level is None:
+            return self.x[i0:i1], self.y[i0:i1]
+
+        bucket, lo, hi = level
+        j0 = i0 // bucket
+        j1 = min(-(-i1 // bucket), len(lo))
+        lo = lo[j0:j1]
+        hi = hi[j0:j1]
+        idx = np.empty(2 * len(lo), dtype=lo.dtype)
+        idx[0::2] = np.minimum(lo, hi)
+        idx[1::2] = np.maximum(lo, hi)
+        return self.x[idx], self.y[idx]
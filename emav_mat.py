@@ -0,0 +1,358 @@
+# EMAV - MATLAB (.mat) Testlab file helpers
+# v5/v7 files are read with scipy.io, imported when the first one is read (it
+# takes longer to import than the rest of EMAV's data code). MATLAB v7.3 files are HDF5 files and are
+# opened lazily with h5py: only the structure and the record names are read
+# up front, X_Data/Y_Data are read from the file when a record is accessed.
+import numpy as np
+import emav_perf
+import emav_store
+
+# v7.3 files start with a 512-byte MATLAB header followed by the HDF5 signature
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+# Fields of a v7.3 record with at most this many elements are kept once read
+SMALL_FIELD_SIZE = 16
+# field_summary() reads v7.3 fields up to this size whole rather than element by element
+SUMMARY_READ_SIZE = 65536
+
+
+def is_hdf5_mat(filepath):
+    """True for a MATLAB v7.3 (HDF5) file."""
+    with open(filepath, 'rb') as f:
+        header = f.read(520)
+    return header[512:520] == HDF5_SIGNATURE or header[:8] == HDF5_SIGNATURE
+
+
+def load_mat(filepath):
+    """
+    Loads a Testlab .mat file as a dict of variables with records as attribute-style structs.
+
+    v5/v7 files are read completely by scipy.io.loadmat and their record data
+    is packed into a RecordStore (see pack_mat_data()). v7.3 files return a
+    MatFileV73 whose records read their fields on access; it keeps the file
+    open until close_mat() is called.
+    """
+    if is_hdf5_mat(filepath):
+        with emav_perf.span('mat.open', file=filepath, version='7.3'):
+            return MatFileV73(filepath)
+    import scipy.io as sio
+    with emav_perf.span('mat.load', file=filepath):
+        mat_data = sio.loadmat(filepath, struct_as_record=False, squeeze_me=True)
+    with emav_perf.span('mat.pack', file=filepath):
+        return pack_mat_data(mat_data)
+
+
+def close_mat(mat_data):
+    """Releases the file behind a load_mat() result (only v7.3 files hold one open)."""
+    close = getattr(mat_data, 'close', None)
+    if close is not None:
+        close()
+
+
+def is_mat_record(value):
+    """True for a struct holding a Testlab record (Name, X_Data and Y_Data fields)."""
+    fieldnames = getattr(value, '_fieldnames', None)
+    if fieldnames is not None:
+        # Checked by name so that lazy records are not read
+        return {'Name', 'X_Data', 'Y_Data'}.issubset(fieldnames)
+    return hasattr(value, 'Name') and hasattr(value, 'X_Data') and hasattr(value, 'Y_Data')
+
+
+def iter_mat_records(mat_data):
+    """
+    Yields (key, index, record) for every record struct in a loadmat() dict.
+
+    Records are found either inside object arrays (index is the position in
+    the array) or as top-level struct variables (index is None). MATLAB
+    metadata entries ('__header__', ...) and other variables are skipped.
+    """
+    for key, value in mat_data.items():
+        if key.startswith('__'):
+            continue
+        if isinstance(value, np.ndarray) and value.dtype.kind == 'O':
+            for i, record in enumerate(value.ravel()):
+                if is_mat_record(record):
+                    yield key, i, record
+        elif hasattr(value, '_fieldnames') and is_mat_record(value):
+            yield key, None, value
+
+
+# --- Packed records ---
+
+def _mat_scalar(value):
+    """Returns value as a JSON-serialisable scalar, or None if it is not one."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bool, int, float, np.integer, np.floating)):
+        return value.item() if isinstance(value, np.generic) else value
+    if isinstance(value, np.ndarray) and value.size == 1 and value.dtype.kind in 'iufU':
+        return value.item()
+    return None
+
+
+def record_table(mat_data):
+    """
+    Splits the records of a loadmat() dict into a metadata table and their data.
+
+    Returns (records, arrays): records[i] is {'key', 'index', 'fields'} with
+    the scalar fields of the record, arrays[i] its (X_Data, Y_Data). Returns
+    None if a record does not hold 1-D numeric data of matching length.
+    """
+    records, arrays = [], []
+    for key, index, record in iter_mat_records(mat_data):
+        x = np.asarray(record.X_Data)
+        y = np.asarray(record.Y_Data)
+        if x.ndim != 1 or y.ndim != 1 or len(x) != len(y) or y.dtype.kind not in 'iufc':
+            return None
+        fields = {}
+        for name in record._fieldnames:
+            if name in ('X_Data', 'Y_Data'):
+                continue
+            scalar = _mat_scalar(getattr(record, name))
+            if scalar is not None:
+                fields[name] = scalar
+        arrays.append((x, y))
+        records.append({'key': key, 'index': index, 'fields': fields})
+    return records, arrays
+
+
+class StoredMatRecord:
+    """Stands in for a scipy.io mat_struct whose X_Data/Y_Data are held in a RecordStore."""
+    def __init__(self, store, slot, fields):
+        self.__dict__.update(fields)
+        self._store = store
+        self._slot = slot
+        self._fieldnames = list(fields) + ['X_Data', 'Y_Data']
+
+    @property
+    def X_Data(self):
+        return self._store.xy(self._slot)[0]
+
+    @property
+    def Y_Data(self):
+        return self._store.xy(self._slot)[1]
+
+
+def stored_slot(record):
+    """The (store, slot) holding the data of a StoredMatRecord, None for other records."""
+    if isinstance(record, StoredMatRecord):
+        return record._store, record._slot
+    return None
+
+
+def mat_data_from_store(store, records):
+    """
+    Rebuilds a loadmat()-like dict of StoredMatRecords from a record_table() table.
+
+    The data of records[i] is slot i of store.
+    """
+    mat_data = {}
+    arrays = {}
+    for slot, record in enumerate(records):
+        struct = StoredMatRecord(store, slot, record['fields'])
+        if record['index'] is None:
+            mat_data[record['key']] = struct
+        else:
+            # Placeholder keeps the original variable order
+            mat_data.setdefault(record['key'], None)
+            arrays.setdefault(record['key'], []).append(struct)
+    for key, structs in arrays.items():
+        value = np.empty(len(structs), dtype=object)
+        value[:] = structs
+        mat_data[key] = value
+    return mat_data
+
+
+def pack_mat_data(mat_data):
+    """
+    Moves the record data of a loadmat() dict into one RecordStore.
+
+    Records sharing a frequency axis then hold it once and the ordinates sit
+    in one contiguous block per dtype, instead of two arrays per record.
+    Returns a dict of StoredMatRecords (other variables are dropped), or
+    mat_data unchanged if its records cannot be packed.
+    """
+    table = record_table(mat_data)
+    if table is None:
+        return mat_data
+    records, arrays = table
+    store = emav_store.RecordStore.build([(len(y), y.dtype) for _, y in arrays], arrays.__getitem__)
+    return mat_data_from_store(store, records)
+
+
+# --- MATLAB v7.3 (HDF5) ---
+
+def _import_h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("Reading MATLAB v7.3 .mat files requires the h5py package.") from None
+    return h5py
+
+
+def _matlab_class(obj):
+    matlab_class = obj.attrs.get('MATLAB_class', b'')
+    return matlab_class.decode('ascii') if isinstance(matlab_class, bytes) else str(matlab_class)
+
+
+def _is_struct_array(group):
+    """True if the fields of a struct group hold one reference per element (a struct array)."""
+    for member in group.values():
+        return (hasattr(member, 'dtype') and member.dtype.kind == 'O'
+                and 'MATLAB_class' not in member.attrs)
+    return False
+
+
+def _read_h5_value(obj):
+    """Reads an HDF5 object of a v7.3 file the way loadmat(squeeze_me=True) would return it."""
+    if not hasattr(obj, 'dtype'):
+        return _lazy_struct(obj)
+    matlab_class = _matlab_class(obj)
+    if 'MATLAB_empty' in obj.attrs and obj.attrs['MATLAB_empty']:
+        return '' if matlab_class == 'char' else np.empty(0)
+    # HDF5 holds MATLAB's column-major arrays with the dimensions reversed
+    value = obj[()].T
+    if matlab_class == 'cell':
+        cells = np.empty(value.shape, dtype=object)
+        for index, ref in np.ndenumerate(value):
+            cells[index] = _read_h5_value(obj.file[ref])
+        value = cells
+    elif matlab_class == 'char':
+        return ''.join(map(chr, value.ravel()))
+    elif value.dtype.names and 'real' in value.dtype.names:
+        value = value['real'] + 1j * value['imag']
+    elif matlab_class == 'logical':
+        value = value.astype(bool)
+    value = np.squeeze(value)
+    if value.ndim == 0:
+        return value.item()
+    return value
+
+
+def _lazy_struct(group):
+    """A struct group as one LazyMatRecord, or an object array of them for a struct array."""
+    if not _is_struct_array(group):
+        return LazyMatRecord(group.file, dict(group.items()))
+    names = list(group)
+    refs = {name: group[name][()].T for name in names}
+    shape = refs[names[0]].shape
+    h5file = group.file
+    records = np.empty(shape, dtype=object)
+    for index in np.ndindex(shape):
+        records[index] = LazyMatRecord(h5file, {name: refs[name][index] for name in names})
+    records = np.squeeze(records)
+    return records.item() if records.ndim == 0 else records
+
+
+class LazyMatRecord:
+    """
+    A record struct of a MATLAB v7.3 file, used like a scipy.io mat_struct.
+
+    Fields are read from the HDF5 file when accessed, so the record data only
+    costs I/O (chunk by chunk) for the records actually viewed. Small fields
+    such as Name and X_Units are kept after the first read.
+    """
+    def __init__(self, h5file, fields):
+        self._file = h5file
+        self._fields = fields
+        self._fieldnames = list(fields)
+        self._small = {}
+
+    def __getattr__(self, name):
+        fields = self.__dict__.get('_fields')
+        if fields is None or name not in fields:
+            raise AttributeError(name)
+        if name in self._small:
+            return self._small[name]
+        obj = fields[name]
+        if not hasattr(obj, 'attrs'):
+            obj = self._file[obj]  # Object reference of a struct array element
+        value = _read_h5_value(obj)
+        if np.size(value) <= SMALL_FIELD_SIZE:
+            self._small[name] = value
+        return value
+
+    def summary(self, name, ends=True):
+        """field_summary() of a field, reading no data unless ends is set."""
+        if name in self._small:
+            return _array_summary(self._small[name], ends)
+        obj = self._fields[name]
+        if not hasattr(obj, 'attrs'):
+            obj = self._file[obj]
+        if not hasattr(obj, 'dtype'):
+            return 0, False, False, np.nan, np.nan
+        dtype = obj.dtype
+        # MATLAB stores empty arrays as their uint64 dimensions
+        if dtype.kind == 'u' and 'MATLAB_empty' in obj.attrs and obj.attrs['MATLAB_empty']:
+            return 0, False, False, np.nan, np.nan
+        is_complex = bool(dtype.names) and 'real' in dtype.names
+        is_single = (dtype['real'] if is_complex else dtype) == np.float32
+        size = obj.size
+        if not ends or size == 0:
+            return size, is_complex, is_single, np.nan, np.nan
+        if size <= SUMMARY_READ_SIZE:
+            value = obj[()]
+            values = [value.flat[0], value.flat[-1]]
+        else:
+            values = [obj[index] for index in ((0,) * obj.ndim, tuple(n - 1 for n in obj.shape))]
+        if is_complex:
+            values = [complex(value['real'], value['imag']) for value in values]
+        return size, is_complex, is_single, values[0], values[1]
+
+
+def _array_summary(value, ends=True):
+    value = np.asarray(value)
+    is_single = value.dtype in (np.float32, np.complex64)
+    if not ends or value.size == 0:
+        return value.size, np.iscomplexobj(value), is_single, np.nan, np.nan
+    return value.size, np.iscomplexobj(value), is_single, value.flat[0], value.flat[-1]
+
+
+def field_summary(record, name, ends=True):
+    """
+    Returns (size, is_complex, is_single, first, last) of a numeric record field.
+
+    first and last are NaN unless ends is set. Lazy (v7.3) records read at
+    most the first and last element of large fields from the file, so this is
+    cheap enough to run for every record at load time.
+    """
+    if isinstance(record, LazyMatRecord):
+        return record.summary(name, ends)
+    return _array_summary(getattr(record, name), ends)
+
+
+class MatFileV73(dict):
+    """
+    The variables of an open MATLAB v7.3 file, as returned by load_mat().
+
+    Struct and cell variables are enumerated into LazyMatRecords (or object
+    arrays of them); other variables are left as h5py datasets, unread.
+    """
+    def __init__(self, filepath):
+        super().__init__()
+        h5py = _import_h5py()
+        self.h5 = h5py.File(filepath, 'r')
+        try:
+            for key, obj in self.h5.items():
+                if key.startswith('#'):
+                    continue  # '#refs#' and '#subsystem#' hold MATLAB internals
+                matlab_class = _matlab_class(obj)
+                if matlab_class == 'struct':
+                    self[key] = _lazy_struct(obj)
+                elif matlab_class == 'cell':
+                    self[key] = self._cell(obj)
+                else:
+                    self[key] = obj
+        except Exception:
+            self.h5.close()
+            raise
+
+    def _cell(self, dataset):
+        refs = dataset[()].T
+        cells = np.empty(refs.shape, dtype=object)
+        for index, ref in np.ndenumerate(refs):
+            obj = self.h5[ref]
+            cells[index] = _lazy_struct(obj) if _matlab_class(obj) == 'struct' else obj
+        return np.squeeze(cells) if cells.size > 1 else cells.ravel()
+
+    def close(self):
+        self.h5.close()
@@ -0,0 +1,298 @@
+# EMAV - Best-match search
+# Scores a reconstructed FRF against every Testlab record at once using
+# stacked magnitude arrays instead of comparing records one by one. A
+# resonance-peak index narrows large libraries down to the records whose
+# peaks line up with those of the reconstructed FRF before scoring.
+import hashlib
+import math
+import numpy as np
+
+# Floor applied to magnitudes before taking the logarithm
+LOG_FLOOR = 1e-12
+
+# Resonance peaks kept per record: the highest maxima of the magnitude over
+# PEAK_NEIGHBOURHOOD of the record's points on either side (so that noise on a
+# resonance does not make several peaks of it), at least PEAK_MIN_LEVEL times
+# the record maximum. Records are searched PEAK_CHUNK_ROWS at a time.
+PEAKS_PER_RECORD = 8
+PEAK_NEIGHBOURHOOD = 1 / 256
+PEAK_MIN_LEVEL = 0.01
+PEAK_CHUNK_ROWS = 1024
+# A record is a candidate when at least PEAK_MIN_MATCH of the reconstructed
+# FRF's peaks have a peak of the record within PEAK_TOLERANCE (relative) of them
+PEAK_TOLERANCE = 0.03
+PEAK_MIN_MATCH = 0.5
+# Records whose log magnitudes are compared with the reconstructed FRF at a time
+SCORE_CHUNK_ROWS = 4096
+
+
+def find_peaks(x, mag, max_peaks=PEAKS_PER_RECORD):
+    """
+    Finds the resonance peaks of the rows of mag (records x points, ascending x).
+
+    Returns (rows, freq, amp, damping) arrays with one entry per peak. The
+    frequency is refined with a parabola through the peak and its two
+    neighbours, and the damping ratio estimated from the curvature there
+    (half-power bandwidth of a single mode); it is NaN where that fails.
+    """
+    # Imported here: scipy.ndimage is slow to import and only needed once records are matched
+    from scipy.ndimage import maximum_filter1d
+    x = np.asarray(x, dtype=float)
+    mag = np.atleast_2d(mag)
+    n = mag.shape[1]
+    if n < 3:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+    window = 2 * max(2, int(n * PEAK_NEIGHBOURHOOD)) + 1
+    found = []
+    for start in range(0, len(mag), PEAK_CHUNK_ROWS):
+        chunk = mag[start:start + PEAK_CHUNK_ROWS]
+        is_peak = chunk == maximum_filter1d(chunk, window, axis=1, mode='nearest')
+        is_peak &= chunk >= PEAK_MIN_LEVEL * chunk.max(axis=1, keepdims=True)
+        # Above the previous point, so that a plateau is one peak and a flat record none
+        is_peak[:, 1:] &= chunk[:, 1:] > chunk[:, :-1]
+        is_peak[:, 0] = is_peak[:, -1] = False
+        rows, columns = np.nonzero(is_peak)
+        found.append((rows + start, columns))
+    rows = np.concatenate([r for r, _ in found])
+    columns = np.concatenate([c for _, c in found])
+    # The max_peaks highest peaks of each row
+    order = np.lexsort((-mag[rows, columns], rows))
+    rows, columns = rows[order], columns[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    rows, columns = rows[rank < max_peaks], columns[rank < max_peaks]
+
+    y0 = mag[rows, columns].astype(float)
+    y_left = mag[rows, columns - 1].astype(float)
+    y_right = mag[rows, columns + 1].astype(float)
+    step = (x[columns + 1] - x[columns - 1]) / 2
+    curvature = y_left - 2 * y0 + y_right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curvature < 0, 0.5 * (y_left - y_right) / curvature, 0.0)
+        freq = x[columns] + np.clip(offset, -0.5, 0.5) * step
+        # |H| ~ A (1 - u^2 / 2) near a mode, u = (f - f_n) / (zeta f_n)
+        damping = np.sqrt(-y0 / (curvature / step ** 2)) / freq
+    damping = np.where((curvature < 0) & (freq > 0), damping, np.nan)
+    return rows, freq, y0.astype(np.float32), damping.astype(np.float32)
+
+
+class PeakIndex:
+    """
+    The resonance peaks of many records, sorted by frequency.
+
+    record[i] is the record number (in the order of the MatchIndex) of the
+    peak at freq[i]; amp and damping are its magnitude and estimated damping
+    ratio. Finding the records with a peak near a frequency is a binary search.
+    """
+    def __init__(self, record, freq, amp, damping, n_records):
+        order = np.argsort(freq, kind='stable')
+        self.record = record[order]
+        self.freq = freq[order]
+        self.amp = amp[order]
+        self.damping = damping[order]
+        self.n_records = n_records
+
+    def __len__(self):
+        return len(self.freq)
+
+    def candidates(self, peak_freq, min_records=0, tolerance=PEAK_TOLERANCE, min_match=PEAK_MIN_MATCH):
+        """
+        The sorted record numbers that have a peak near at least min_match of
+        the frequencies peak_freq. Frequencies within tolerance of each other
+        count as one. While that gives fewer than min_records records, fewer
+        matching peaks are asked for, down to one.
+        """
+        distinct = []
+        for freq in np.sort(np.asarray(peak_freq, dtype=float)):
+            if not distinct or freq > distinct[-1] * (1 + tolerance):
+                distinct.append(freq)
+        peak_freq = np.array(distinct)
+        lo = np.searchsorted(self.freq, peak_freq * (1 - tolerance), side='left')
+        hi = np.searchsorted(self.freq, peak_freq * (1 + tolerance), side='right')
+        matched = np.zeros(self.n_records, dtype=np.int32)
+        for start, stop in zip(lo, hi):
+            # Each frequency counts once per record, however many of its peaks are near
+            matched[np.unique(self.record[start:stop])] += 1
+        needed = max(1, math.ceil(min_match * len(peak_freq)))
+        counts = np.bincount(matched, minlength=len(peak_freq) + 1)
+        # counts[k:].sum() records have at least k matching peaks
+        while needed > 1 and counts[needed:].sum() < min_records:
+            needed -= 1
+        return np.flatnonzero(matched >= needed)
+
+
+class MatchIndex:
+    """
+    Stacked record magnitudes, grouped by frequency axis, for vectorized matching.
+
+    Records that share an abscissa (the usual case for a Testlab campaign) end
+    up in one 2-D array, so scoring a reconstructed curve against all of them
+    is a handful of matrix-vector products.
+    """
+    def __init__(self):
+        self.groups = []
+        self._pending = {}
+        # Record numbers of the first record of each group, and their resonance peaks
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.peaks = None
+
+    def __len__(self):
+        return sum(len(group['keys']) for group in self.groups)
+
+    def add(self, key, x, y):
+        """Adds one record (abscissa x, real or complex ordinate y) under key."""
+        x = np.asarray(x, dtype=float).ravel()
+        mag = np.abs(np.asarray(y)).ravel().astype(np.float32)
+        if len(x) != len(mag) or len(x) < 2:
+            return False
+        pending = self._pending_group(x)
+        pending['keys'].append(key)
+        pending['rows'].append(mag)
+        return True
+
+    def add_rows(self, keys, x, y):
+        """Adds records that share the abscissa x; y holds their ordinates, one row per key."""
+        x = np.asarray(x, dtype=float).ravel()
+        mag = np.abs(np.asarray(y)).astype(np.float32)
+        if mag.ndim != 2 or mag.shape != (len(keys), len(x)) or len(x) < 2:
+            return False
+        pending = self._pending_group(x)
+        pending['keys'].extend(keys)
+        pending['rows'].append(mag)
+        return True
+
+    def _pending_group(self, x):
+        axis_id = hashlib.blake2b(x.tobytes(), digest_size=16).digest()
+        return self._pending.setdefault(axis_id, {'x': x, 'keys': [], 'rows': []})
+
+    def finalize(self):
+        """Stacks the records added so far into per-axis arrays."""
+        for pending in self._pending.values():
+            # Columns are kept in ascending frequency so a frequency range is a plain slice
+            order = np.argsort(pending['x'], kind='stable')
+            mag = np.vstack(pending['rows'])[:, order]
+            self.groups.append({
+                'x': pending['x'][order],
+                'keys': pending['keys'],
+                'mag': mag,
+                'log_mag': np.log10(np.maximum(mag, LOG_FLOOR)),
+            })
+        self._pending = {}
+        self.offsets = np.cumsum([0] + [len(group['keys']) for group in self.groups])
+        self.build_peaks()
+        return self
+
+    def build_peaks(self):
+        """Finds the resonance peaks of every record, group by group, for candidates()."""
+        found = [find_peaks(group['x'], group['mag']) for group in self.groups]
+        if not found:
+            self.peaks = None
+            return
+        record = np.concatenate([rows + offset for (rows, _, _, _), offset in zip(found, self.offsets)])
+        self.peaks = PeakIndex(record, *(np.concatenate([f[i] for f in found]) for i in (1, 2, 3)),
+                               n_records=int(self.offsets[-1]))
+
+    def candidates(self, recon_x, recon_y, min_records=0):
+        """
+        The record numbers whose resonance peaks line up with those of the
+        reconstructed curve (see PeakIndex.candidates), or None if it has no
+        peaks to search for.
+        """
+        if self.peaks is None:
+            return None
+        recon_x = np.asarray(recon_x, dtype=float).ravel()
+        order = np.argsort(recon_x, kind='stable')
+        recon_mag = np.abs(np.asarray(recon_y)).ravel()[order]
+        _, peak_freq, _, _ = find_peaks(recon_x[order], recon_mag[np.newaxis, :])
+        if not len(peak_freq):
+            return None
+        return self.peaks.candidates(peak_freq, min_records)
+
+    def score(self, recon_x, recon_y, records=None):
+        """
+        Scores every record, or the sorted record numbers records, against the reconstructed curve.
+
+        The reconstructed magnitude is interpolated onto each group's frequency
+        axis over the range both cover. Returns (keys, frac, log_rms) where
+        frac is the Frequency Response Assurance Criterion of the magnitudes
+        (1 = identical shape) and log_rms the RMS difference of log10 magnitudes.
+        """
+        recon_x = np.asarray(recon_x, dtype=float).ravel()
+        recon_mag = np.abs(np.asarray(recon_y)).ravel()
+        order = np.argsort(recon_x)
+        recon_x, recon_mag = recon_x[order], recon_mag[order]
+
+        keys, frac, log_rms = [], [], []
+        for number, group in enumerate(self.groups):
+            rows = None
+            if records is not None:
+                start, stop = np.searchsorted(records, self.offsets[number:number + 2])
+                if start == stop:
+                    continue
+                rows = records[start:stop] - self.offsets[number]
+            x = group['x']
+            lo = np.searchsorted(x, recon_x[0], side='left')
+            hi = np.searchsorted(x, recon_x[-1], side='right')
+            n = int(hi - lo)
+            if n < 2:
+                continue
+            ref = np.interp(x[lo:hi], recon_x, recon_mag)
+            log_ref = np.log10(np.maximum(ref, LOG_FLOOR))
+
+            mag = group['mag'][:, lo:hi]
+            log_mag = group['log_mag'][:, lo:hi]
+            group_keys = group['keys']
+            if rows is not None:
+                mag = mag[rows]
+                log_mag = log_mag[rows]
+                group_keys = [group_keys[row] for row in rows]
+
+            # In float64, a chunk of rows at a time: near 1 (FRAC) and 0 (RMS), where the
+            # close matches are ranked, float32 rounding would reorder them
+            ref_energy = float(ref @ ref)
+            group_frac = np.empty(len(mag))
+            group_rms = np.empty(len(mag))
+            for start in range(0, len(mag), SCORE_CHUNK_ROWS):
+                chunk = slice(start, start + SCORE_CHUNK_ROWS)
+                rows_mag = mag[chunk].astype(np.float64)
+                cross = rows_mag @ ref
+                energy = np.einsum('ij,ij->i', rows_mag, rows_mag)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    group_frac[chunk] = np.where(energy > 0, cross ** 2 / (energy * ref_energy), 0.0)
+                # mean((L - l)^2) taken directly: expanded into squares and a product, its terms cancel
+                diff = log_mag[chunk] - log_ref
+                group_rms[chunk] = np.sqrt(np.einsum('ij,ij->i', diff, diff) / n)
+
+            keys.extend(group_keys)
+            frac.append(group_frac)
+            log_rms.append(group_rms)
+
+        if not keys:
+            return [], np.empty(0), np.empty(0)
+        return keys, np.concatenate(frac), np.concatenate(log_rms)
+
+    def best_matches(self, recon_x, recon_y, top_n=20, metric='frac', prune=True):
+        """
+        Returns the top_n records as a list of (key, frac, log_rms) tuples.
+
+        metric selects the ranking: 'frac' (highest first) or 'log_rms'
+        (lowest first). With prune, only the candidates() of the peak index
+        are scored; records that share no peak with the reconstructed curve
+        are then left out even if that makes fewer than top_n matches. All
+        records are scored when none does.
+        """
+        records = self.candidates(recon_x, recon_y, min_records=top_n) if prune else None
+        if records is not None and not len(records):
+            records = None
+        keys, frac, log_rms = self.score(recon_x, recon_y, records)
+        if not keys:
+            return []
+        if metric == 'frac':
+            ranking = -frac
+        elif metric == 'log_rms':
+            ranking = log_rms
+        else:
+            raise ValueError(f"Unknown match metric: {metric}")
+        top_n = min(top_n, len(keys))
+        best = np.argpartition(ranking, top_n - 1)[:top_n]
+        best = best[np.argsort(ranking[best], kind='stable')]
+        return [(keys[i], float(frac[i]), float(log_rms[i])) for i in best]
@@ -0,0 +1,81 @@
+# EMAV - Multi-record overlay
+# Prepares many records to be drawn on top of each other with one matplotlib
+# LineCollection per axes. Every curve is decimated with its min/max pyramid,
+# so the vertices drawn depend on the plot width rather than on the record
+# lengths, and the envelope (min/max band and mean) of the records is
+# computed on a common abscissa. No GUI imports.
+import numpy as np
+import emav_lod
+
+# Points of the common abscissa of the envelope when the records do not share one
+ENVELOPE_POINTS = 4096
+
+
+class OverlayCurves:
+    """The min/max pyramids of a set of (x, y) curves, drawn as the segments of one LineCollection."""
+    def __init__(self, curves):
+        self.pyramids = [emav_lod.MinMaxPyramid(x, y) for x, y in curves]
+
+    def __len__(self):
+        return len(self.pyramids)
+
+    def segments(self, n_pixels):
+        """One (N, 2) vertex array per curve, decimated for n_pixels of width."""
+        segments = []
+        for pyramid in self.pyramids:
+            x, y = pyramid.view(n_pixels=n_pixels)
+            segments.append(np.column_stack([x, y]))
+        return segments
+
+
+class Envelope:
+    """
+    Lower and upper bound and mean of several curves at common abscissas.
+
+    Built with from_curves(); the band and mean line are decimated for
+    drawing like the curves themselves.
+    """
+    def __init__(self, x, lower, upper, mean):
+        self.x = x
+        self.lower = emav_lod.MinMaxPyramid(x, lower)
+        self.upper = emav_lod.MinMaxPyramid(x, upper)
+        self.mean = emav_lod.MinMaxPyramid(x, mean)
+
+    @classmethod
+    def from_curves(cls, curves):
+        """
+        Returns the Envelope of a list of (x, y) curves with ascending x, or None for fewer than two.
+
+        Curves that share their abscissa (the usual case) are combined point
+        by point; otherwise they are interpolated onto ENVELOPE_POINTS points
+        over the range they all cover (None if there is no such range).
+        Bounds and sum are accumulated curve by curve, so memory does not grow
+        with the number of curves.
+        """
+        if len(curves) < 2:
+            return None
+        x = np.asarray(curves[0][0], dtype=float)
+        shared = all(len(xi) == len(x) and np.array_equal(xi, x) for xi, _ in curves[1:])
+        if not shared:
+            x_min = max(float(np.min(xi)) for xi, _ in curves)
+            x_max = min(float(np.max(xi)) for xi, _ in curves)
+            if x_max <= x_min:
+                return None
+            x = np.linspace(x_min, x_max, ENVELOPE_POINTS)
+        lower = upper = total = None
+        for xi, yi in curves:
+            y = np.asarray(yi, dtype=float) if shared else np.interp(x, xi, yi)
+            if lower is None:
+                lower, upper, total = y.copy(), y.copy(), y.copy()
+            else:
+                np.minimum(lower, y, out=lower)
+                np.maximum(upper, y, out=upper)
+                total += y
+        return cls(x, lower, upper, total / len(curves))
+
+    def band(self, n_pixels):
+        """The outline of the band between the bounds as one (N, 2) polygon."""
+        upper_x, upper_y = self.upper.view(n_pixels=n_pixels)
+        lower_x, lower_y = self.lower.view(n_pixels=n_pixels)
+        return np.column_stack([np.concatenate([upper_x, lower_x[::-1]]),
+                                np.concatenate([upper_y, lower_y[::-1]])])
@@ -0,0 +1,208 @@
+# EMAV - Timing instrumentation
+# Named spans around the expensive stages (file scan, parse, tree insert,
+# drawing, export...). Disabled spans cost one attribute check, so they can
+# stay in the code paths permanently. Set EMAV_PERF=1 to record from start-up.
+import collections
+import json
+import os
+import threading
+import time
+
+# Spans kept for the Performance panel and the trace export
+DEFAULT_HISTORY = 10000
+
+
+class _NullSpan:
+    """Returned while recording is disabled; every call is a no-op."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def end(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """
+    One timed operation. Use as a context manager, or call end() when the
+    operation finishes elsewhere (e.g. after a worker thread posts back).
+    """
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+        self.thread = threading.current_thread().name
+        self.profile = recorder._begin_profile()
+        if recorder.trace_memory:
+            self.args['memory_start_mb'] = _traced_memory_mb()
+        self.start = time.perf_counter()
+        self.ended = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.args['error'] = f"{exc_type.__name__}: {exc}"
+        self.end()
+        return False
+
+    def set(self, **args):
+        """Attaches details (record counts, file names, ...) to the span."""
+        self.args.update(args)
+
+    def end(self, **args):
+        if self.ended:
+            return
+        end = time.perf_counter()
+        self.ended = True
+        self.args.update(args)
+        if self.recorder.trace_memory:
+            self.args['memory_end_mb'] = _traced_memory_mb()
+        self.recorder._end_profile(self.profile)
+        self.recorder._add(self.name, self.start, end, self.thread, self.args)
+
+
+def _traced_memory_mb():
+    import tracemalloc
+    return round(tracemalloc.get_traced_memory()[0] / 1e6, 3) if tracemalloc.is_tracing() else None
+
+
+class Recorder:
+    """
+    Collects finished spans in a bounded history.
+
+    set_capture() optionally adds a cProfile run of the outermost span of
+    each thread, and tracemalloc memory figures to every span. 'version'
+    changes whenever the history does.
+    """
+    def __init__(self, history=DEFAULT_HISTORY):
+        self.enabled = bool(os.environ.get('EMAV_PERF'))
+        self.spans = collections.deque(maxlen=history)
+        self.version = 0
+        self.origin = time.perf_counter()
+        self.trace_memory = False
+        self.profiling = False
+        self._own_tracemalloc = False
+        self._profile_stats = None
+        self._active_profile = threading.local()
+        self._lock = threading.Lock()
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def _add(self, name, start, end, thread, args):
+        with self._lock:
+            self.spans.append({'name': name, 'start': start - self.origin, 'duration': end - start,
+                               'thread': thread, 'args': args})
+            self.version += 1
+
+    def recent(self, n=None):
+        """The last n finished spans (all of the history by default), oldest first."""
+        with self._lock:
+            spans = list(self.spans)
+        return spans if n is None else spans[-n:]
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self.version += 1
+
+    # --- cProfile / tracemalloc capture ---
+
+    def set_capture(self, profile=False, memory=False):
+        """
+        Switches the cProfile and tracemalloc capture on or off.
+
+        Returns the merged pstats.Stats of the spans profiled when profiling is
+        switched off, otherwise None.
+        """
+        import tracemalloc
+        if memory and not self.trace_memory:
+            # tracemalloc may already be running, e.g. under the benchmarks
+            self._own_tracemalloc = not tracemalloc.is_tracing()
+            if self._own_tracemalloc:
+                tracemalloc.start()
+        elif not memory and self.trace_memory and self._own_tracemalloc:
+            tracemalloc.stop()
+        self.trace_memory = memory
+
+        stats = None
+        if profile and not self.profiling:
+            self._profile_stats = None
+        elif not profile and self.profiling:
+            stats, self._profile_stats = self._profile_stats, None
+        self.profiling = profile
+        return stats
+
+    def _begin_profile(self):
+        if not self.profiling or getattr(self._active_profile, 'profile', None) is not None:
+            return None
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None  # Another profiler is already active (Python 3.12+ allows only one)
+        self._active_profile.profile = profile
+        return profile
+
+    def _end_profile(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        self._active_profile.profile = None
+        import pstats
+        with self._lock:
+            if self._profile_stats is None:
+                self._profile_stats = pstats.Stats(profile)
+            else:
+                self._profile_stats.add(profile)
+
+    # --- Export ---
+
+    def chrome_trace(self):
+        """The recorded spans as a Chrome trace (load it in chrome://tracing or Perfetto)."""
+        pid = os.getpid()
+        thread_ids = {}
+        events = []
+        for span in self.recent():
+            tid = thread_ids.setdefault(span['thread'], len(thread_ids) + 1)
+            events.append({
+                'name': span['name'], 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': round(span['start'] * 1e6, 1), 'dur': round(span['duration'] * 1e6, 1),
+                'args': {key: _json_value(value) for key, value in span['args'].items()},
+            })
+        for thread, tid in thread_ids.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def _json_value(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+recorder = Recorder()
+
+
+def span(name, **args):
+    """Starts a span on the shared recorder; a no-op unless recording is enabled."""
+    if not recorder.enabled:
+        return NULL_SPAN
+    return Span(recorder, name, args)
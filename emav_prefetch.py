@@ -0,0 +1,95 @@
+# EMAV - Background record prefetch
+# While a record is shown, the records next to it in the tree are read and
+# prepared for plotting (parse, magnitude/phase, decimation pyramids) by a
+# worker thread, so that moving on to one of them only has to draw it. The
+# prepared records are kept in a bounded LRU cache. No GUI imports.
+import collections
+import threading
+
+# Prepared records kept, counted in abscissa points (a prepared point costs about 40 bytes)
+PREFETCH_CACHE_POINTS = 8_000_000
+
+
+class RecordPrefetcher:
+    """
+    LRU cache of prepared records, filled on request by a daemon thread.
+
+    prepare(key) returns the prepared record of a key and cost(prepared) its
+    size; it runs on the worker thread, so it must not touch any widget.
+    Keys that fail to prepare are skipped: showing them reports the error.
+    """
+    def __init__(self, prepare, cost=len, max_cost=PREFETCH_CACHE_POINTS):
+        self.prepare = prepare
+        self.cost = cost
+        self.max_cost = max_cost
+        self._cache = collections.OrderedDict()
+        self._total = 0
+        self._wanted = []
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key):
+        """Returns the prepared record of key, or None if it is not cached."""
+        with self._lock:
+            prepared = self._cache.get(key)
+            if prepared is not None:
+                self._cache.move_to_end(key)
+            return prepared
+
+    def put(self, key, prepared):
+        with self._lock:
+            self._put(key, prepared)
+
+    def _put(self, key, prepared):
+        if key in self._cache:
+            self._total -= self.cost(self._cache.pop(key))
+        self._cache[key] = prepared
+        self._total += self.cost(prepared)
+        # The newest record stays even if it alone is over the budget
+        while self._total > self.max_cost and len(self._cache) > 1:
+            _, oldest = self._cache.popitem(last=False)
+            self._total -= self.cost(oldest)
+
+    def request(self, keys):
+        """Replaces the keys waiting to be prepared by keys, most wanted first."""
+        with self._lock:
+            self._wanted = [key for key in keys if key not in self._cache]
+            if not self._wanted:
+                return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='emav-prefetch', daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def clear(self):
+        """Forgets every prepared and wanted record, e.g. when other files are loaded."""
+        with self._lock:
+            self._cache.clear()
+            self._total = 0
+            self._wanted = []
+            # A record being prepared now is dropped when it is done
+            self._generation += 1
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._wanted:
+                    self._wake.clear()
+                    continue
+                key = self._wanted.pop(0)
+                if key in self._cache:
+                    continue
+                generation = self._generation
+            try:
+                prepared = self.prepare(key)
+            except Exception:
+                continue
+            with self._lock:
+                if generation == self._generation:
+                    self._put(key, prepared)
@@ -0,0 +1,154 @@
+# EMAV - Columnar record store
+# Holds the numeric data of the records of a file in a few contiguous arrays
+# instead of two arrays per record: abscissas shared by several records are
+# stored once, ordinates are packed into one block per dtype, and a typed
+# slot table gives the place of each record in them. A store can be written
+# as .npy files and opened memory-mapped (the Testlab cache does that). No
+# GUI imports.
+import hashlib
+import os
+import numpy as np
+
+X_FILE = 'x.npy'
+SLOTS_FILE = 'slots.npy'
+# Ordinate blocks; records keep the precision they were read with
+BLOCK_DTYPES = (np.dtype(np.float32), np.dtype(np.float64), np.dtype(np.complex64), np.dtype(np.complex128))
+SLOT_DTYPE = np.dtype([('x_start', np.int64), ('size', np.int64), ('block', np.int8), ('y_start', np.int64)])
+# Records gathered at once by axis_groups(), which bounds the size of the 2-D arrays it yields
+GROUP_ROWS = 4096
+
+
+def block_dtype(dtype):
+    """The ordinate block for data of dtype: its own if it has one, otherwise float64 or complex128."""
+    dtype = np.dtype(dtype)
+    if dtype in BLOCK_DTYPES:
+        return dtype
+    return np.dtype(np.complex128) if dtype.kind == 'c' else np.dtype(np.float64)
+
+
+def _block_file(dtype):
+    return f'y_{dtype.name}.npy'
+
+
+def _slot_table(shapes):
+    """The slot table of records with ordinates of the given (size, dtype), without the abscissa offsets."""
+    slots = np.zeros(len(shapes), dtype=SLOT_DTYPE)
+    totals = [0] * len(BLOCK_DTYPES)
+    for slot, (size, dtype) in enumerate(shapes):
+        block = BLOCK_DTYPES.index(block_dtype(dtype))
+        slots[slot] = (0, size, block, totals[block])
+        totals[block] += size
+    return slots, totals
+
+
+def _fill(slots, blocks, read_xy):
+    """Copies the records into the blocks and returns the deduplicated abscissas; sets the abscissa offsets."""
+    x_parts, x_offsets, x_len = [], {}, 0
+    for slot in range(len(slots)):
+        x, y = read_xy(slot)
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y).ravel()
+        _, size, block, y_start = slots[slot]
+        if len(x) != size or len(y) != size:
+            raise ValueError(f"Record {slot} does not have the expected {size} points.")
+        x_key = hashlib.blake2b(x.tobytes(), digest_size=16).digest()
+        if x_key not in x_offsets:
+            x_offsets[x_key] = x_len
+            x_parts.append(x)
+            x_len += size
+        slots['x_start'][slot] = x_offsets[x_key]
+        blocks[block][y_start:y_start + size] = y
+    return np.concatenate(x_parts) if x_parts else np.empty(0)
+
+
+class RecordStore:
+    """
+    The (x, y) data of a file's records, addressed by slot number.
+
+    x holds the deduplicated abscissas, blocks one ordinate array per
+    BLOCK_DTYPES entry, and slots the SLOT_DTYPE row of each record.
+    """
+    def __init__(self, x, blocks, slots):
+        self.x = x
+        self.blocks = blocks
+        self.slots = slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + sum(block.nbytes for block in self.blocks) + self.slots.nbytes
+
+    @classmethod
+    def build(cls, shapes, read_xy):
+        """
+        Builds a store in memory for records with ordinates of the given (size, dtype).
+
+        read_xy(slot) returns the (x, y) arrays of a record; it is called once
+        per record, in slot order.
+        """
+        slots, totals = _slot_table(shapes)
+        blocks = [np.empty(total, dtype=dtype) for dtype, total in zip(BLOCK_DTYPES, totals)]
+        x = _fill(slots, blocks, read_xy)
+        return cls(x, blocks, slots)
+
+    @staticmethod
+    def write(path, shapes, read_xy):
+        """
+        Like build(), but writes the store to .npy files in the folder path.
+
+        The blocks are filled in memory-mapped files, so stores larger than
+        memory can be written. Open the result with load().
+        """
+        slots, totals = _slot_table(shapes)
+        blocks = [np.lib.format.open_memmap(os.path.join(path, _block_file(dtype)), mode='w+', dtype=dtype, shape=(total,))
+                  for dtype, total in zip(BLOCK_DTYPES, totals)]
+        x = _fill(slots, blocks, read_xy)
+        for block in blocks:
+            block.flush()
+        del blocks
+        np.save(os.path.join(path, X_FILE), x)
+        np.save(os.path.join(path, SLOTS_FILE), slots)
+
+    @classmethod
+    def load(cls, path):
+        """Opens a store written by write(); its arrays are memory-mapped read-only and paged in on access."""
+        def mapped(name, dtype):
+            array = np.load(os.path.join(path, name), mmap_mode='r')
+            # Empty arrays cannot be memory-mapped and come back as plain arrays either way
+            return array if array.size else np.empty(0, dtype=dtype)
+        x = mapped(X_FILE, np.float64)
+        blocks = [mapped(_block_file(dtype), dtype) for dtype in BLOCK_DTYPES]
+        return cls(x, blocks, np.load(os.path.join(path, SLOTS_FILE)))
+
+    def xy(self, slot):
+        """Returns the (x, y) arrays of a record as views into the store."""
+        x_start, size, block, y_start = self.slots[slot]
+        return self.x[x_start:x_start + size], self.blocks[block][y_start:y_start + size]
+
+    def axis_groups(self, slots, max_rows=GROUP_ROWS):
+        """
+        Groups the given slots by shared abscissa and ordinate dtype, for operations over many records at once.
+
+        Yields (x, positions, y): positions indexes the slots of the group in
+        the given sequence and y is a 2-D array with one row per record,
+        gathered with a single indexing operation. Large groups are yielded
+        in parts of up to max_rows records.
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        table = self.slots[slots]
+        keys = np.column_stack([table['x_start'], table['size'], table['block']])
+        if not len(keys):
+            return
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(groups) + 1))
+        for group, (x_start, size, block) in enumerate(groups):
+            members = order[bounds[group]:bounds[group + 1]]
+            x = self.x[x_start:x_start + size]
+            for start in range(0, len(members), max_rows):
+                positions = members[start:start + max_rows]
+                rows = table['y_start'][positions, None] + np.arange(size)
+                yield x, positions, self.blocks[block][rows]
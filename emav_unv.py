@@ -0,0 +1,546 @@
+# EMAV - Universal File (.unv) reader and writer
+# Builds a byte-offset index of the datasets in a .unv file so that large
+# Testlab exports can be browsed without parsing every numeric block up front.
+# Dataset 58 records are written with vectorized fixed-width formatting.
+import mmap
+import numpy as np
+import emav_perf
+
+DELIMITER = b'    -1'
+
+# Field widths of the fixed-format header records of dataset 58 (records 6 to 11).
+_RECORD6_FIELDS = (
+    (5, int, 'func_type'), (10, int, 'func_id'), (5, int, 'ver_num'), (10, int, 'load_case_id'),
+    (11, str, 'rsp_ent_name'), (10, int, 'rsp_node'), (4, int, 'rsp_dir'),
+    (11, str, 'ref_ent_name'), (10, int, 'ref_node'), (4, int, 'ref_dir'),
+)
+_RECORD7_FIELDS = (
+    (10, int, 'ord_data_type'), (10, int, 'num_pts'), (10, int, 'abscissa_spacing'),
+    (13, float, 'abscissa_min'), (13, float, 'abscissa_inc'), (13, float, 'z_axis_value'),
+)
+_AXIS_RECORD_PREFIXES = ('abscissa', 'ordinate', 'orddenom', 'z_axis')
+
+# Dataset 58 function types (record 6, field 1) by name
+FUNCTION_TYPES = {
+    'GENERAL': 0, 'TIME': 1, 'AUTO': 2, 'CROSS': 3, 'FRF': 4, 'TRANSMISSIBILITY': 5,
+    'COHERENCE': 6, 'AUTOCORR': 7, 'CROSSCORR': 8, 'PSD': 9, 'ESD': 10, 'PDF': 11,
+    'SPECTRUM': 12,
+}
+# Dataset 58 direction codes (records 6, response and reference direction) by name
+DIRECTIONS = {'S': 0, 'X': 1, 'Y': 2, 'Z': 3, 'RX': 4, 'RY': 5, 'RZ': 6}
+
+
+def parse_function_type(text):
+    """Returns the dataset 58 function type code for a name ('FRF', 'coherence') or number."""
+    text = str(text).strip().upper()
+    if text in FUNCTION_TYPES:
+        return FUNCTION_TYPES[text]
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"Unknown function type: {text}") from None
+
+
+def parse_direction(text):
+    """Returns the dataset 58 direction code for '+Z', '-X', 'RY', 'Z' or a signed number."""
+    text = str(text).strip().upper()
+    sign = -1 if text.startswith('-') else 1
+    name = text.lstrip('+-')
+    if name in DIRECTIONS:
+        return sign * DIRECTIONS[name]
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"Unknown direction: {text}") from None
+
+
+def format_direction(code):
+    """Returns '+Z', '-X', 'S', ... for a dataset 58 direction code (the inverse of parse_direction)."""
+    for name, value in DIRECTIONS.items():
+        if value == abs(code):
+            return name if value == 0 else ('-' if code < 0 else '+') + name
+    return str(code)
+
+
+def _parse_fields(line, fields, prefix=''):
+    """Splits a fixed-width header line into a dict, skipping blank fields."""
+    values = {}
+    pos = 0
+    for width, cast, name in fields:
+        text = line[pos:pos + width].strip()
+        pos += width
+        if not text:
+            continue
+        try:
+            values[prefix + name] = cast(text)
+        except ValueError:
+            values[prefix + name] = text
+    return values
+
+
+def _axis_fields(prefix):
+    return (
+        (10, int, f'{prefix}_spec_data_type'), (5, int, f'{prefix}_len_unit_exp'),
+        (5, int, f'{prefix}_force_unit_exp'), (5, int, f'{prefix}_temp_unit_exp'),
+        (21, str, f'{prefix}_axis_lab'), (21, str, f'{prefix}_axis_units_lab'),
+    )
+
+
+def _is_delimiter(buf, pos, line_start=True):
+    """True if the '    -1' found at pos is a dataset delimiter line and not part of a value."""
+    if line_start and pos > 0 and buf[pos - 1] not in (10, 13):
+        return False
+    end = pos + len(DELIMITER)
+    line_end = buf.find(b'\n', end)
+    if line_end == -1:
+        line_end = len(buf)
+    return not buf[end:line_end].strip()
+
+
+def _find_delimiter(buf, start, line_start=True):
+    """Returns (start, end) of the next delimiter line at or after start, or None.
+
+    With line_start=False the delimiter may directly follow the previous byte,
+    as happens after the raw data of a binary dataset.
+    """
+    pos = buf.find(DELIMITER, start)
+    while pos != -1:
+        if _is_delimiter(buf, pos, line_start):
+            line_end = buf.find(b'\n', pos)
+            return pos, (len(buf) if line_end == -1 else line_end + 1)
+        pos = buf.find(DELIMITER, pos + 1)
+    return None
+
+
+def _read_line(buf, pos):
+    """Returns (decoded line without EOL, offset of the next line)."""
+    line_end = buf.find(b'\n', pos)
+    if line_end == -1:
+        line_end = len(buf)
+    line = buf[pos:line_end].decode('utf-8', errors='replace').rstrip('\r')
+    return line, line_end + 1
+
+
+def _parse_header_58(buf, pos, dataset):
+    """Parses the 11 ASCII header records of a dataset 58 starting at pos.
+
+    Returns the offset of the first byte of the numeric block.
+    """
+    for n in range(1, 6):
+        line, pos = _read_line(buf, pos)
+        dataset[f'id{n}'] = line.strip()
+    line, pos = _read_line(buf, pos)
+    dataset.update(_parse_fields(line, _RECORD6_FIELDS))
+    line, pos = _read_line(buf, pos)
+    dataset.update(_parse_fields(line, _RECORD7_FIELDS))
+    for prefix in _AXIS_RECORD_PREFIXES:
+        line, pos = _read_line(buf, pos)
+        dataset.update(_parse_fields(line, _axis_fields(prefix)))
+    return pos
+
+
+def _binary_size(dataset):
+    """Byte size of a 58b numeric block, derived from the point count and data type.
+
+    The header 'n_bytes' field is not trusted: some writers store the size of
+    the real part only for complex data.
+    """
+    if 'num_pts' not in dataset or 'ord_data_type' not in dataset:
+        return dataset.get('n_bytes', 0)
+    item_size = 4 if dataset['ord_data_type'] in (2, 5) else 8
+    return _num_values(dataset) * item_size
+
+
+def _num_values(dataset):
+    """Number of values stored in the numeric block of a dataset 58."""
+    values_per_point = 2 if dataset['ord_data_type'] in (5, 6) else 1
+    if dataset.get('abscissa_spacing', 1) == 0:
+        values_per_point += 1
+    return dataset['num_pts'] * values_per_point
+
+
+def _iter_index(buf, start=0):
+    """Yields an index entry for every complete dataset in buf from offset start onwards."""
+    pos = start
+    while True:
+        opening = _find_delimiter(buf, pos)
+        if opening is None:
+            break
+        offset, header_pos = opening
+        if buf[header_pos:header_pos + len(DELIMITER)] == DELIMITER and _is_delimiter(buf, header_pos):
+            # Two delimiters in a row: the first one closed a block that was not a dataset
+            pos = header_pos
+            continue
+        type_line, next_pos = _read_line(buf, header_pos)
+        try:
+            dataset_type = int(type_line[:6])
+        except ValueError:
+            # Not a dataset start (e.g. trailing garbage); resync on the next delimiter
+            pos = header_pos
+            continue
+
+        dataset = {'type': dataset_type, 'binary': 0, 'offset': offset}
+        data_pos = next_pos
+        if type_line[6:7].lower() == 'b':
+            dataset['binary'] = 1
+            dataset.update(_parse_fields(type_line[7:], (
+                (6, int, 'byte_ordering'), (6, int, 'fp_format'),
+                (12, int, 'n_ascii_lines'), (12, int, 'n_bytes'))))
+        if dataset_type == 58:
+            data_pos = _parse_header_58(buf, next_pos, dataset)
+
+        # Binary blocks may contain anything, so jump over them before looking for the end
+        search_from = data_pos
+        is_binary_58 = dataset['binary'] and dataset_type == 58
+        if is_binary_58:
+            search_from = data_pos + _binary_size(dataset)
+
+        closing = _find_delimiter(buf, search_from, line_start=not is_binary_58)
+        if closing is None:
+            break  # Incomplete dataset at the end of the file
+        dataset['data_offset'] = data_pos
+        dataset['data_end'] = closing[0]
+        dataset['end_offset'] = closing[1]
+        yield dataset
+        pos = closing[1]
+
+
+def _open_buffer(f):
+    """Memory-maps an open file for reading; returns None for an empty file."""
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return None
+
+
+def iter_unv_index(filepath, start=0):
+    """
+    Yields the dataset index entries of a .unv file while it is being scanned.
+
+    Each entry is a dict with the dataset 'type', its byte offsets in the file
+    ('offset', 'data_offset', 'data_end', 'end_offset') and, for dataset 58,
+    the header metadata using the same keys as pyuff (rsp_node, rsp_dir,
+    ref_node, ref_dir, func_type, ord_data_type, num_pts, ...).
+    No numeric data is parsed. 'end_offset' of the last entry doubles as the
+    number of bytes scanned so far.
+
+    start, the 'end_offset' of a dataset already indexed, resumes the scan
+    after it: only the pages of the file from there on are read, e.g. to
+    index the datasets appended to a file that is still being written.
+    """
+    with open(filepath, 'rb') as f:
+        buf = _open_buffer(f)
+        if buf is None:
+            return
+        try:
+            yield from _iter_index(buf, start)
+        finally:
+            buf.close()
+
+
+def scan_unv(filepath):
+    """Scans a .unv file once and returns the list of its dataset index entries."""
+    return list(iter_unv_index(filepath))
+
+
+def _ascii_field_widths(ord_data_type, abscissa_spacing):
+    """Fixed field widths of one line of an ASCII dataset 58 numeric block."""
+    if ord_data_type in (2, 5):
+        return [13] * 6                 # 6E13.5
+    if abscissa_spacing == 1:
+        return [20] * 4                 # 4E20.12
+    if ord_data_type == 4:
+        return [13, 20, 13, 20]         # 2(E13.5,E20.12)
+    if ord_data_type == 6:
+        return [13, 20, 20]             # E13.5,2E20.12
+    raise ValueError(f"Unsupported ordinate data type {ord_data_type} in dataset 58.")
+
+
+def _decode_ascii(block, widths, n_values):
+    """Decodes a fixed-width ASCII numeric block into a float array in one pass.
+
+    The lines are joined into a single byte string and reinterpreted as an
+    array of fixed-width fields, so the text to float conversion runs inside
+    NumPy instead of once per value in Python.
+    """
+    line_width = sum(widths)
+    lines = block.splitlines()
+    if any(len(line) != line_width for line in lines[:-1]):
+        # Irregular line lengths (trailing blanks, truncated lines): normalise them first
+        lines = [line[:line_width].ljust(line_width) for line in lines]
+    joined = b''.join(lines)
+    n_rows = -(-len(joined) // line_width)
+    joined = joined.ljust(n_rows * line_width)
+
+    if len(set(widths)) == 1:
+        fields = np.frombuffer(joined, dtype=f'S{widths[0]}')
+    else:
+        row_dtype = np.dtype([(f'f{i}', f'S{width}') for i, width in enumerate(widths)])
+        rows = np.frombuffer(joined, dtype=row_dtype)
+        fields = np.stack([rows[name] for name in row_dtype.names], axis=1).ravel()
+    if len(fields) < n_values:
+        raise ValueError(f"Dataset 58 holds {len(fields)} values, expected {n_values}.")
+    return fields[:n_values].astype(float)
+
+
+def _decode_binary(block, dataset):
+    byte_order = '<' if dataset.get('byte_ordering', 1) == 1 else '>'
+    item = 'f4' if dataset['ord_data_type'] in (2, 5) else 'f8'
+    n_values = _num_values(dataset)
+    if len(block) < n_values * np.dtype(item).itemsize:
+        raise ValueError("Binary dataset 58b is shorter than its header declares.")
+    return np.frombuffer(block, dtype=byte_order + item, count=n_values).astype(float)
+
+
+def _split_values(values, dataset):
+    """Turns the flat value sequence of dataset 58 into pyuff-style 'x' and 'data' arrays."""
+    is_complex = dataset['ord_data_type'] in (5, 6)
+    if dataset.get('abscissa_spacing', 1) == 0:
+        values = values.reshape(-1, 3 if is_complex else 2)
+        x = values[:, 0].copy()
+        if is_complex:
+            data = np.empty(len(values), dtype=complex)
+            data.real = values[:, 1]
+            data.imag = values[:, 2]
+        else:
+            data = values[:, 1].copy()
+    else:
+        # Interleaved real/imaginary pairs can be reinterpreted as complex without a copy
+        data = values.view(complex) if is_complex else values
+        x = dataset.get('abscissa_min', 0.0) + np.arange(len(data)) * dataset.get('abscissa_inc', 1.0)
+    return x, data
+
+
+def _decode_record(block, dataset):
+    """Decodes the numeric block of a dataset 58 and returns the full record dict."""
+    if dataset.get('binary'):
+        values = _decode_binary(block, dataset)
+    else:
+        widths = _ascii_field_widths(dataset['ord_data_type'], dataset.get('abscissa_spacing', 1))
+        values = _decode_ascii(block, widths, _num_values(dataset))
+
+    record = dict(dataset)
+    record['x'], record['data'] = _split_values(values, dataset)
+    return record
+
+
+def read_unv_record(filepath, dataset):
+    """
+    Parses the numeric block of a single indexed dataset 58 on demand.
+
+    Returns a copy of the index entry with 'x' (abscissa) and 'data'
+    (real or complex ordinate) arrays added, like a pyuff dataset dict.
+    """
+    if dataset.get('type') != 58:
+        raise ValueError(f"Dataset type {dataset.get('type')} is not supported.")
+    with emav_perf.span('unv.parse', points=dataset.get('num_pts')):
+        with open(filepath, 'rb') as f:
+            f.seek(dataset['data_offset'])
+            block = f.read(dataset['data_end'] - dataset['data_offset'])
+        return _decode_record(block, dataset)
+
+
+def iter_unv58(filepath):
+    """
+    Streams the dataset 58 records of a .unv file in file order.
+
+    The file is scanned and decoded in a single pass over a memory map.
+    Datasets of any other type (e.g. the 151 header written in front of
+    reconstructed FRFs) are skipped without being parsed.
+    """
+    with open(filepath, 'rb') as f:
+        buf = _open_buffer(f)
+        if buf is None:
+            return
+        try:
+            for dataset in _iter_index(buf):
+                if dataset['type'] != 58:
+                    continue
+                yield _decode_record(buf[dataset['data_offset']:dataset['data_end']], dataset)
+        finally:
+            buf.close()
+
+
+def read_unv58(filepath, max_records=None):
+    """Returns a list of the (first max_records) dataset 58 records of a .unv file."""
+    records = []
+    with emav_perf.span('unv.read58', file=filepath) as span:
+        stream = iter_unv58(filepath)
+        try:
+            for record in stream:
+                records.append(record)
+                if max_records is not None and len(records) >= max_records:
+                    break
+        finally:
+            stream.close()
+        span.set(records=len(records))
+    return records
+
+
+# --- Writer ---
+
+# Lines of an ASCII numeric block formatted at once; bounds the memory used for long records
+WRITE_CHUNK_LINES = 65536
+# Output buffer of write_unv58()
+WRITE_BUFFER_SIZE = 1 << 20
+# Digits after the decimal point of the E13.5 and E20.12 fields of dataset 58
+_E_PRECISION = {13: 5, 20: 12}
+
+
+# ASCII codes of the numbers 0 to 10 ** n - 1 written with n digits, for n = 1 to 4
+_DIGIT_TABLES = {n: np.array([list(b'%0*d' % (n, i)) for i in range(10 ** n)], dtype=np.uint8) for n in range(1, 5)}
+
+
+def _format_e(values, width, out=None):
+    """
+    Formats values like printf's '%{width}.{precision}E' into an (N, width) array of ASCII codes.
+
+    The digits of all values are computed at once in floating point and
+    integer arithmetic. Values too close to a rounding boundary for that to
+    be exact, NaN, infinity and values needing a three-digit exponent are
+    formatted one by one, so the output is identical to printf's. out may
+    be a view into a larger array (e.g. one field of a block of lines).
+    """
+    precision = _E_PRECISION[width]
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.abs(values)
+    regular = np.isfinite(values) & (magnitude > 0)
+    exponent = np.zeros(len(values), dtype=np.int64)
+    exponent[regular] = np.floor(np.log10(magnitude[regular]))
+    # Far from 1, 10 ** -exponent would overflow; those values are formatted separately anyway
+    extreme = np.abs(exponent) > 100
+    exponent[extreme] = 0
+    regular &= ~extreme
+    magnitude = np.where(regular, magnitude, 0.0)
+    scaled = magnitude * 10.0 ** (precision - exponent)
+    # log10() and the scaling can be a little off next to a power of ten, and rounding can carry
+    # into a new digit; all of these show in the number of digits
+    too_low = regular & (scaled < 10.0 ** precision)
+    if too_low.any():
+        exponent[too_low] -= 1
+        scaled = magnitude * 10.0 ** (precision - exponent)
+    # The scaling is off by a few units in the last place, which matters only next to a half
+    ambiguous = np.abs(scaled - np.floor(scaled) - 0.5) <= scaled * 1e-15
+    too_high = regular & ~ambiguous & (np.rint(scaled) >= 10.0 ** (precision + 1))
+    if too_high.any():
+        exponent[too_high] += 1
+        scaled = magnitude * 10.0 ** (precision - exponent)
+    special = ~np.isfinite(values) | extreme | ambiguous | (np.abs(exponent) > 99)
+    digits = np.where(special, 0, np.rint(scaled)).astype(np.int64)
+    exponent[special] = 0
+
+    text = np.empty((len(values), width), dtype=np.uint8) if out is None else out
+    text[:, :-7 - precision] = ord(' ')
+    text[:, -7 - precision] = np.where(np.signbit(values), ord('-'), ord(' '))
+    position = width - 4
+    while position > width - 4 - precision:
+        n = min(4, position - (width - 4 - precision))
+        digits, group = np.divmod(digits, 10 ** n)
+        text[:, position - n:position] = _DIGIT_TABLES[n][group]
+        position -= n
+    text[:, -5 - precision] = ord('.')
+    text[:, -6 - precision] = digits + ord('0')
+    text[:, -4] = ord('E')
+    text[:, -3] = np.where(exponent < 0, ord('-'), ord('+'))
+    text[:, -2:] = _DIGIT_TABLES[2][np.abs(exponent)]
+    for i in np.flatnonzero(special):
+        text[i] = np.frombuffer(b'%*.*E' % (width, precision, values[i]), dtype=np.uint8)
+    return text
+
+
+def _format_ascii(values, widths):
+    """The lines of an ASCII numeric block holding values, len(widths) fixed-width fields per line."""
+    per_line = len(widths)
+    n_full = len(values) // per_line
+    full = values[:n_full * per_line].reshape(n_full, per_line)
+    lines = np.empty((n_full, sum(widths) + 1), dtype=np.uint8)
+    start = 0
+    for j, width in enumerate(widths):
+        _format_e(full[:, j], width, out=lines[:, start:start + width])
+        start += width
+    lines[:, -1] = ord('\n')
+    text = lines.tobytes()
+    rest = values[n_full * per_line:]
+    if len(rest):
+        text += b''.join(_format_e(rest[j:j + 1], widths[j]).tobytes() for j in range(len(rest))) + b'\n'
+    return text
+
+
+def _record_values(record):
+    """
+    Returns (x, values, ord_data_type, abscissa_spacing) of a record to write:
+    values is the flat value sequence of its numeric block.
+    """
+    x = np.asarray(record['x'], dtype=np.float64).ravel()
+    data = np.asarray(record['data'])
+    if data.ndim == 2 and data.shape[1] >= 2:
+        data = data[:, 0] + 1j * data[:, 1]
+    data = data.ravel()
+    if len(x) != len(data):
+        raise ValueError(f"Record has {len(x)} abscissa values for {len(data)} ordinate values.")
+    is_complex = np.iscomplexobj(data)
+    is_single = record.get('ord_data_type') in (2, 5)
+    ord_data_type = (5 if is_single else 6) if is_complex else (2 if is_single else 4)
+    spacing = record.get('abscissa_spacing')
+    if spacing is None:
+        steps = np.diff(x)
+        spacing = int(len(steps) > 0 and np.allclose(steps, steps[0]))
+    columns = [] if spacing else [x]
+    columns += [data.real, data.imag] if is_complex else [data.real]
+    values = np.column_stack(columns).ravel() if len(columns) > 1 else columns[0]
+    return x, values, ord_data_type, int(spacing)
+
+
+def _header_58(record, x, ord_data_type, spacing, n_bytes=None):
+    """The delimiter, type line and 11 header records of a dataset 58 (58b if n_bytes is given)."""
+    get = record.get
+    lines = ['%6i' % -1, '%6i' % 58 + ('%74s' % ' ' if n_bytes is None else
+                                        'b%6i%6i%12i%12i%6i%6i%12i%12i' % (1, 2, 11, n_bytes, 0, 0, 0, 0))]
+    lines += ['%-80s' % str(get(f'id{n}', 'NONE'))[:80] for n in range(1, 6)]
+    lines.append('%5i%10i%5i%10i %10s%10i%4i %10s%10i%4i' % (
+        int(get('func_type', 0)), int(get('func_id', 0)), int(get('ver_num', 0)), int(get('load_case_id', 0)),
+        str(get('rsp_ent_name', 'NONE'))[:10], int(get('rsp_node', 0)), int(get('rsp_dir', 0)),
+        str(get('ref_ent_name', 'NONE'))[:10], int(get('ref_node', 0)), int(get('ref_dir', 0))))
+    x_min = x[0] if spacing and len(x) else 0.0
+    x_inc = (x[-1] - x[0]) / (len(x) - 1) if spacing and len(x) > 1 else 0.0
+    lines.append('%10i%10i%10i%13.5e%13.5e%13.5e' % (ord_data_type, len(x), spacing, x_min, x_inc,
+                                                     float(get('z_axis_value', 0.0))))
+    for prefix in _AXIS_RECORD_PREFIXES:
+        lines.append('%10i%5i%5i%5i %-20s %-20s' % (
+            int(get(f'{prefix}_spec_data_type', 0)), int(get(f'{prefix}_len_unit_exp', 0)),
+            int(get(f'{prefix}_force_unit_exp', 0)), int(get(f'{prefix}_temp_unit_exp', 0)),
+            str(get(f'{prefix}_axis_lab', 'NONE'))[:20], str(get(f'{prefix}_axis_units_lab', 'NONE'))[:20]))
+    return ('\n'.join(lines) + '\n').encode('ascii', errors='replace')
+
+
+def write_unv58(filepath, records, binary=False):
+    """Writes records as dataset 58 (ASCII) or 58b (binary) to a new .unv file; see dump_unv58()."""
+    with open(filepath, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+        dump_unv58(f, records, binary)
+
+
+def dump_unv58(f, records, binary=False):
+    """
+    Writes records as dataset 58 (ASCII) or 58b (binary, little-endian) to the binary file object f.
+
+    Records are dicts like those of read_unv_record(): 'x' and 'data' (real,
+    complex or two-column) arrays and the header fields, which default to
+    0/'NONE' when missing. Single precision records (ord_data_type 2 or 5)
+    are written in single precision, everything else in double precision.
+    Records without 'abscissa_spacing' are written with even spacing if
+    their abscissa is evenly spaced. records may be any iterable, e.g. a
+    generator producing them one at a time.
+    """
+    for record in records:
+        x, values, ord_data_type, spacing = _record_values(record)
+        if binary:
+            item = '<f4' if ord_data_type in (2, 5) else '<f8'
+            f.write(_header_58(record, x, ord_data_type, spacing, n_bytes=len(values) * np.dtype(item).itemsize))
+            f.write(values.astype(item).tobytes())
+        else:
+            f.write(_header_58(record, x, ord_data_type, spacing))
+            widths = _ascii_field_widths(ord_data_type, spacing)
+            chunk = WRITE_CHUNK_LINES * len(widths)
+            for start in range(0, len(values), chunk):
+                f.write(_format_ascii(values[start:start + chunk], widths))
+        f.write(DELIMITER + b'\n')
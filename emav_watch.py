@@ -0,0 +1,63 @@
+# EMAV - Watching a growing .unv file
+# During a test campaign Testlab keeps appending datasets to the .unv export
+# being viewed. A FileWatcher polls the size and modification time of the
+# file and tells whether it has grown, so that only the datasets after the
+# last one indexed need to be scanned (see emav_unv.iter_unv_index), or was
+# rewritten, which needs a full reload. No GUI imports.
+import os
+
+# Bytes in front of the scan position compared on every change, to tell an append from a rewrite
+TAIL_CHECK_BYTES = 4096
+
+GROWN = 'grown'
+REPLACED = 'replaced'
+
+
+class FileWatcher:
+    """
+    Size, modification time and scan position of a watched .unv file.
+
+    offset is where the next scan resumes: the 'end_offset' of the last
+    complete dataset indexed. A dataset still being written when the file was
+    scanned is left out, and scanned again in full once the file grows.
+    """
+    def __init__(self, path, offset):
+        self.path = path
+        # Anything past offset is new to us, whatever the file size is now
+        self.size = offset
+        self.mtime_ns = None
+        self.advance(offset)
+
+    def advance(self, offset):
+        """Moves the scan position to offset, after the datasets just indexed."""
+        self.offset = offset
+        self.tail = self._read_tail()
+
+    def check(self):
+        """
+        Returns GROWN when the file has grown since the last check, REPLACED
+        when it was truncated or the bytes in front of the scan position
+        changed, otherwise None.
+
+        A file that cannot be read (e.g. while Testlab replaces it) counts as
+        unchanged until the next check.
+        """
+        try:
+            stat = os.stat(self.path)
+            if (stat.st_size, stat.st_mtime_ns) == (self.size, self.mtime_ns):
+                return None
+            if stat.st_size < self.offset or self._read_tail() != self.tail:
+                return REPLACED
+        except OSError:
+            return None
+        grown = stat.st_size > self.size
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        return GROWN if grown else None
+
+    def _read_tail(self):
+        """The TAIL_CHECK_BYTES of the file in front of offset."""
+        start = max(self.offset - TAIL_CHECK_BYTES, 0)
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(self.offset - start)
@@ -0,0 +1,49 @@
+# EMAV - Best-match scoring tests
+import numpy as np
+import emav_match
+
+
+def resonant_frf(x, modes=(120.0, 340.0, 710.0), damping=0.01):
+    return sum(1 / np.abs(f ** 2 - x ** 2 + 2j * damping * f * x) for f in modes)
+
+
+def make_index(x, ref, noise_levels, n_others=200, seed=0):
+    """A MatchIndex with ref plus relative noise as records 0, 1, ... and unrelated records after them."""
+    rng = np.random.default_rng(seed)
+    index = emav_match.MatchIndex()
+    records = {}
+    for key, level in enumerate(noise_levels):
+        records[key] = ref * (1 + level * rng.standard_normal(len(x)))
+        index.add(key, x, records[key])
+    for key in range(len(noise_levels), len(noise_levels) + n_others):
+        records[key] = resonant_frf(x, modes=rng.uniform(50, 950, 3)) * rng.uniform(0.5, 2.0)
+        index.add(key, x, records[key])
+    return index.finalize(), records
+
+
+def direct_scores(x, ref, y):
+    """FRAC and log-RMS of one record, straight from their definitions."""
+    mag = np.abs(y).astype(np.float32).astype(np.float64)
+    frac = (mag @ ref) ** 2 / ((mag @ mag) * (ref @ ref))
+    log_mag = np.log10(np.maximum(mag.astype(np.float32), emav_match.LOG_FLOOR)).astype(np.float64)
+    log_rms = np.sqrt(np.mean((log_mag - np.log10(ref)) ** 2))
+    return frac, log_rms
+
+
+def test_pruned_and_full_scores_match_direct_calculation():
+    x = np.linspace(1.0, 1000.0, 2048)
+    ref = resonant_frf(x)
+    index, records = make_index(x, ref, noise_levels=(0.0, 1e-3, 1e-2, 1e-1))
+    pruned = index.best_matches(x, ref, top_n=4, metric='log_rms')
+    full = index.best_matches(x, ref, top_n=4, metric='log_rms', prune=False)
+
+    assert [key for key, _, _ in pruned] == [0, 1, 2, 3]
+    assert [key for key, _, _ in full] == [0, 1, 2, 3]
+    for (key, frac, log_rms), (_, full_frac, full_log_rms) in zip(pruned, full):
+        expected_frac, expected_log_rms = direct_scores(x, ref, records[key])
+        assert np.isclose(log_rms, expected_log_rms, rtol=1e-6, atol=1e-9)
+        assert np.isclose(full_log_rms, expected_log_rms, rtol=1e-6, atol=1e-9)
+        assert np.isclose(frac, expected_frac, rtol=1e-12)
+        assert np.isclose(full_frac, expected_frac, rtol=1e-12)
+    # 0.1 % noise on the magnitude is about 4.3e-4 in log10, not zero
+    assert 3e-4 < pruned[1][2] < 6e-4
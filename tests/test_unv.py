@@ -0,0 +1,147 @@
+# EMAV - Universal file reader and writer tests
+import io
+import numpy as np
+import pytest
+import emav_unv
+
+HEADER_151 = (b"    -1\n   151\nModel\nDescription\nEMAV tests\n01-Jan-24 00:00:00\n"
+              b"01-Jan-24 00:00:00\nEMAV tests\n01-Jan-24 00:00:00\n    -1\n")
+UNITS_164 = (b"    -1\n   164\n         1  SI - mks (Newton)        2\n"
+             b"  1.00000000000000000D+00  1.00000000000000000D+00  1.00000000000000000D+00\n"
+             b"  2.73149999999999977D+02\n    -1\n")
+NODES_2411 = (b"    -1\n  2411\n         1         1         1        11\n"
+              b"   0.0000000000000000D+00   1.0000000000000000D+00  -1.0000000000000000D+00\n    -1\n")
+
+
+def frf_record(n_points, name='FRF', ord_data_type=6, **fields):
+    """A dataset 58 record with an even abscissa and complex (or real, for types 2 and 4) values."""
+    x = np.arange(n_points) * 0.5
+    data = np.cos(x) + 1j * np.sin(2 * x) if ord_data_type in (5, 6) else np.cos(x) + 2.0
+    return dict({'id1': name, 'x': x, 'data': data, 'ord_data_type': ord_data_type, 'abscissa_spacing': 1}, **fields)
+
+
+def dump(records, binary=False):
+    """The bytes dump_unv58() writes for records."""
+    f = io.BytesIO()
+    emav_unv.dump_unv58(f, records, binary)
+    return f.getvalue()
+
+
+def write(tmp_path, content, name='test.unv'):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def assert_same_record(record, expected, rtol):
+    np.testing.assert_allclose(record['x'], expected['x'], rtol=rtol, atol=1e-12)
+    np.testing.assert_allclose(record['data'], expected['data'], rtol=rtol, atol=1e-12)
+
+
+@pytest.mark.parametrize('eol', [b'\n', b'\r\n'])
+def test_reads_80_column_space_padded_lines(tmp_path, eol):
+    """Writers that pad every line to 80 columns, including the delimiters and the numeric block."""
+    expected = [frf_record(9, 'single', ord_data_type=5), frf_record(5, 'double', ord_data_type=6)]
+    lines = dump(expected).split(b'\n')[:-1]
+    padded = eol.join(line.ljust(80) for line in lines) + eol
+    path = write(tmp_path, padded)
+
+    records = emav_unv.read_unv58(path)
+    assert [record['id1'] for record in records] == ['single', 'double']
+    assert_same_record(records[0], expected[0], rtol=1e-5)
+    assert_same_record(records[1], expected[1], rtol=1e-11)
+    index = emav_unv.scan_unv(path)
+    assert_same_record(emav_unv.read_unv_record(path, index[1]), expected[1], rtol=1e-11)
+
+
+@pytest.mark.parametrize('n_points, ord_data_type', [(7, 2), (7, 5), (3, 4), (5, 6)])
+def test_reads_short_last_line(tmp_path, n_points, ord_data_type):
+    """The last line of a numeric block holds fewer values than a full line, with or without a trailing blank."""
+    expected = frf_record(n_points, ord_data_type=ord_data_type)
+    content = dump([expected])
+    last_line = content.rstrip(b'\n').split(b'\n')[-2]
+    assert len(last_line) < 78
+    rtol = 1e-5 if ord_data_type in (2, 5) else 1e-11
+    for variant in (content, content.replace(last_line + b'\n', last_line + b'   \n')):
+        record, = emav_unv.read_unv58(write(tmp_path, variant))
+        assert_same_record(record, expected, rtol)
+
+
+def test_resynchronises_after_other_datasets(tmp_path):
+    """Datasets of other types, stray text and a block that is not a dataset are skipped."""
+    first, second, third = (frf_record(6, name) for name in ('first', 'second', 'third'))
+    content = (HEADER_151 + dump([first]) + UNITS_164 + b"stray text between datasets\n" + NODES_2411
+               + dump([second]) + b"    -1\nnot a dataset\n    -1\n" + dump([third]))
+    path = write(tmp_path, content)
+
+    index = emav_unv.scan_unv(path)
+    assert [dataset['type'] for dataset in index] == [151, 58, 164, 2411, 58, 58]
+    assert [dataset['id1'] for dataset in index if dataset['type'] == 58] == ['first', 'second', 'third']
+    assert index[-1]['end_offset'] == len(content)
+    records = emav_unv.read_unv58(path)
+    assert [record['id1'] for record in records] == ['first', 'second', 'third']
+    for record, expected in zip(records, (first, second, third)):
+        assert_same_record(record, expected, rtol=1e-11)
+
+
+def test_resumes_scan_at_an_end_offset(tmp_path):
+    """iter_unv_index(start=...) yields only the datasets after an indexed one, as watch mode uses it."""
+    content = HEADER_151 + dump([frf_record(4, 'first'), frf_record(4, 'second')])
+    path = write(tmp_path, content)
+    index = emav_unv.scan_unv(path)
+    resumed = list(emav_unv.iter_unv_index(path, index[1]['end_offset']))
+    assert [dataset['id1'] for dataset in resumed] == ['second']
+    assert resumed[0]['offset'] == index[2]['offset']
+
+
+@pytest.mark.parametrize('binary', [False, True], ids=['ascii', 'binary'])
+@pytest.mark.parametrize('even', [True, False], ids=['even', 'uneven'])
+@pytest.mark.parametrize('is_complex', [True, False], ids=['complex', 'real'])
+@pytest.mark.parametrize('single', [True, False], ids=['single', 'double'])
+def test_write_index_read_round_trip(tmp_path, binary, even, is_complex, single):
+    rng = np.random.default_rng(0)
+    n_points = 101
+    # Abscissas with at most 6 significant digits, which E13.5 holds exactly
+    x = np.arange(n_points) * 0.25 if even else np.round(np.geomspace(1.0, 1000.0, n_points), 2)
+    data = rng.standard_normal(n_points)
+    if is_complex:
+        data = data + 1j * rng.standard_normal(n_points)
+    ord_data_type = {(True, True): 5, (True, False): 2, (False, True): 6, (False, False): 4}[single, is_complex]
+    expected = [{'id1': f'Record {i}', 'func_type': 4, 'rsp_node': 10 + i, 'rsp_dir': 3, 'ref_node': 1, 'ref_dir': -3,
+                 'ord_data_type': ord_data_type, 'abscissa_axis_units_lab': 'Hz', 'x': x, 'data': data * (i + 1)}
+                for i in range(3)]
+    path = str(tmp_path / 'round_trip.unv')
+    emav_unv.write_unv58(path, expected, binary=binary)
+
+    index = emav_unv.scan_unv(path)
+    assert len(index) == 3
+    if single:
+        # E13.5 keeps 6 significant digits; float32 about 7
+        rtol = 1e-7 if binary else 5e-6
+    else:
+        rtol = 0.0 if binary else 1e-12
+    for dataset, record in zip(index, expected):
+        assert dataset['type'] == 58
+        assert dataset['binary'] == int(binary)
+        assert (dataset['ord_data_type'], dataset['num_pts'], dataset['abscissa_spacing']) == (ord_data_type, n_points, int(even))
+        assert (dataset['id1'], dataset['rsp_node'], dataset['ref_dir']) == (record['id1'], record['rsp_node'], -3)
+        assert dataset['abscissa_axis_units_lab'] == 'Hz'
+        read = emav_unv.read_unv_record(path, dataset)
+        assert np.iscomplexobj(read['data']) == is_complex
+        # Uneven abscissas are stored like the values, so in float32 in a single precision 58b
+        np.testing.assert_allclose(read['x'], x, rtol=1e-7 if single and binary and not even else 1e-12)
+        scale = np.abs(record['data'])
+        np.testing.assert_array_less(np.abs(read['data'] - record['data']), rtol * scale + 1e-300)
+    for streamed, dataset in zip(emav_unv.read_unv58(path), index):
+        np.testing.assert_array_equal(streamed['data'], emav_unv.read_unv_record(path, dataset)['data'])
+
+
+def test_ascii_values_match_printf(tmp_path):
+    """The numeric block is formatted exactly as Fortran E20.12 / E13.5, i.e. printf %E."""
+    values = np.array([0.0, -0.0, 1.0, -1.5e-300, 9.999999999999e99, 123456.7891234, -7.25e-5, 5e-324, 1e308])
+    x = np.round(np.linspace(0.0, 8.0, len(values)) ** 2, 3)
+    content = dump([{'x': x, 'data': values, 'ord_data_type': 4, 'abscissa_spacing': 0}])
+    block = content.split(b'\n')[13:-2]
+    expected = ''.join('%13.5E%20.12E' % pair for pair in zip(x, values))
+    assert b''.join(block).decode() == expected
+    assert all(len(line) == 66 for line in block[:-1])